@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+DESCRIPTION = """\
+Benchmark of the ASR evaluation path of eval_model.py.
+
+We run a fixed subset of an ATC test set (Kaldi format) or synthetic audio with
+controlled durations through:
+    - feature extraction (processor),
+    - acoustic model (Wav2Vec 2.0 / XLS-R forward pass),
+    - greedy decoding,
+    - beam search decoding with pyctcdecode (+ KenLM, if given).
+
+For each configuration we report the realtime factor (RTF), the latency
+percentiles of each stage and the peak memory. The output is a JSON file
+that can be diff'ed between commits.
+
+If no model is given, we use a tiny randomly initialised Wav2Vec 2.0 model,
+so the benchmark runs offline and on CPU.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from transformers import (
+    AutoModelForCTC,
+    AutoProcessor,
+    Wav2Vec2Config,
+    Wav2Vec2CTCTokenizer,
+    Wav2Vec2FeatureExtractor,
+    Wav2Vec2ForCTC,
+    Wav2Vec2Processor,
+)
+
+from eval_model import get_beam_search_processor
+
+# Our models work with audio data at 16kHZ,
+SAMPLING_RATE = 16000
+
+# stages of the evaluation path, in order
+STAGES = ["feature_extraction", "acoustic_model", "decoding"]
+
+# percentiles reported per stage
+PERCENTILES = [50, 90, 99]
+
+
+def build_tiny_model(output_dir, seed=1234):
+    """Create a small randomly initialised Wav2Vec 2.0 model with a
+    character vocabulary similar to our ATC models. The model and processor
+    are stored in output_dir, so they can be loaded as a normal checkpoint.
+    """
+    torch.manual_seed(seed)
+
+    # vocabulary: '|' is the word delimiter, [PAD] is the CTC blank
+    chars = list("abcdefghijklmnopqrstuvwxyz'")
+    vocab = {char: idx for idx, char in enumerate(chars)}
+    vocab["|"] = len(vocab)
+    vocab["[UNK]"] = len(vocab)
+    vocab["[PAD]"] = len(vocab)
+    with open(os.path.join(output_dir, "vocab.json"), "w") as vocab_f:
+        json.dump(vocab, vocab_f)
+
+    tokenizer = Wav2Vec2CTCTokenizer(
+        os.path.join(output_dir, "vocab.json"),
+        unk_token="[UNK]",
+        pad_token="[PAD]",
+        word_delimiter_token="|",
+    )
+    feature_extractor = Wav2Vec2FeatureExtractor(
+        feature_size=1,
+        sampling_rate=SAMPLING_RATE,
+        padding_value=0.0,
+        do_normalize=True,
+        return_attention_mask=False,
+    )
+    processor = Wav2Vec2Processor(
+        feature_extractor=feature_extractor, tokenizer=tokenizer
+    )
+
+    # same CNN feature encoder (20ms frames) as the real models, but tiny
+    # len(tokenizer) also counts <s> and </s>, as in run_speech_recognition_ctc.py
+    config = Wav2Vec2Config(
+        vocab_size=len(tokenizer),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        conv_dim=(32, 32, 32, 32, 32, 32, 32),
+        num_conv_pos_embeddings=16,
+        num_conv_pos_embedding_groups=2,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    model = Wav2Vec2ForCTC(config)
+
+    processor.save_pretrained(output_dir)
+    model.save_pretrained(output_dir)
+    return output_dir
+
+
+def load_test_subset(data_loader, path_test_set, max_utts):
+    """Fixed subset (first max_utts utterances) of a test set in Kaldi format.
+    Returns a list of (utt_id, audio_array)"""
+    from datasets import load_dataset
+
+    test_dataset = load_dataset(
+        data_loader,
+        "test",
+        data_dir=path_test_set,
+        split="test",
+        cache_dir=f".cache/eval/{path_test_set}",
+    )
+    test_dataset = test_dataset.select(range(min(max_utts, len(test_dataset))))
+
+    return [
+        (sample["id"], np.asarray(sample["audio"]["array"], dtype=np.float32))
+        for sample in test_dataset
+    ]
+
+
+def synthetic_audio(durations, utts_per_duration, seed=1234):
+    """Noise-like audio with controlled durations (in seconds).
+    Returns a list of (utt_id, audio_array)"""
+    rng = np.random.default_rng(seed)
+    samples = []
+    for duration in durations:
+        for idx in range(utts_per_duration):
+            audio = 0.1 * rng.standard_normal(int(duration * SAMPLING_RATE))
+            samples.append((f"synthetic-{duration}s-{idx}", audio.astype(np.float32)))
+    return samples
+
+
+def get_peak_memory_mb(device):
+    """Peak memory of the process (RSS), and of the GPU if used.
+    Note that the RSS is the high-water mark of the process, i.e., configurations
+    run later include the memory of the previous ones (model, decoders)
+    """
+    memory = {"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    if device.type == "cuda":
+        memory["peak_cuda_mb"] = torch.cuda.max_memory_allocated(device) / 1024**2
+    return memory
+
+
+def summarize_latencies(latencies):
+    """Mean and percentiles (in ms) of a list of latencies in seconds"""
+    latencies = 1000 * np.asarray(latencies)
+    summary = {"mean_ms": float(latencies.mean()), "total_ms": float(latencies.sum())}
+    for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+        summary[f"p{percentile}_ms"] = float(value)
+    return summary
+
+
+def run_configuration(name, decode_fn, samples, processor, model, device, warmup=2):
+    """Run all the samples through the evaluation path with the decoder 'decode_fn'"""
+
+    def forward(audio):
+        """one utterance, returns the latency of each stage"""
+        latency = []
+
+        t_start = time.perf_counter()
+        input_values = processor(
+            audio, sampling_rate=SAMPLING_RATE, return_tensors="pt"
+        ).input_values.to(device)
+        latency.append(time.perf_counter() - t_start)
+
+        t_start = time.perf_counter()
+        with torch.no_grad():
+            logits = model(input_values).logits
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        latency.append(time.perf_counter() - t_start)
+
+        t_start = time.perf_counter()
+        decode_fn(logits)
+        latency.append(time.perf_counter() - t_start)
+
+        return latency
+
+    # warm up, not accounted in the results
+    for _, audio in samples[:warmup]:
+        forward(audio)
+
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+
+    latencies = np.array([forward(audio) for _, audio in samples])
+    audio_duration = sum(len(audio) for _, audio in samples) / SAMPLING_RATE
+
+    result = {
+        "num_utts": len(samples),
+        "audio_duration_s": audio_duration,
+        "rtf": float(latencies.sum() / audio_duration),
+        "stages": {
+            stage: summarize_latencies(latencies[:, idx])
+            for idx, stage in enumerate(STAGES)
+        },
+    }
+    result["stages"]["total"] = summarize_latencies(latencies.sum(axis=1))
+    result.update(get_peak_memory_mb(device))
+
+    print(
+        f"{name:<25} RTF: {result['rtf']:.4f} \t"
+        f"p90 total: {result['stages']['total']['p90_ms']:.1f} ms \t"
+        f"peak RSS: {result['peak_rss_mb']:.0f} MB"
+    )
+    return result
+
+
+def get_git_commit():
+    """commit of the repository, useful when comparing JSON files"""
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (subprocess.CalledProcessError, OSError):
+        return "unknown"
+
+
+def parse_args():
+    """parser"""
+    parser = argparse.ArgumentParser(
+        description=DESCRIPTION, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--w2v2",
+        "--pretrained-model",
+        dest="path_model",
+        default=None,
+        help="Directory with a fine-tuned model. If not given, we use a tiny random model.",
+    )
+    parser.add_argument(
+        "--lm",
+        "--language-model",
+        dest="path_lm",
+        default=None,
+        help="KenLM binary used in beam search. If not given, beam search is done without LM.",
+    )
+    parser.add_argument(
+        "--test-set",
+        dest="test_set",
+        default=None,
+        help="Directory with a test set in Kaldi format. If not given, we use synthetic audio.",
+    )
+    parser.add_argument(
+        "--dl",
+        "--data-loader-file",
+        dest="data_loader",
+        default="asr_e2e/atc_data_loader.py",
+        help="Data loader file, used only with --test-set",
+    )
+    parser.add_argument(
+        "--max-utts",
+        type=int,
+        default=50,
+        help="Number of utterances of the test set to benchmark (the first ones)",
+    )
+    parser.add_argument(
+        "--durations",
+        default="1 2 5 10",
+        help="Durations (in seconds) of the synthetic audio, separated by spaces",
+    )
+    parser.add_argument(
+        "--utts-per-duration",
+        type=int,
+        default=5,
+        help="Number of synthetic utterances per each duration",
+    )
+    parser.add_argument(
+        "--beam-widths",
+        default="10 100",
+        help="Beam widths of pyctcdecode to benchmark, separated by spaces",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=1, help="Number of CPU threads for PyTorch"
+    )
+    parser.add_argument(
+        "--device", default="cpu", help="Device to run the acoustic model, cpu or cuda"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=2, help="Number of utterances used to warm up"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=1234, help="Seed for the tiny model"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="JSON file where to write the results. Otherwise printed to stdout",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Main code execution"""
+    args = parse_args()
+
+    torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+
+    # model, either a fine-tuned checkpoint or a tiny random one
+    tmp_dir = None
+    path_model = args.path_model
+    if path_model is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        path_model = build_tiny_model(tmp_dir.name, seed=args.seed)
+        print("*** Using a tiny randomly initialised model ***")
+
+    processor = AutoProcessor.from_pretrained(path_model)
+    model = AutoModelForCTC.from_pretrained(path_model).to(device).eval()
+
+    # audio: fixed subset of a test set or synthetic audio
+    if args.test_set is not None:
+        samples = load_test_subset(args.data_loader, args.test_set, args.max_utts)
+        audio_source = args.test_set
+    else:
+        durations = [float(x) for x in args.durations.split()]
+        samples = synthetic_audio(durations, args.utts_per_duration, seed=args.seed)
+        audio_source = f"synthetic {durations}s x {args.utts_per_duration}"
+    print(f"*** Benchmarking {len(samples)} utterances from: {audio_source} ***")
+
+    # decoders to benchmark, greedy and beam search (with/without LM)
+    def greedy_decoding(logits):
+        return processor.batch_decode(torch.argmax(logits, dim=-1))[0]
+
+    configurations = {"greedy": greedy_decoding}
+    processor_beam = get_beam_search_processor(processor, path_model, args.path_lm)
+    lm_tag = "kenlm" if args.path_lm is not None else "nolm"
+    for beam_width in [int(x) for x in args.beam_widths.split()]:
+
+        # the decoder is called directly, batch_decode would start (and time) a
+        # new multiprocessing pool on each call
+        def beam_decoding(logits, beam_width=beam_width):
+            return processor_beam.decoder.decode(
+                logits[0].cpu().numpy(), beam_width=beam_width
+            )
+
+        configurations[f"beam{beam_width}_{lm_tag}"] = beam_decoding
+
+    results = {
+        "meta": {
+            "commit": get_git_commit(),
+            "model": args.path_model or "tiny-random",
+            "lm": args.path_lm,
+            "audio": audio_source,
+            "device": str(device),
+            "threads": args.threads,
+            "torch": torch.__version__,
+            "python": sys.version.split()[0],
+        },
+        "configurations": {},
+    }
+    for name, decode_fn in configurations.items():
+        results["configurations"][name] = run_configuration(
+            name, decode_fn, samples, processor, model, device, warmup=args.warmup
+        )
+
+    if args.output is not None:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as out_f:
+            json.dump(results, out_f, indent=2, sort_keys=True)
+        print(f"Done! results in {args.output}")
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
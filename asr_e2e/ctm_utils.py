@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+"""\
+Utils to get word timings and word confidences from the CTC output of the models.
+
+The word timings come from the frame offsets given by the greedy decoder
+(HuggingFace tokenizer) or by the beam search decoder (pyctcdecode). The word
+confidence is the mean of the frame-level posteriors of the best token, over the
+non-blank frames of the word.
+
+The output is in CTM format, one word per line:
+    <utt_id> <channel> <t_beg> <duration> <word> <confidence>
+which can be read by data/databases/atco2_pl_set/local/get_cnet_score.py
+"""
+
+import numpy as np
+
+
+def frame_posteriors(logits):
+    """Softmax over the vocabulary, logits is a numpy array (frames, vocab)"""
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    posteriors = np.exp(logits)
+    posteriors /= posteriors.sum(axis=-1, keepdims=True)
+    return posteriors
+
+
+def word_confidences(posteriors, word_offsets, blank_id):
+    """Confidence of each word, given the frame posteriors and the word offsets
+    (list of dicts with 'start_offset' and 'end_offset', in frames).
+    We compute all the words at once with cumulative sums over the frames.
+    """
+    if len(word_offsets) == 0:
+        return np.zeros(0)
+
+    best_token = posteriors.argmax(axis=-1)
+    best_posterior = posteriors.max(axis=-1)
+    non_blank = best_token != blank_id
+
+    # cumulative sums, with a leading 0, to get the sum over [start, end)
+    cum_post = np.concatenate(([0.0], np.cumsum(best_posterior * non_blank)))
+    cum_count = np.concatenate(([0], np.cumsum(non_blank)))
+    cum_all = np.concatenate(([0.0], np.cumsum(best_posterior)))
+
+    num_frames = len(best_posterior)
+    starts = np.array([x["start_offset"] for x in word_offsets]).clip(0, num_frames - 1)
+    ends = np.array([x["end_offset"] for x in word_offsets]).clip(0, num_frames)
+    ends = np.maximum(ends, starts + 1)
+
+    sum_post = cum_post[ends] - cum_post[starts]
+    count = cum_count[ends] - cum_count[starts]
+    # words without non-blank frames, use the mean over all the frames
+    mean_all = (cum_all[ends] - cum_all[starts]) / (ends - starts)
+
+    return np.where(count > 0, sum_post / np.maximum(count, 1), mean_all)
+
+
+def get_ctm_lines(utt_id, word_offsets, logits, blank_id, time_offset, channel="1"):
+    """CTM lines of one utterance.
+    Inputs:
+        - utt_id: utterance id (first column of the CTM)
+        - word_offsets: list of dicts with 'word', 'start_offset' and 'end_offset'
+        - logits: numpy array (frames, vocab) of the utterance
+        - blank_id: id of the CTC blank (pad token)
+        - time_offset: duration of one frame in seconds, e.g., 320 / 16000 = 0.02
+    """
+    confidences = word_confidences(frame_posteriors(logits), word_offsets, blank_id)
+
+    lines = []
+    for word, confidence in zip(word_offsets, confidences):
+        t_beg = word["start_offset"] * time_offset
+        duration = max(word["end_offset"] - word["start_offset"], 1) * time_offset
+        lines.append(
+            f"{utt_id} {channel} {t_beg:.2f} {duration:.2f} {word['word']} {confidence:.4f}\n"
+        )
+    return lines
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+DESCRIPTION = """\
+Local decode server for eval_model.py.
+
+It loads the processor, the Wav2Vec 2.0 / XLS-R model, the KenLM binary and the
+pyctcdecode decoder only once, and keeps them in memory. Then, eval_model.py can
+send test sets to evaluate through a Unix socket (--server-socket), thus, the
+start-up cost is not paid on each run.
+
+The protocol is one JSON object per line, e.g.:
+    {"command": "evaluate", "test_set": "/abs/path/to/kaldi/dir", "print_output": true,
+     "w2v2": "/path/to/model", "lm": "/path/to/lm.binary"}
+    {"command": "ping"}
+    {"command": "shutdown"}
+and the server answers with one JSON object per line: {"status": "ok"/"error", ...}
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from pathlib import Path
+
+import torch
+
+from eval_model import evaluate_test_set, get_kenlm_processor
+
+
+class DecodeRequestHandler(socketserver.StreamRequestHandler):
+    """Reads one JSON request per line and writes back one JSON response per line"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.process(json.loads(line))
+            except Exception as error:
+                traceback.print_exc()
+                response = {"status": "error", "message": repr(error)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class DecodeServer(socketserver.UnixStreamServer):
+    """Unix socket server that keeps the models and the decoder resident.
+    Requests are processed one at a time (one model, maybe one GPU).
+    """
+
+    def __init__(self, socket_path, path_model, path_lm=None):
+        self.path_model = path_model
+        self.path_lm = path_lm
+
+        print("*** Loading the Wav2Vec 2.0 model, loading... ***")
+        (
+            self.processor,
+            self.processor_ctc_kenlm,
+            self.model,
+        ) = get_kenlm_processor(path_model, path_lm)
+        if torch.cuda.is_available():
+            self.model.to("cuda")
+
+        # remove a socket left by a previous server
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, DecodeRequestHandler)
+        print(f"*** Decode server listening in: {socket_path} ***")
+
+    def same_path(self, path_a, path_b):
+        """compare model/LM paths given by the client and the server"""
+        if path_a is None or path_b is None:
+            return path_a == path_b
+        return os.path.realpath(path_a) == os.path.realpath(path_b)
+
+    def process(self, request):
+        """Process one request and return the response"""
+        command = request.get("command", "evaluate")
+
+        if command == "ping":
+            return {"status": "ok", "w2v2": self.path_model, "lm": self.path_lm}
+
+        if command == "shutdown":
+            # shutdown() blocks until serve_forever() returns, call it from another thread
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"status": "ok"}
+
+        if command != "evaluate":
+            return {"status": "error", "message": f"Unknown command: {command}"}
+
+        # the client must ask for the models loaded in the server
+        if not self.same_path(request.get("w2v2", self.path_model), self.path_model):
+            return {
+                "status": "error",
+                "message": f"Server has model {self.path_model}, not {request['w2v2']}",
+            }
+        if not self.same_path(request.get("lm", self.path_lm), self.path_lm):
+            return {
+                "status": "error",
+                "message": f"Server has LM {self.path_lm}, not {request['lm']}",
+            }
+
+        results = evaluate_test_set(
+            request["test_set"],
+            self.processor,
+            self.processor_ctc_kenlm,
+            self.model,
+            self.path_model,
+            path_lm=self.path_lm,
+            data_loader=request.get("data_loader", "src/atc_data_loader.py"),
+            print_output=request.get("print_output", False),
+            nbest=request.get("nbest", 0),
+            hotword_weight=request.get("hotword_weight"),
+            expansion_level=request.get("expansion_level", "standard"),
+        )
+        return {"status": "ok", "test_set": request["test_set"], "results": results}
+
+
+def send_request(socket_path, request):
+    """Send one request to the decode server and wait for the response"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        with client.makefile("r", encoding="utf-8") as rd:
+            response = json.loads(rd.readline())
+
+    if response["status"] != "ok":
+        raise RuntimeError(f"Decode server error: {response['message']}")
+    return response
+
+
+def request_evaluation(
+    socket_path,
+    path_test_set,
+    path_model=None,
+    path_lm=None,
+    data_loader="src/atc_data_loader.py",
+    print_output=False,
+    nbest=0,
+    hotword_weight=None,
+    expansion_level="standard",
+):
+    """Ask the decode server to evaluate one test set, returns the WER/CER metrics.
+    Paths are sent as absolute paths, the server might run in another folder
+    """
+    abspath = lambda x: os.path.abspath(x) if x is not None else None
+
+    request = {
+        "command": "evaluate",
+        "test_set": abspath(path_test_set),
+        "w2v2": abspath(path_model),
+        "lm": abspath(path_lm),
+        "data_loader": abspath(data_loader),
+        "print_output": print_output,
+        "nbest": nbest,
+        "hotword_weight": hotword_weight,
+        "expansion_level": expansion_level,
+    }
+    return send_request(socket_path, request)["results"]
+
+
+def parse_args():
+    """parser"""
+    parser = argparse.ArgumentParser(
+        description=DESCRIPTION, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--lm",
+        "--language-model",
+        dest="path_lm",
+        default=None,
+        help="Directory with an in-domain LM. Needs to match the symbol table",
+    )
+    parser.add_argument(
+        "--shutdown",
+        action="store_true",
+        help="Stop a running server listening in --socket and exit",
+    )
+    parser.add_argument(
+        "--w2v2",
+        "--pretrained-model",
+        dest="path_model",
+        default=None,
+        help="Directory with pre-trained Wav2Vec 2.0 model (or XLS-R-300m).",
+    )
+
+    # must give,
+    parser.add_argument(
+        "--socket",
+        dest="socket_path",
+        required=True,
+        help="Path of the Unix socket where the server listens, e.g., /tmp/eval_model.sock",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Main code execution"""
+    args = parse_args()
+
+    if args.shutdown:
+        send_request(args.socket_path, {"command": "shutdown"})
+        print(f"Decode server in {args.socket_path} was stopped")
+        return
+
+    if args.path_model is None:
+        print("You need to pass a model with --w2v2 to start the server")
+        sys.exit(1)
+    if args.path_lm is not None and not Path(args.path_lm).is_file():
+        print(f"You pass a path to LM ({args.path_lm}), but file does not exists")
+        sys.exit(1)
+
+    path_lm = os.path.abspath(args.path_lm) if args.path_lm is not None else None
+    server = DecodeServer(args.socket_path, os.path.abspath(args.path_model), path_lm)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket_path):
+            os.remove(args.socket_path)
+    print("Done! decode server stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,9 @@
 DESCRIPTION = """\
 Script for evaluating a Wav2Vec 2.0 / XLS-R model from Huggingface. 
 We eval by greedy decoding and shallow fusion of 4-gram LM.
+WER and CER are accumulated while decoding (see wer_utils.py), with
+breakdowns per speaker role and airport. We also write the word timings
+and confidences of the hypotheses in CTM format (see ctm_utils.py).
 
 We need to:
     - Define a train and test dataset (or several). 
@@ -19,14 +22,15 @@ We need to:
 """
 
 import argparse
+import json
 import os
 import sys
 from pathlib import Path
 
-import evaluate
 import torch
 from datasets import load_dataset
 from pyctcdecode import build_ctcdecoder
+from tqdm import tqdm
 from transformers import (
     AutoModelForCTC,
     AutoProcessor,
@@ -34,6 +38,11 @@ from transformers import (
     Wav2Vec2ProcessorWithLM,
 )
 
+from ctm_utils import get_ctm_lines
+from hotword_utils import CallsignHotwords
+from nbest_utils import beams_to_nbest
+from wer_utils import ErrorRateAccumulator, get_utt_groups, load_utt2info
+
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
@@ -51,7 +60,17 @@ def get_kenlm_processor(model_path, path_lm=None):
 
     # In case we don't pass any language model path, we just send back the model and processor
     if path_lm is None:
-        return processor, None, None, model
+        return processor, None, model
+
+    processor_ctc_kenlm = get_beam_search_processor(processor, path_tokenizer, path_lm)
+
+    return processor, processor_ctc_kenlm, model
+
+
+def get_beam_search_processor(processor, path_tokenizer, path_lm=None):
+    """Build the HuggingFace processor with a pyctcdecode beam search decoder.
+    If path_lm is None, we perform beam search without LM
+    """
 
     vocab = processor.tokenizer.convert_ids_to_tokens(
         range(0, processor.tokenizer.vocab_size)
@@ -80,7 +99,7 @@ def get_kenlm_processor(model_path, path_lm=None):
         decoder=ctcdecoder_kenlm,
     )
 
-    return processor, processor_ctc_kenlm, model
+    return processor_ctc_kenlm
 
 
 def parse_args():
@@ -111,6 +130,35 @@ def parse_args():
         default=False,
         help="whether to print the output into the models' fodler.",
     )
+    parser.add_argument(
+        "--hotword-weight",
+        type=float,
+        default=None,
+        help="If given, bias the beam search towards the callsigns expected in each "
+        "recording (utt2callsign_list of the test set), with this weight, e.g., 10.0. "
+        "Needs --lm.",
+    )
+    parser.add_argument(
+        "--callsign-expansion-level",
+        dest="expansion_level",
+        default="standard",
+        choices=["standard", "special", "full"],
+        help="How the callsigns are verbalized, see lm/resources/callsign_expansion",
+    )
+    parser.add_argument(
+        "--nbest",
+        type=int,
+        default=0,
+        help="Number of beams to write in hypo.nbest.jsonl (with acoustic and LM scores) "
+        "for rescoring, see rescore_nbest.py. Needs --lm and --print-output.",
+    )
+    parser.add_argument(
+        "--server-socket",
+        dest="server_socket",
+        default=None,
+        help="Unix socket of a running decode_server.py. If given, the test sets are "
+        "decoded by the server, which keeps the model and LM loaded between runs.",
+    )
 
     # must give,
     parser.add_argument(
@@ -124,44 +172,66 @@ def parse_args():
         "--test-set",
         dest="test_set",
         required=True,
-        help="Directory with a test set folder in Kaldi format.",
+        action="append",
+        help="Directory with a test set folder in Kaldi format. Pass it several times "
+        "(or a space separated list) to evaluate several test sets with the same loaded model.",
     )
 
     return parser.parse_args()
 
 
-def main():
-    """Main code execution"""
-    args = parse_args()
-
-    path_model = args.path_model
-    path_test_set = args.test_set
-    path_lm = args.path_lm
-    
-    if args.print_output == "true" or args.print_output == "True":
-        args.print_output = True
-
-    if not Path(path_lm).is_file():
-        print(f"You pass a path to LM ({path_lm}), but file does not exists")
-        sys.exit(1)
-    else:
-        print("Integrating a LM by shallow fusion, results should be better")
-    
-    print("*** Loading the Wav2Vec 2.0 model, loading... ***")
-    # Loading the models and the processors,tokenizer and also we load the models with CTC decoding and decoding CTC with LM
-    processor, processor_ctc_kenlm, model = get_kenlm_processor(path_model, path_lm)
-
-    if torch.cuda.is_available():
-        model.to("cuda")
-
-    print("*** Loading the dataset... ***")    
+def get_output_name(path_test_set):
+    """Name of the output folder of a test set: the name of its folder, or of its
+    corpus for the Kaldi split folders, e.g., atco2_test_set_4h/ -> atco2_test_set_4h,
+    atcosim_corpus/test -> atcosim_corpus and uwb_atcc/dev -> uwb_atcc_dev
+    """
+    path = os.path.normpath(path_test_set)
+    name = os.path.basename(path)
+    if name in ["train", "dev", "test"]:
+        corpus = os.path.basename(os.path.dirname(path))
+        return corpus if name == "test" else f"{corpus}_{name}"
+    return name
+
+
+def evaluate_test_set(
+    path_test_set,
+    processor,
+    processor_ctc_kenlm,
+    model,
+    path_model,
+    path_lm=None,
+    data_loader="src/atc_data_loader.py",
+    print_output=False,
+    nbest=0,
+    hotword_weight=None,
+    expansion_level="standard",
+):
+    """Decode and evaluate one test set with models that are already loaded,
+    thus, several test sets can be evaluated without reloading them.
+    If nbest > 0 (and print_output), the top-N beams are written in JSONL format.
+    If hotword_weight is given, the beam search is biased towards the callsigns
+    expected in each recording (utt2callsign_list of the test set).
+    Returns the WER/CER metrics in a dictionary
+    """
+
+    # the N-best lists come from the beam search, thus, we need the LM
+    if nbest > 0 and processor_ctc_kenlm is None:
+        print("--nbest needs a LM (--lm), the N-best lists are not written")
+        nbest = 0
+
+    # hotwords (verbalized callsigns) of each utterance, only for the beam search
+    get_hotwords = lambda utt_id: None
+    if hotword_weight is not None and processor_ctc_kenlm is not None:
+        get_hotwords = CallsignHotwords(path_test_set, level=expansion_level)
+
+    print("*** Loading the dataset... ***")
     # load the test set with our data loader
     test_dataset = load_dataset(
-        args.data_loader,
+        data_loader,
         "test",
         data_dir=path_test_set,
         split="test",
-        cache_dir = f".cache/eval/{path_test_set}",
+        cache_dir=f".cache/eval/{path_test_set}",
     )
 
     def prepare_dataset(batch):
@@ -181,9 +251,14 @@ def main():
     test_dataset = test_dataset.filter(lambda x: len(x["text"]) > 1)
     test_dataset = test_dataset.map(prepare_dataset, num_proc=4)
 
+    # duration of one frame of the logits, in seconds (320 / 16000 = 0.02)
+    time_offset = (
+        model.config.inputs_to_logits_ratio / processor.feature_extractor.sampling_rate
+    )
+
     def map_to_result(batch):
         """\
-            Function to pass to the test_dataset. This allows us to perform batch processing. 
+            Function to decode one sample of the test_dataset.
             We are generating the output of CTC decode and also CTC+LM (if LM provided)
             """
 
@@ -194,57 +269,196 @@ def main():
 
         # get the prediction for the raw model with BeamSearch or LM
         pred_ids = torch.argmax(logits, dim=-1)
-        batch["pred_str"] = processor.batch_decode(pred_ids)[0]
+        output_greedy = processor.batch_decode(pred_ids, output_word_offsets=True)
+        batch["pred_str"] = output_greedy.text[0]
         batch["text"] = processor.decode(batch["labels"], group_tokens=False)
+        word_offsets = output_greedy.word_offsets[0]
 
         # Perform BeamSearch + LM (if given), (we get [0] to only extract the string)
+        # with nbest, we keep the top-N beams (and their scores) for rescoring
+        hotwords = get_hotwords(batch["id"])
+        hotword_args = {}
+        if hotwords is not None:
+            hotword_args = {"hotwords": hotwords, "hotword_weight": hotword_weight}
+
+        # the decoder is called directly, batch_decode starts a new multiprocessing
+        # pool on each call (i.e., for each utterance)
         if processor_ctc_kenlm is not None:
-            batch["pred_str_ctc_lm"] = processor_ctc_kenlm.batch_decode(
-                logits.cpu().numpy()
-            ).text[0]
+            beams = processor_ctc_kenlm.decoder.decode_beams(
+                logits[0].cpu().numpy(), **hotword_args
+            )
+            if nbest > 0:
+                batch["nbest"] = beams_to_nbest(beams, nbest=nbest)
+            batch["pred_str_ctc_lm"] = beams[0][0]
+            word_offsets = [
+                {"word": word, "start_offset": start, "end_offset": end}
+                for word, (start, end) in beams[0][2]
+            ]
         else:
-            batch["pred_str_ctc_lm"] = batch["text"]
+            batch["pred_str_ctc_lm"] = batch["pred_str"]
+
+        # word timings and confidences of the final hypothesis (CTM format)
+        if print_output:
+            batch["ctm"] = get_ctm_lines(
+                batch["id"],
+                word_offsets,
+                logits[0].cpu().numpy(),
+                blank_id=processor.tokenizer.pad_token_id,
+                time_offset=time_offset,
+            )
 
         return batch
 
-    # get the result by passing it to the model. If there is LM we perform BeamSearch CTC+LM (better performance)
-    print(f"\n\nPerforming inference on dataset... Loading \n\n")
-    results = test_dataset.map(map_to_result, batch_size=8, desc="inference")
+    # speaker role and airport of each utterance, used to break down the WER/CER.
+    # We use the Kaldi files if present, otherwise we parse the utterance ids
+    utt2role = load_utt2info(os.path.join(path_test_set, "utt2speaker_callsign"))
+    utt2airport = load_utt2info(os.path.join(path_test_set, "utt2airport"))
 
     # Define evaluation metrics for testing, *i.e.* word error rate, character error rate
-    eval_metrics = {metric: evaluate.load(metric) for metric in ["wer", "cer"]}
-
-    wer_nolm = 100 * eval_metrics["wer"].compute(
-        predictions=results["pred_str"], references=results["text"]
-    )
-    wer_lm_ctc = 100 * eval_metrics["wer"].compute(
-        predictions=results["pred_str_ctc_lm"], references=results["text"]
-    )
-
-    if args.print_output is not None:
-        output_folder = path_model + "/output/" + os.path.basename(os.path.dirname(Path(path_test_set)))
-
+    # these are accumulated while decoding, so we do not keep the transcripts in memory
+    eval_metrics = {
+        (system, unit): ErrorRateAccumulator(unit=unit)
+        for system in ["nolm", "ctc_lm"]
+        for unit in ["word", "char"]
+    }
+
+    output_folder = path_model + "/output/" + get_output_name(path_test_set)
+    if print_output:
         # create the folder if not present
-        if not os.path.isdir(f"{output_folder}"):
-            os.makedirs(f"{output_folder}", exist_ok=True)
-        
-        # write the WER output to a file
+        os.makedirs(f"{output_folder}", exist_ok=True)
+        trans_f = open(f"{output_folder}/gt", mode="w")
+        hypo_f = open(f"{output_folder}/hypo", mode="w")
+        ctm_f = open(f"{output_folder}/hypo.ctm", mode="w")
+        if nbest > 0:
+            nbest_f = open(f"{output_folder}/hypo.nbest.jsonl", mode="w")
+
+    # get the result by passing it to the model. If there is LM we perform BeamSearch CTC+LM (better performance)
+    print(f"\n\nPerforming inference on dataset... Loading \n\n")
+    for sample in tqdm(test_dataset, desc="inference"):
+        result = map_to_result(sample)
+        groups = get_utt_groups(result["id"], utt2role, utt2airport)
+
+        for (system, unit), accumulator in eval_metrics.items():
+            prediction = result["pred_str" if system == "nolm" else "pred_str_ctc_lm"]
+            accumulator.update(result["text"], prediction, groups)
+
+        if print_output:
+            trans_f.write(f"{result['id']} {result['text']}\n")
+            hypo_f.write(f"{result['id']} {result['pred_str_ctc_lm']}\n")
+            ctm_f.writelines(result["ctm"])
+            if nbest > 0:
+                nbest_line = {"id": result["id"], "nbest": result["nbest"]}
+                nbest_f.write(json.dumps(nbest_line) + "\n")
+
+    # print the metrics to the terminal
+    for (system, unit), accumulator in eval_metrics.items():
+        print(accumulator.report(title=system))
+
+    results = {
+        f"{system}_{unit}": accumulator.to_dict()
+        for (system, unit), accumulator in eval_metrics.items()
+    }
+
+    if print_output:
+        trans_f.close()
+        hypo_f.close()
+        ctm_f.close()
+        if nbest > 0:
+            nbest_f.close()
+        print(f"*** printed the ASR results in {output_folder}/hypo ***")
+
+        # write the WER/CER output to a file, with the breakdowns per speaker/airport
         with open(f"{output_folder}/wer_metrics", "a") as o:
             o.write("---------------Test Statistics---------------\n")
             o.write(f"----LM used {path_lm}---\n")
-            o.write("WER: \t\t{:2f}\n".format(wer_nolm))
-            o.write("WER with CTC+LM: \t\t{:2f}\n".format(wer_lm_ctc))
+            o.write("WER: \t\t{:2f}\n".format(eval_metrics["nolm", "word"].result()))
+            o.write(
+                "WER with CTC+LM: \t\t{:2f}\n".format(
+                    eval_metrics["ctc_lm", "word"].result()
+                )
+            )
+            o.write("CER: \t\t{:2f}\n".format(eval_metrics["nolm", "char"].result()))
+            o.write(
+                "CER with CTC+LM: \t\t{:2f}\n".format(
+                    eval_metrics["ctc_lm", "char"].result()
+                )
+            )
+            o.write("--------------- Breakdowns ------------------\n")
+            for (system, unit), accumulator in eval_metrics.items():
+                o.write(accumulator.report(title=system))
             o.write("-------------END STATISTICS------------------\n")
 
-        print(f"*** printing the ASR results in {output_folder}/hypo ***")
-        with open(f"{output_folder}/gt", mode="w") as trans_f:
-            with open(f"{output_folder}/hypo", mode="w") as hypo_f:
-                for id, transcript, hypo in zip(results["id"], results["text"], results["pred_str_ctc_lm"]):
-                    trans_f.write(f"{id} {transcript}\n")
-                    hypo_f.write(f"{id} {hypo}\n")
+        # same metrics in JSON format, easier to parse for plots/tables
+        with open(f"{output_folder}/wer_metrics.json", "w") as o:
+            json.dump(results, o, indent=2)
+
+    results["output_folder"] = output_folder if print_output else None
+
+    print("Done!")
+    return results
+
+
+def main():
+    """Main code execution"""
+    args = parse_args()
+
+    path_model = args.path_model
+    path_lm = args.path_lm
+    # several test sets, e.g., --test-set dir1 --test-set dir2 or --test-set "dir1 dir2"
+    test_sets = [x for test_set in args.test_set for x in test_set.split()]
+
+    args.print_output = args.print_output in [True, "true", "True"]
+
+    if path_lm is not None and not Path(path_lm).is_file():
+        print(f"You pass a path to LM ({path_lm}), but file does not exists")
+        sys.exit(1)
+    elif path_lm is not None:
+        print("Integrating a LM by shallow fusion, results should be better")
+
+    # the decode server already has the models loaded, we only send the test sets
+    if args.server_socket is not None:
+        from decode_server import request_evaluation
+
+        for path_test_set in test_sets:
+            print(f"*** Sending test set to the decode server: {path_test_set} ***")
+            results = request_evaluation(
+                args.server_socket,
+                path_test_set,
+                path_model=path_model,
+                path_lm=path_lm,
+                data_loader=args.data_loader,
+                print_output=args.print_output,
+                nbest=args.nbest,
+                hotword_weight=args.hotword_weight,
+                expansion_level=args.expansion_level,
+            )
+            print(json.dumps(results, indent=2))
+        return
+
+    print("*** Loading the Wav2Vec 2.0 model, loading... ***")
+    # Loading the models and the processors,tokenizer and also we load the models with CTC decoding and decoding CTC with LM
+    processor, processor_ctc_kenlm, model = get_kenlm_processor(path_model, path_lm)
+
+    if torch.cuda.is_available():
+        model.to("cuda")
+
+    # the model and decoder are loaded only once for all the test sets
+    for path_test_set in test_sets:
+        print(f"*** Evaluating test set: {path_test_set} ***")
+        evaluate_test_set(
+            path_test_set,
+            processor,
+            processor_ctc_kenlm,
+            model,
+            path_model,
+            path_lm=path_lm,
+            data_loader=args.data_loader,
+            print_output=args.print_output,
+            nbest=args.nbest,
+            hotword_weight=args.hotword_weight,
+            expansion_level=args.expansion_level,
+        )
 
-        print("Done!")
-            
 
 if __name__ == "__main__":
     main()
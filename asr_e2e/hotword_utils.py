@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+"""\
+Utils to bias the beam search (pyctcdecode) towards the callsigns expected in
+each recording, i.e., contextual biasing with hotwords.
+
+The lists of callsigns (ICAO format) come from the Kaldi file 'utt2callsign_list'
+of the test sets (see data/databases/atco2_test_set_4h/ and
+data/databases/atco2_pl_set/local/prepare_callsign_lists.py):
+    <utt_id> CSA123 BAW77 OKHTM ...
+
+Each callsign is verbalized with ExpandCallsign (lm/resources/callsign_expansion),
+e.g., 'CSA123' -> 'csa one two three', 'csa two three', ... and the expansions are
+passed as hotwords to the decoder. All the utterances of one recording share the
+same list, so the expansions are cached per recording.
+"""
+
+import functools
+import os
+import sys
+from pathlib import Path
+
+# folder of the repository, the callsign expansion tools live in lm/resources/
+REPO_FOLDER = Path(__file__).resolve().parents[1]
+CALLSIGN_EXPANSION_FOLDER = REPO_FOLDER / "lm/resources/callsign_expansion"
+AIRLINE_TABLE = REPO_FOLDER / "lm/resources/callsign_table/callsign_table.csv"
+
+
+@functools.lru_cache(maxsize=None)
+def get_callsign_expander(level="standard", airline_table=AIRLINE_TABLE):
+    """Load ExpandCallsign only once (per expansion level), it reads the airline table"""
+    sys.path.insert(0, str(CALLSIGN_EXPANSION_FOLDER))
+    from expand_callsign import ExpandCallsign
+
+    return ExpandCallsign(airline_table=str(airline_table), level=level)
+
+
+class CallsignHotwords:
+    """Verbalized callsigns of each utterance of a test set, to use as hotwords.
+    The expansions are computed once per recording and kept in memory. The cache
+    is keyed by the callsign list itself (it is the same for all the utterances
+    and speakers of a recording), thus, it does not depend on the utt_id format.
+    """
+
+    def __init__(self, path_test_set, level="standard"):
+        self.expander = get_callsign_expander(level)
+        self.utt2callsign_list = {}
+        self.cache = {}
+
+        path_to_file = os.path.join(path_test_set, "utt2callsign_list")
+        if not os.path.isfile(path_to_file):
+            print(f"Warning, no callsign lists in {path_to_file}, no hotwords are used")
+            return
+
+        with open(path_to_file, "r") as rd:
+            for line in rd:
+                utt_id, *callsigns = line.split()
+                self.utt2callsign_list[utt_id] = callsigns
+
+    def expand(self, callsigns):
+        """Spoken forms of a list of callsigns, without duplicates. Multi-word
+        airline designators are written with '_' in the airline table, e.g.,
+        'air_berlin', we split them to match the transcripts"""
+        hotwords = []
+        for callsign in callsigns:
+            # unknown callsigns return None (and ExpandCallsign prints a warning)
+            try:
+                expansions = self.expander.expand_callsign(callsign)
+            except Exception:
+                expansions = None
+            for words in expansions or []:
+                hotwords.append(" ".join(words).replace("_", " "))
+        return list(dict.fromkeys(hotwords))
+
+    def __call__(self, utt_id):
+        """hotwords of one utterance, None if there is no callsign list"""
+        callsigns = self.utt2callsign_list.get(utt_id)
+        if not callsigns:
+            return None
+
+        key = " ".join(callsigns)
+        if key not in self.cache:
+            self.cache[key] = self.expand(callsigns)
+        return self.cache[key] or None
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+"""\
+Report of KenLM binaries (e.g., pruned/quantized variants from train_kenlm.py):
+    - size of the binary (MB)
+    - load time (s)
+    - perplexity and OOV rate on a dev set (Kaldi text file)
+    - decode speed (utterances/s) and WER of pyctcdecode with the LM, on synthetic
+      CTC posteriors built from the dev transcripts (no acoustic model needed), so
+      all the variants are compared on the same input
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from wer_utils import ErrorRateAccumulator
+
+
+def read_dev_sentences(path_dev_text, clean_fn=None):
+    """Transcripts of a Kaldi text file (utt_id transcript), cleaned with clean_fn"""
+    sentences = []
+    with open(path_dev_text, "r", encoding="utf-8") as rd:
+        for line in rd:
+            if len(line.split(" ")) > 1:
+                _, transcript = line.split(" ", maxsplit=1)
+                transcript = clean_fn(transcript) if clean_fn else transcript.strip()
+                if transcript.strip():
+                    sentences.append(" ".join(transcript.split()))
+    return sentences
+
+
+def perplexity(model, sentences):
+    """Perplexity (with </s>) and OOV rate of a kenlm.Model on a list of sentences"""
+    log10_prob, num_tokens, num_oov = 0.0, 0, 0
+    for sentence in sentences:
+        for prob, _, oov in model.full_scores(sentence, bos=True, eos=True):
+            log10_prob += prob
+            num_tokens += 1
+            num_oov += oov
+    return 10.0 ** (-log10_prob / max(num_tokens, 1)), num_oov / max(num_tokens, 1)
+
+
+def synthetic_logits(sentence, labels, rng, frames_per_char=2, peak=5.0, noise=1.0):
+    """Noisy CTC log-posteriors of a sentence, each char is followed by a blank (0)"""
+    char_ids = {char: i for i, char in enumerate(labels)}
+    frames = []
+    for char in sentence:
+        frames += [char_ids[char]] * frames_per_char + [0]
+
+    logits = rng.normal(0.0, noise, size=(len(frames), len(labels)))
+    logits[np.arange(len(frames)), frames] += peak
+    logits -= np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+    return logits.astype(np.float32)
+
+
+def decode_speed(path_lm, sentences, beam_width=100, seed=1234):
+    """Decode speed (utterances/s, seconds/utterance) and WER of pyctcdecode with
+    the LM on synthetic CTC posteriors of the sentences"""
+    from pyctcdecode import build_ctcdecoder
+
+    labels = [""] + sorted(set("".join(sentences)) | {" "})
+    decoder = build_ctcdecoder(labels, kenlm_model_path=path_lm)
+
+    rng = np.random.default_rng(seed)
+    all_logits = [synthetic_logits(x, labels, rng) for x in sentences]
+
+    wer = ErrorRateAccumulator(unit="word")
+    start = time.perf_counter()
+    for sentence, logits in zip(sentences, all_logits):
+        wer.update(sentence, decoder.decode(logits, beam_width=beam_width))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "utts_per_second": len(sentences) / elapsed,
+        "seconds_per_utt": elapsed / max(len(sentences), 1),
+        "wer": wer.result(),
+    }
+
+
+def report_variants(
+    lm_bin_file_paths, path_dev_text, clean_fn=None, path_report=None, max_utts=200
+):
+    """Measure and print the size, load time, perplexity and decode speed of each
+    KenLM binary. The report is also written in JSON format to path_report"""
+    import kenlm
+
+    sentences = read_dev_sentences(path_dev_text, clean_fn=clean_fn)
+    print(
+        f"*** Reporting {len(lm_bin_file_paths)} LMs on {len(sentences)} sentences ***"
+    )
+
+    report = []
+    for path_lm in lm_bin_file_paths:
+        start = time.perf_counter()
+        model = kenlm.Model(path_lm)
+        load_time = time.perf_counter() - start
+
+        ppl, oov_rate = perplexity(model, sentences)
+        del model
+
+        report.append(
+            {
+                "lm": path_lm,
+                "size_mb": os.path.getsize(path_lm) / 1024**2,
+                "load_time_s": load_time,
+                "perplexity": ppl,
+                "oov_rate": oov_rate,
+                **decode_speed(path_lm, sentences[:max_utts]),
+            }
+        )
+
+    print(
+        f"\n{'LM':50s} {'size(MB)':>9s} {'load(s)':>8s} {'PPL':>9s} "
+        f"{'OOV(%)':>7s} {'utts/s':>8s} {'WER':>7s}"
+    )
+    for row in report:
+        print(
+            f"{os.path.basename(row['lm']):50s} {row['size_mb']:9.2f} "
+            f"{row['load_time_s']:8.3f} {row['perplexity']:9.2f} "
+            f"{100 * row['oov_rate']:7.2f} {row['utts_per_second']:8.2f} "
+            f"{row['wer']:7.2f}"
+        )
+
+    if path_report is not None:
+        with open(path_report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nreport written in {path_report}")
+    return report
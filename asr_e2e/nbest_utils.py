@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+"""\
+Utils to store and rescore N-best lists from the pyctcdecode beam search.
+
+The N-best lists are stored in JSONL format, one utterance per line:
+    {"id": "utt_id", "nbest": [{"text": "...", "am_score": -1.2, "lm_score": -3.4,
+                                "score": -4.6, "word_offsets": [[0, 12], ...]}, ...]}
+
+where 'am_score' is the CTC (logit) score of the beam, 'lm_score' is the score
+added by the LM (and word insertion bonus) and 'score' is the sum of both.
+
+A scorer is any callable that receives a list of hypotheses (strings) and
+returns a list of floats (one per hypothesis), higher is better. Scorers are
+called with the hypotheses of several utterances at once, so expensive
+second-pass models (e.g., callsign-aware LM, NER) run batched and only over
+the shortlists of the beam search.
+"""
+
+import importlib
+import json
+
+
+def beams_to_nbest(beams, nbest=10):
+    """Convert the output of pyctcdecode 'decode_beams' to a list of dicts.
+    Each beam is: (text, last_lm_state, text_frames, logit_score, combined_score)
+    """
+    output = []
+    for text, _, text_frames, logit_score, combined_score in beams[:nbest]:
+        output.append(
+            {
+                "text": text,
+                "am_score": float(logit_score),
+                "lm_score": float(combined_score - logit_score),
+                "score": float(combined_score),
+                "word_offsets": [[int(x[1][0]), int(x[1][1])] for x in text_frames],
+            }
+        )
+    return output
+
+
+def read_nbest_file(path_to_file, batch_size=32):
+    """Read a N-best JSONL file in batches of utterances (does not load the whole file)"""
+    batch = []
+    with open(path_to_file, "r") as rd:
+        for line in rd:
+            if not line.strip():
+                continue
+            batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def rescore_batch(batch, scorers, weights):
+    """Rescore and reorder the N-best lists of a batch of utterances.
+    Inputs:
+        - batch: list of {"id", "nbest"} dicts
+        - scorers: dict name -> callable(list of str) -> list of float
+        - weights: dict name -> weight of the scorer
+    Output: same batch, each hypothesis has the new 'rescore' field and a
+        'scores' dict with the output of each scorer, and the N-best lists are sorted
+    """
+    hypotheses = [hyp for utt in batch for hyp in utt["nbest"]]
+    texts = [hyp["text"] for hyp in hypotheses]
+
+    for hyp in hypotheses:
+        hyp["scores"] = {}
+        hyp["rescore"] = hyp["score"]
+
+    # one call per scorer with all the hypotheses of the batch
+    for name, scorer in scorers.items():
+        for hyp, value in zip(hypotheses, scorer(texts)):
+            hyp["scores"][name] = float(value)
+            hyp["rescore"] += weights[name] * float(value)
+
+    for utt in batch:
+        utt["nbest"] = sorted(utt["nbest"], key=lambda x: x["rescore"], reverse=True)
+    return batch
+
+
+def word_count_scorer(arguments=None):
+    """number of words, i.e., a word insertion bonus"""
+    return lambda texts: [len(text.split()) for text in texts]
+
+
+def kenlm_scorer(path_lm):
+    """log10 probability of the hypothesis with another KenLM model,
+    e.g., a callsign-aware LM (see train_kenlm.py)"""
+    import kenlm
+
+    model = kenlm.Model(path_lm)
+    return lambda texts: [model.score(text, bos=True, eos=True) for text in texts]
+
+
+# built-in scorers, <name>[:<argument>] in the command line
+SCORERS = {
+    "wordcount": word_count_scorer,
+    "kenlm": kenlm_scorer,
+}
+
+
+def load_scorer(spec):
+    """Build a scorer from a command line spec:
+    - built-in: 'wordcount' or 'kenlm:/path/to/lm.binary'
+    - pluggable: 'python:my_module.my_factory:argument', where my_factory(argument)
+      returns a callable(list of str) -> list of float
+    """
+    if spec.startswith("python:"):
+        _, factory_path, *argument = spec.split(":", maxsplit=2)
+        module_name, factory_name = factory_path.rsplit(".", maxsplit=1)
+        factory = getattr(importlib.import_module(module_name), factory_name)
+        return factory(argument[0] if argument else None)
+
+    name, *argument = spec.split(":", maxsplit=1)
+    if name not in SCORERS:
+        raise ValueError(f"Unknown scorer {name}, choose from {list(SCORERS)}")
+    return SCORERS[name](argument[0] if argument else None)
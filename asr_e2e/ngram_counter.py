@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+DESCRIPTION = """\
+Pure Python/numpy n-gram LM with interpolated modified Kneser-Ney smoothing,
+written in ARPA format. It is used by train_kenlm.py when 'lmplz' is not
+installed, and it can be used to cross-check the output of KenLM.
+
+The estimation follows lmplz:
+    - adjusted counts: raw counts for the highest order and for the n-grams
+      starting with <s>, number of distinct left extensions for the others
+    - discounts D1, D2, D3+ per order from the counts of counts
+    - interpolation with the lower order, and with the uniform distribution
+      for the unigrams (<unk> gets the uniform mass)
+
+The corpus does not need to fit in memory: the words are mapped to integer ids
+(stored on disk), each n-gram is packed (hashed) into one uint64 id, and the
+counts are computed in blocks, spilled to disk as sorted runs and merged.
+"""
+
+import argparse
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+
+UNK, BOS, EOS = 0, 1, 2
+SPECIAL_WORDS = ["<unk>", "<s>", "</s>"]
+
+# fallback discounts when they can not be estimated (like lmplz --discount_fallback)
+DISCOUNT_FALLBACK = (0.5, 1.0, 1.5)
+
+
+# ======================================================================
+# arrays on disk
+# ======================================================================
+
+
+class DiskArrays:
+    """Named arrays stored as raw binary files in a folder, appended in blocks
+    and read back as memory maps"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.dtypes = {}
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def create(self, name, dtype):
+        self.dtypes[name] = np.dtype(dtype)
+        open(self.path(name), "wb").close()
+
+    def append(self, name, values):
+        with open(self.path(name), "ab") as f:
+            np.asarray(values, dtype=self.dtypes[name]).tofile(f)
+
+    def write(self, name, values):
+        self.create(name, np.asarray(values).dtype)
+        self.append(name, values)
+
+    def read(self, name, mode="r"):
+        if os.path.getsize(self.path(name)) == 0:
+            return np.zeros(0, dtype=self.dtypes[name])
+        return np.memmap(self.path(name), dtype=self.dtypes[name], mode=mode)
+
+    def remove(self, name):
+        os.remove(self.path(name))
+
+
+# ======================================================================
+# n-gram ids
+# ======================================================================
+
+
+def pack(windows, bits):
+    """Pack the word ids of n-grams (array n x order) into one uint64 per n-gram,
+    the first word in the highest bits, so sorting the ids sorts the n-grams by
+    context"""
+    keys = np.zeros(len(windows), dtype=np.uint64)
+    for j in range(windows.shape[1]):
+        keys = (keys << np.uint64(bits)) | windows[:, j].astype(np.uint64)
+    return keys
+
+
+def unpack(keys, bits, order):
+    """Word ids of packed n-grams, array n x order"""
+    mask = np.uint64((1 << bits) - 1)
+    words = np.zeros((len(keys), order), dtype=np.int64)
+    for j in range(order - 1, -1, -1):
+        words[:, j] = keys & mask
+        keys = keys >> np.uint64(bits)
+    return words
+
+
+def suffix(keys, bits, order):
+    """Drop the first word of n-grams of a given order"""
+    return keys & np.uint64((1 << (bits * (order - 1))) - 1)
+
+
+def context(keys, bits):
+    """Drop the last word of n-grams"""
+    return keys >> np.uint64(bits)
+
+
+# ======================================================================
+# sort and count with sorted runs on disk
+# ======================================================================
+
+
+def unique_counts(keys, counts=None):
+    """Sorted unique keys and the sum of their counts"""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    if counts is None:
+        return unique, np.bincount(inverse, minlength=len(unique)).astype(np.int64)
+    summed = np.bincount(inverse, weights=counts, minlength=len(unique))
+    return unique, summed.astype(np.int64)
+
+
+def merge_runs(arrays, runs, name, block_size):
+    """Merge sorted runs (keys, counts) into one sorted run, with bounded memory:
+    we take a block of each run, and only the keys up to the smallest last key
+    of the blocks (the other keys might also be in the next blocks)"""
+    arrays.create(f"{name}.keys", np.uint64)
+    arrays.create(f"{name}.counts", np.int64)
+
+    runs = [(arrays.read(f"{x}.keys"), arrays.read(f"{x}.counts")) for x in runs]
+    position = [0] * len(runs)
+    while True:
+        active = [i for i, run in enumerate(runs) if position[i] < len(run[0])]
+        if not active:
+            break
+
+        frontier = min(
+            runs[i][0][min(position[i] + block_size, len(runs[i][0])) - 1]
+            for i in active
+        )
+        keys, counts = [], []
+        for i in active:
+            run_keys, run_counts = runs[i]
+            block = run_keys[position[i] : position[i] + block_size]
+            end = position[i] + np.searchsorted(block, frontier, side="right")
+            keys.append(run_keys[position[i] : end])
+            counts.append(run_counts[position[i] : end])
+            position[i] = end
+
+        keys, counts = unique_counts(np.concatenate(keys), np.concatenate(counts))
+        arrays.append(f"{name}.keys", keys)
+        arrays.append(f"{name}.counts", counts)
+
+
+def sort_and_count(arrays, blocks, name, block_size):
+    """Count the keys given in blocks (keys, counts or None): each block is sorted
+    and counted in memory, written to disk as a run, and the runs are merged"""
+    runs = []
+    for keys, counts in blocks:
+        if len(keys) == 0:
+            continue
+        run = f"{name}.run{len(runs)}"
+        keys, counts = unique_counts(keys, counts)
+        arrays.write(f"{run}.keys", keys)
+        arrays.write(f"{run}.counts", counts)
+        runs.append(run)
+
+    merge_runs(arrays, runs, name, block_size)
+    for run in runs:
+        arrays.remove(f"{run}.keys")
+        arrays.remove(f"{run}.counts")
+
+
+# ======================================================================
+# counting
+# ======================================================================
+
+
+def text_to_ids(text_chunks, arrays, vocab):
+    """Map the words of the text to ids, stored on disk with <s> and </s> around
+    each line. The chunks can split lines and words, we carry the last word"""
+    arrays.create("corpus.ids", np.int32)
+    sentence_open = False
+    carry = ""
+
+    def convert(text, final=False):
+        nonlocal sentence_open
+        ids = []
+        lines = text.split("\n")
+        for i, line in enumerate(lines):
+            words = line.split()
+            if words and not sentence_open:
+                ids.append(BOS)
+                sentence_open = True
+            ids.extend(vocab.setdefault(w, len(vocab)) for w in words)
+            if sentence_open and (i < len(lines) - 1 or final):
+                ids.append(EOS)
+                sentence_open = False
+        arrays.append("corpus.ids", ids)
+
+    for chunk in text_chunks:
+        text = carry + chunk
+        # the text after the last whitespace might be an incomplete word
+        match = re.search(r"\S+\Z", text)
+        carry = match.group(0) if match else ""
+        convert(text[: len(text) - len(carry)])
+    convert(carry, final=True)
+
+
+def count_blocks(ids, order, n, bits, block_size):
+    """Packed n-grams of a given order n in blocks of the corpus. The n-grams do
+    not cross sentences, and for n < order, only the n-grams starting with <s>"""
+    for start in range(0, len(ids), block_size):
+        segment = np.asarray(ids[start : start + block_size + n - 1])
+        if len(segment) < n:
+            break
+        windows = np.lib.stride_tricks.sliding_window_view(segment, n)[:block_size]
+        valid = ~(windows[:, 1:] == BOS).any(axis=1) & ~(windows[:, :-1] == EOS).any(
+            axis=1
+        )
+        if n < order:
+            valid &= windows[:, 0] == BOS
+        yield pack(windows[valid], bits), None
+
+
+def suffix_blocks(arrays, name, bits, n, block_size):
+    """Suffixes of the n-grams of a table, one per distinct n-gram (left extension)"""
+    keys = arrays.read(f"{name}.keys")
+    for start in range(0, len(keys), block_size):
+        block = np.asarray(keys[start : start + block_size])
+        yield suffix(block, bits, n), None
+
+
+def adjusted_counts(arrays, ids, order, bits, block_size):
+    """Adjusted counts of each order, tables 'adjusted{n}.keys/.counts' on disk"""
+    # highest order, raw counts
+    sort_and_count(
+        arrays,
+        count_blocks(ids, order, order, bits, block_size),
+        f"adjusted{order}",
+        block_size,
+    )
+
+    for n in range(order - 1, 0, -1):
+        # continuation counts, number of distinct left extensions
+        sort_and_count(
+            arrays,
+            suffix_blocks(arrays, f"adjusted{n + 1}", bits, n + 1, block_size),
+            f"continuation{n}",
+            block_size,
+        )
+        # the n-grams starting with <s> have no left extension, raw counts
+        if n > 1:
+            sort_and_count(
+                arrays,
+                count_blocks(ids, order, n, bits, block_size),
+                f"bos{n}",
+                block_size,
+            )
+        else:
+            # the unigrams <unk> and <s>, with a count of 0 (<unk> gets the uniform
+            # mass, and the probability of <s> is not used)
+            arrays.write("bos1.keys", np.array([UNK, BOS], dtype=np.uint64))
+            arrays.write("bos1.counts", np.array([0, 0], dtype=np.int64))
+
+        # both are disjoint, the counts are not summed
+        merge_runs(arrays, [f"continuation{n}", f"bos{n}"], f"adjusted{n}", block_size)
+        for name in [f"continuation{n}", f"bos{n}"]:
+            arrays.remove(f"{name}.keys")
+            arrays.remove(f"{name}.counts")
+
+
+# ======================================================================
+# modified Kneser-Ney estimation
+# ======================================================================
+
+
+def estimate_discounts(counts, fallback=DISCOUNT_FALLBACK):
+    """Discounts D1, D2, D3+ from the counts of counts n1..n4 (Chen and Goodman)"""
+    n = np.bincount(np.minimum(counts[counts > 0], 5), minlength=6)
+    try:
+        if n[1] == 0 or n[2] == 0 or n[3] == 0:
+            raise ZeroDivisionError
+        y = n[1] / (n[1] + 2 * n[2])
+        discounts = (
+            1 - 2 * y * n[2] / n[1],
+            2 - 3 * y * n[3] / n[2],
+            3 - 4 * y * n[4] / n[3],
+        )
+        if not all(0 < d < i + 1 for i, d in enumerate(discounts)):
+            raise ZeroDivisionError
+        return tuple(float(d) for d in discounts)
+    except ZeroDivisionError:
+        return fallback
+
+
+def discount(counts, discounts):
+    """Discount of each adjusted count, 0 for a count of 0"""
+    table = np.array((0.0,) + tuple(discounts))
+    return table[np.minimum(counts, 3)]
+
+
+def context_stats(keys, counts, discounts, bits):
+    """Per context (sorted): sum of the adjusted counts, and the mass kept for the
+    lower order: gamma = (D1 N1 + D2 N2 + D3 N3+) / sum"""
+    contexts = context(keys, bits)
+    unique, index = np.unique(contexts, return_index=True)
+    totals = np.add.reduceat(counts.astype(np.float64), index)
+    mass = np.add.reduceat(discount(counts, discounts), index)
+    return unique, totals, mass
+
+
+def estimate(arrays, order, bits, block_size, discount_fallback=DISCOUNT_FALLBACK):
+    """Interpolated probabilities 'prob{n}' and backoffs 'backoff{n}' (linear) of
+    each order, aligned with the tables 'adjusted{n}.keys'"""
+    all_discounts = {}
+    for n in range(1, order + 1):
+        keys = arrays.read(f"adjusted{n}.keys")
+        counts = arrays.read(f"adjusted{n}.counts")
+        all_discounts[n] = estimate_discounts(np.asarray(counts), discount_fallback)
+        arrays.write(f"backoff{n}", np.ones(len(keys), dtype=np.float64))
+        arrays.create(f"prob{n}", np.float64)
+
+        if n == 1:
+            # unigrams, interpolated with the uniform distribution (without <s>)
+            keys, counts = np.asarray(keys), np.asarray(counts)
+            _, total, mass = context_stats(keys, counts, all_discounts[1], bits)
+            vocab_size = len(keys) - 1
+            probs = (counts - discount(counts, all_discounts[1])) / total[0]
+            probs += mass[0] / total[0] / vocab_size
+            probs[keys == BOS] = 0.0
+            arrays.append("prob1", probs)
+            continue
+
+        lower_keys = arrays.read(f"adjusted{n - 1}.keys")
+        lower_probs = arrays.read(f"prob{n - 1}")
+        lower_backoffs = arrays.read(f"backoff{n - 1}", mode="r+")
+
+        # blocks of complete contexts (the keys are sorted by context)
+        start = 0
+        while start < len(keys):
+            end = min(start + block_size, len(keys))
+            if end < len(keys):
+                last_context = context(np.asarray(keys[end - 1 : end]), bits)[0]
+                end = start + np.searchsorted(
+                    context(np.asarray(keys[start:end]), bits), last_context
+                )
+                if end == start:
+                    # one context bigger than the block
+                    contexts = context(np.asarray(keys[start:]), bits)
+                    end = start + np.searchsorted(contexts, last_context, side="right")
+
+            block_keys = np.asarray(keys[start:end])
+            block_counts = np.asarray(counts[start:end])
+            unique, total, mass = context_stats(
+                block_keys, block_counts, all_discounts[n], bits
+            )
+            gamma = mass / total
+
+            where = np.searchsorted(unique, context(block_keys, bits))
+            lower = lower_probs[
+                np.searchsorted(lower_keys, suffix(block_keys, bits, n))
+            ]
+            probs = (block_counts - discount(block_counts, all_discounts[n])) / total[
+                where
+            ] + gamma[where] * lower
+            arrays.append(f"prob{n}", probs)
+
+            # the mass of each context goes to the lower order, i.e., its backoff
+            lower_backoffs[np.searchsorted(lower_keys, unique)] = gamma
+            start = end
+
+        lower_backoffs.flush()
+        del lower_backoffs
+
+    return all_discounts
+
+
+def write_arpa(arrays, arpa_path, order, bits, id2word, block_size):
+    """Write the LM in ARPA format (log10 probabilities and backoffs)"""
+    id2word = np.array(id2word, dtype=object)
+    with open(arpa_path, "w", encoding="utf-8") as f:
+        f.write("\\data\\\n")
+        for n in range(1, order + 1):
+            f.write(f"ngram {n}={len(arrays.read(f'adjusted{n}.keys'))}\n")
+
+        for n in range(1, order + 1):
+            f.write(f"\n\\{n}-grams:\n")
+            keys = arrays.read(f"adjusted{n}.keys")
+            probs = arrays.read(f"prob{n}")
+            backoffs = arrays.read(f"backoff{n}")
+            for start in range(0, len(keys), block_size):
+                block = np.asarray(keys[start : start + block_size])
+                words = id2word[unpack(block, bits, n)]
+                with np.errstate(divide="ignore"):
+                    log_probs = np.log10(probs[start : start + block_size])
+                    log_backoffs = np.log10(backoffs[start : start + block_size])
+                log_probs[~np.isfinite(log_probs)] = -99.0
+
+                lines = []
+                for i, ngram in enumerate(words):
+                    line = f"{log_probs[i]:.7g}\t{' '.join(ngram)}"
+                    if n < order:
+                        line += f"\t{log_backoffs[i]:.7g}"
+                    lines.append(line + "\n")
+                f.writelines(lines)
+        f.write("\n\\end\\\n")
+
+
+def train_arpa(
+    text_chunks, arpa_path, order=4, block_size=1000000, tmpdir=None, verbose=True
+):
+    """Train a modified Kneser-Ney LM from text (iterable of strings, one
+    sentence per line) and write it in ARPA format. Returns the discounts"""
+    if order < 2:
+        raise ValueError("The order of the LM must be at least 2")
+
+    folder = tempfile.mkdtemp(prefix="ngram_counter_", dir=tmpdir)
+    try:
+        arrays = DiskArrays(folder)
+        vocab = {w: i for i, w in enumerate(SPECIAL_WORDS)}
+        text_to_ids(text_chunks, arrays, vocab)
+
+        bits = max(int(np.ceil(np.log2(len(vocab)))), 1)
+        if bits * order > 64:
+            raise ValueError(
+                f"{len(vocab)} words do not fit in {order}-grams of 64 bits, "
+                "reduce the order of the LM"
+            )
+
+        ids = arrays.read("corpus.ids")
+        adjusted_counts(arrays, ids, order, bits, block_size)
+        discounts = estimate(arrays, order, bits, block_size)
+        id2word = sorted(vocab, key=vocab.get)
+        write_arpa(arrays, arpa_path, order, bits, id2word, block_size)
+    finally:
+        shutil.rmtree(folder)
+
+    if verbose:
+        for n, values in discounts.items():
+            print(f"Discounts {n}-grams: " + " ".join(f"{d:.4f}" for d in values))
+    return discounts
+
+
+def read_text_chunks(path_to_file, chunk_size=16 * 1024 * 1024):
+    """Read a text file in chunks of characters"""
+    with open(path_to_file, "r", encoding="utf-8") as rd:
+        for chunk in iter(lambda: rd.read(chunk_size), ""):
+            yield chunk
+
+
+def parse_args():
+    """parser"""
+    parser = argparse.ArgumentParser(
+        description=DESCRIPTION, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("-o", "--order", type=int, default=4, help="order of the LM")
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=1000000,
+        help="Number of n-grams counted in memory at once (size of the sorted runs)",
+    )
+    parser.add_argument(
+        "--tmpdir", default=None, help="Folder for the temporary files (sorted runs)"
+    )
+
+    # must give,
+    parser.add_argument(
+        "--text", required=True, help="Text file, one sentence per line"
+    )
+    parser.add_argument("--arpa", required=True, help="Output LM in ARPA format")
+    return parser.parse_args()
+
+
+def main():
+    """Main code execution"""
+    args = parse_args()
+    train_arpa(
+        read_text_chunks(args.text),
+        args.arpa,
+        order=args.order,
+        block_size=args.block_size,
+        tmpdir=args.tmpdir,
+    )
+    print(f"Done! LM in {args.arpa}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+DESCRIPTION = """\
+Rescore the N-best lists written by eval_model.py (--nbest N) with one or
+several pluggable scorers, e.g., a callsign-aware KenLM or a NER-based scorer.
+
+The new score of each hypothesis is:
+    score (CTC + LM of the first pass) + sum_k weight_k * scorer_k(hypothesis)
+
+The scorers run batched over the hypotheses of several utterances, so an
+expensive second pass runs only over the shortlists of the beam search.
+"""
+
+import argparse
+import json
+import os
+
+from nbest_utils import load_scorer, read_nbest_file, rescore_batch
+from wer_utils import ErrorRateAccumulator, get_utt_groups
+
+
+def parse_args():
+    """parser"""
+    parser = argparse.ArgumentParser(
+        description=DESCRIPTION, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--scorer",
+        dest="scorers",
+        action="append",
+        default=[],
+        help="Scorer to use, can be passed several times:\n"
+        "  - wordcount\n"
+        "  - kenlm:/path/to/lm.binary\n"
+        "  - python:my_module.my_factory:argument (pluggable scorer)",
+    )
+    parser.add_argument(
+        "--weight",
+        dest="weights",
+        action="append",
+        type=float,
+        default=[],
+        help="Weight of each scorer, in the same order as --scorer (default 1.0)",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=32,
+        help="Number of utterances whose hypotheses are scored at once",
+    )
+    parser.add_argument(
+        "--ref",
+        default=None,
+        help="Kaldi text file with the references, to report WER before/after rescoring",
+    )
+
+    # must give,
+    parser.add_argument(
+        "--nbest-file",
+        required=True,
+        help="N-best JSONL file, e.g., /path/to/model/output/test_set/hypo.nbest.jsonl",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-folder",
+        required=True,
+        help="Folder where to write the rescored N-best lists and 1-best hypotheses",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Main code execution"""
+    args = parse_args()
+
+    weights = args.weights + [1.0] * (len(args.scorers) - len(args.weights))
+    scorers = {spec: load_scorer(spec) for spec in args.scorers}
+    weights = dict(zip(args.scorers, weights))
+
+    # the references are only used to report the WER
+    references = {}
+    if args.ref is not None:
+        with open(args.ref, "r") as rd:
+            for line in rd:
+                utt_id, *text = line.split(" ", maxsplit=1)
+                references[utt_id] = text[0].strip() if text else ""
+    wer_first_pass = ErrorRateAccumulator(unit="word")
+    wer_rescored = ErrorRateAccumulator(unit="word")
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    path_nbest = f"{args.output_folder}/hypo.nbest.rescored.jsonl"
+    path_hypo = f"{args.output_folder}/hypo.rescored"
+
+    with open(path_nbest, "w") as nbest_f, open(path_hypo, "w") as hypo_f:
+        for batch in read_nbest_file(args.nbest_file, batch_size=args.batch_size):
+            # 1-best of the first pass, before reordering
+            first_pass = [
+                utt["nbest"][0]["text"] if utt["nbest"] else "" for utt in batch
+            ]
+
+            for utt, first_best in zip(
+                rescore_batch(batch, scorers, weights), first_pass
+            ):
+                best = utt["nbest"][0]["text"] if utt["nbest"] else ""
+                nbest_f.write(json.dumps(utt) + "\n")
+                hypo_f.write(f"{utt['id']} {best}\n")
+
+                if utt["id"] in references:
+                    groups = get_utt_groups(utt["id"])
+                    wer_first_pass.update(references[utt["id"]], first_best, groups)
+                    wer_rescored.update(references[utt["id"]], best, groups)
+
+    if args.ref is not None:
+        print(wer_first_pass.report(title="first pass"))
+        print(wer_rescored.report(title="rescored"))
+
+    print(f"Done! rescored hypotheses in {path_hypo}")
+
+
+if __name__ == "__main__":
+    main()
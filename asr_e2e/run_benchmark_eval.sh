@@ -0,0 +1,43 @@
+#!/bin/bash
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License 
+
+# Script to benchmark the speed of the evaluation path (eval_model.py)
+# By default, it runs offline and CPU-only, with a tiny random model and synthetic audio.
+# Pass --path-to-model, --path-to-lm and --test-set to benchmark a real setup.
+#######################################
+# COMMAND LINE OPTIONS,
+set -euo pipefail
+
+path_to_lm=""
+path_to_model=""
+test_set=""
+max_utts="50"
+durations="1 2 5 10"
+beam_widths="10 100"
+threads="1"
+output_file="experiments/benchmarks/eval_model_$(git rev-parse --short HEAD 2>/dev/null || echo local).json"
+
+. data/utils/parse_options.sh
+
+# only pass the optional arguments if they are given
+extra_args=""
+[ -n "$path_to_lm" ] && extra_args="$extra_args --language-model $path_to_lm"
+[ -n "$path_to_model" ] && extra_args="$extra_args --pretrained-model $path_to_model"
+[ -n "$test_set" ] && extra_args="$extra_args --test-set $test_set --max-utts $max_utts"
+
+echo "*** About to benchmark the evaluation path ***"
+echo "*** Output file: $output_file ***"
+
+python3 asr_e2e/benchmark_eval.py $extra_args \
+  --durations "$durations" \
+  --beam-widths "$beam_widths" \
+  --threads "$threads" \
+  --output "$output_file"
+
+echo "Done benchmarking, results in ${output_file}"
+exit 0
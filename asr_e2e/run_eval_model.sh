@@ -13,9 +13,12 @@ set -euo pipefail
 
 path_to_lm="experiments/data/atco2_pl_set/train/lm/atco2_pl_set_4g.binary"
 path_to_model="experiments/results/baseline/wav2vec2-xls-r-300m/atco2_pl_set/0.0ld_0.0ad_0.0attd_0.0fpd_0.01mtp_12mtl_0.0mfp_12mfl_2acc/checkpoint-10000"
+# several test sets can be passed as a space separated list, the model is loaded only once
 test_set="experiments/data/atco2_test_set_4h/"
 
 print_output="true"
+# Unix socket of a running decode server (asr_e2e/decode_server.py), optional
+server_socket=""
 
 . data/utils/parse_options.sh
 
@@ -23,7 +26,10 @@ echo "*** About to evaluate a Wav2Vec 2.0 model***"
 echo "*** Dataset in: $test_set ***"
 echo "*** Output folder: $(dirname $path_to_model)/output ***"
 
-python3 asr_e2e/eval_model.py \
+extra_args=""
+[ -n "$server_socket" ] && extra_args="--server-socket $server_socket"
+
+python3 asr_e2e/eval_model.py $extra_args \
   --language-model "$path_to_lm" \
   --pretrained-model "$path_to_model" \
   --print-output "$print_output" \
@@ -14,6 +14,7 @@ set -euo pipefail
 dataset_name="atco2_pl_set"
 text_file="experiments/data/atco2_pl_set/train/text"
 n_gram_order="4"
+num_workers="$(nproc)" # processes that clean the corpus streamed into lmplz
 
 . data/utils/parse_options.sh
 
@@ -25,6 +26,7 @@ echo "*** Output folder: $output_lmdir ***"
 
 python3 asr_e2e/train_kenlm.py \
   --n-gram "${n_gram_order}" \
+  --num-workers "$num_workers" \
   --dataset-name "$dataset_name" \
   --dataset_path "$text_file" \
   --target_dir "$output_lmdir"
@@ -7,9 +7,12 @@
 #
 # SPDX-License-Identifier: MIT-License
 
+import itertools
+import multiprocessing
 import os
 import re
 import shlex
+import shutil
 import subprocess
 import sys
 from argparse import ArgumentParser, RawTextHelpFormatter
@@ -21,21 +24,26 @@ We also could perform optimization.
 """
 
 
-def correct_kenLM(path_lm, path_lm_correct):
-    """When we create the LM with KenLM, we need to fix the LM --> we need to add <s/> symbol"""
+def correct_kenLM(path_lm, path_lm_correct, block_size=16 * 1024 * 1024):
+    """When we create the LM with KenLM, we need to fix the LM --> we need to add <s/> symbol
+    Only the header (unigram count) and the <s> line are modified, then, the rest of
+    the ARPA file is copied in large blocks (not line by line)
+    """
 
-    with open(path_lm, "r") as read_file, open(path_lm_correct, "w") as write_file:
-        has_added_eos = False
-        for line in read_file:
-            if not has_added_eos and "ngram 1=" in line:
-                count = line.strip().split("=")[-1]
-                write_file.write(line.replace(f"{count}", f"{int(count)+1}"))
-            elif not has_added_eos and "<s>" in line:
+    with open(path_lm, "rb") as read_file, open(path_lm_correct, "wb") as write_file:
+        for line in iter(read_file.readline, b""):
+            if line.startswith(b"ngram 1="):
+                count = int(line.strip().split(b"=")[-1])
+                write_file.write(b"ngram 1=%d\n" % (count + 1))
+            elif b"<s>" in line:
                 write_file.write(line)
-                write_file.write(line.replace("<s>", "</s>"))
-                has_added_eos = True
+                write_file.write(line.replace(b"<s>", b"</s>"))
+                break
             else:
                 write_file.write(line)
+
+        # the rest of the file (n-grams) is not modified
+        shutil.copyfileobj(read_file, write_file, length=block_size)
     return print(f"corrected Ken LM in {path_lm_correct}")
 
 
@@ -68,70 +76,227 @@ def remove_special_characters(text):
     return sentence.lower().rstrip()
 
 
-def train(lm_dir, dataset_path, n_gram=4, dataset_name="not-defined"):
-    """Train a KenLM with a defined order, default 4-gram"""
+def clean_chunk(lines):
+    """Clean a chunk of lines of a Kaldi text file (utt_id transcript), it runs in
+    the workers of the pool. Returns the text to write in the corpus"""
+    corpus = []
+    for line in lines:
+        if len(line.split(" ")) > 1:
+            _, transcript = line.split(" ", maxsplit=1)
+            corpus.append(remove_special_characters(transcript) + " ")
+    return "".join(corpus)
 
-    print(dataset_name, dataset_path)
 
-    Path(lm_dir).mkdir(parents=True, exist_ok=True)
-    corpus_file_path = os.path.join(lm_dir, str(n_gram) + "_corpus.txt")
+def read_chunks(dataset_path, chunk_size=10000):
+    """Read a text file in chunks of lines"""
+    with open(dataset_path, "r", encoding="utf-8") as text_f:
+        while True:
+            lines = list(itertools.islice(text_f, chunk_size))
+            if not lines:
+                break
+            yield lines
 
-    print("\nExporting dataset to text file {}...".format(corpus_file_path))
-    with open(corpus_file_path, "w", encoding="utf-8") as corpus_file:
-        with open(dataset_path, "r", encoding="utf-8") as text_f:
-            for line in text_f:
-                if len(line.split(" ")) > 1:
-                    _, transcript = line.split(" ", maxsplit=1)
-                    transcript = remove_special_characters(transcript)
-                    corpus_file.write(transcript + " ")  # we only write the text file
 
-    # generate KenLM ARPA file language model
-    lm_arpa_file_path_no_fixed = os.path.join(
-        lm_dir, f"{dataset_name}_{n_gram}g_no_fix.arpa"
-    )
-    lm_arpa_file_path = os.path.join(lm_dir, f"{dataset_name}_{n_gram}g.arpa")
-    lm_bin_file_path = os.path.join(lm_dir, f"{dataset_name}_{n_gram}g.binary")
+def corpus_chunks(dataset_path, num_workers=1, chunk_size=10000):
+    """Cleaned transcripts of a Kaldi text file, in chunks of text. The chunks
+    are cleaned in a process pool and returned in order"""
+    chunks = read_chunks(dataset_path, chunk_size=chunk_size)
+
+    if num_workers <= 1:
+        yield from map(clean_chunk, chunks)
+        return
+
+    with multiprocessing.Pool(num_workers) as pool:
+        yield from pool.imap(clean_chunk, chunks)
+
+
+def export_corpus(dataset_path, output_f, num_workers=1, chunk_size=10000):
+    """Clean the transcripts of a Kaldi text file and write them to output_f
+    (binary file object, e.g., stdin of lmplz)"""
+    for text in corpus_chunks(dataset_path, num_workers, chunk_size):
+        output_f.write(text.encode("utf-8"))
+
+
+def train_arpa(
+    lm_arpa_file_path,
+    dataset_path,
+    n_gram=4,
+    prune=None,
+    ngram_counter=False,
+    **export_args,
+):
+    """Train an ARPA LM with lmplz (maybe pruned), and fix it (add </s>).
+    If lmplz is not installed (or ngram_counter=True), we use the Python n-gram
+    counter (ngram_counter.py), its output already has </s>"""
+
+    if ngram_counter or shutil.which("lmplz") is None:
+        from ngram_counter import train_arpa as train_arpa_python
+
+        print(f"\nTraining {n_gram}-gram LM with ngram_counter.py (no lmplz)...")
+        if prune is not None:
+            print(f"Warning, pruning ({prune}) is only supported by lmplz, ignoring it")
+        train_arpa_python(
+            corpus_chunks(dataset_path, **export_args),
+            lm_arpa_file_path,
+            order=n_gram,
+            tmpdir=os.path.dirname(lm_arpa_file_path),
+        )
+        return
+
+    lm_arpa_file_path_no_fixed = lm_arpa_file_path.replace(".arpa", "_no_fix.arpa")
 
-    # define the bash command to be executed to train the arpa LM with KenLM
-    cmd = "lmplz -o {n} --text {corpus_file} --arpa {lm_file}".format(
-        n=n_gram, corpus_file=corpus_file_path, lm_file=lm_arpa_file_path_no_fixed
+    # define the bash command to be executed to train the arpa LM with KenLM.
+    # The corpus is streamed to stdin of lmplz, no intermediate text file
+    cmd = "lmplz -o {n} --arpa {lm_file}".format(
+        n=n_gram, lm_file=lm_arpa_file_path_no_fixed
     )
+    # pruning thresholds of the n-gram counts, one per order, e.g., "0 0 1"
+    if prune is not None:
+        cmd += f" --prune {prune}"
     print(cmd)
 
-    # run the LM training
-    subprocess.run(shlex.split(cmd), stderr=sys.stderr, stdout=sys.stdout)
+    # run the LM training, while exporting the dataset
+    print(f"\nExporting dataset {dataset_path} to lmplz...")
+    lmplz = subprocess.Popen(
+        shlex.split(cmd), stdin=subprocess.PIPE, stderr=sys.stderr, stdout=sys.stdout
+    )
+    try:
+        export_corpus(dataset_path, lmplz.stdin, **export_args)
+    finally:
+        lmplz.stdin.close()
+    if lmplz.wait() != 0:
+        raise RuntimeError(f"lmplz failed with exit code {lmplz.returncode}")
 
     # now we need to fix the LM --> we add <s/> symbol
     correct_kenLM(lm_arpa_file_path_no_fixed, lm_arpa_file_path)
+    os.remove(lm_arpa_file_path_no_fixed)
+
+
+def build_binary(lm_arpa_file_path, lm_bin_file_path, quantize=None, array=None):
+    """Convert the ARPA LM into a KenLM binary (trie), which is faster to be loaded by
+    PyCTCdecode. Optionally:
+        - quantize: bits of the probabilities and backoffs, e.g., "8 8" -> -q 8 -b 8
+        - array: bits of the pointer compression, e.g., 64 -> -a 64
+    """
+    options = ""
+    if quantize is not None:
+        prob_bits, backoff_bits = quantize.split()
+        options += f"-q {prob_bits} -b {backoff_bits} "
+    if array is not None:
+        options += f"-a {array} "
 
-    # generate the binary version of the LM (which is faster to be loaded by PyCTCdecode)
-    cmd = "build_binary trie {arpa_file} {bin_file}".format(
-        arpa_file=lm_arpa_file_path, bin_file=lm_bin_file_path
+    cmd = "build_binary {options}trie {arpa_file} {bin_file}".format(
+        options=options, arpa_file=lm_arpa_file_path, bin_file=lm_bin_file_path
     )
     print(cmd)
 
     # run the arpa to bin converter:
-    subprocess.run(shlex.split(cmd), stderr=sys.stderr, stdout=sys.stdout)
+    subprocess.run(shlex.split(cmd), stderr=sys.stderr, stdout=sys.stdout, check=True)
+
+
+def variant_name(prune=None, quantize=None, array=None):
+    """suffix of the binary, e.g., '_prune001_q8b8_a64', empty for the default LM"""
+    name = ""
+    if prune is not None:
+        name += "_prune" + "".join(prune.split())
+    if quantize is not None:
+        name += "_q{}b{}".format(*quantize.split())
+    if array is not None:
+        name += f"_a{array}"
+    return name
+
+
+def train(
+    lm_dir,
+    dataset_path,
+    n_gram=4,
+    dataset_name="not-defined",
+    num_workers=1,
+    chunk_size=10000,
+    prunes=None,
+    quantizations=None,
+    arrays=None,
+    ngram_counter=False,
+):
+    """Train a KenLM with a defined order, default 4-gram.
+    One ARPA LM is trained per pruning setting (prunes), and one binary is built
+    per quantization/array compression setting. Returns the paths to the binaries
+    """
+
+    print(dataset_name, dataset_path)
+
+    Path(lm_dir).mkdir(parents=True, exist_ok=True)
+
+    lm_bin_file_paths = []
+    for prune in prunes or [None]:
+        # generate KenLM ARPA file language model
+        lm_arpa_file_path = os.path.join(
+            lm_dir, f"{dataset_name}_{n_gram}g{variant_name(prune)}.arpa"
+        )
+        train_arpa(
+            lm_arpa_file_path,
+            dataset_path,
+            n_gram=n_gram,
+            prune=prune,
+            ngram_counter=ngram_counter,
+            num_workers=num_workers,
+            chunk_size=chunk_size,
+        )
 
-    # remove some files that we don't need to store (corpus and LM in arpa format)
-    [
-        os.remove(x)
-        for x in [lm_arpa_file_path, lm_arpa_file_path_no_fixed, corpus_file_path]
-    ]
+        # without build_binary, we keep the ARPA file (KenLM and PyCTCdecode load it)
+        if shutil.which("build_binary") is None:
+            print("Warning, build_binary not found, we keep the LM in ARPA format")
+            lm_bin_file_paths.append(lm_arpa_file_path)
+            continue
 
-    return lm_dir
+        # generate the binary versions of the LM
+        for quantize, array in itertools.product(
+            quantizations or [None], arrays or [None]
+        ):
+            lm_bin_file_path = os.path.join(
+                lm_dir,
+                f"{dataset_name}_{n_gram}g{variant_name(prune, quantize, array)}.binary",
+            )
+            build_binary(lm_arpa_file_path, lm_bin_file_path, quantize, array)
+            lm_bin_file_paths.append(lm_bin_file_path)
+
+        # remove some files that we don't need to store (LM in arpa format)
+        os.remove(lm_arpa_file_path)
+
+    return lm_bin_file_paths
 
 
 def main(lm_root_dir, dataset_path, **args):
     """Main function. Train the KENLM"""
 
-    lm_file_path = train(
+    lm_bin_file_paths = train(
         lm_dir=lm_root_dir,
         dataset_path=dataset_path,
         n_gram=args["n_gram"],
         dataset_name=args["dataset_name"],
+        num_workers=args["num_workers"],
+        chunk_size=args["chunk_size"],
+        prunes=args["prunes"],
+        quantizations=args["quantizations"],
+        arrays=args["arrays"],
+        ngram_counter=args["ngram_counter"],
     )
-    print(f"done doing training of KenLM \n check the output folder: {lm_file_path}")
+    print(f"done doing training of KenLM \n check the output folder: {lm_root_dir}")
+
+    # size, load time, perplexity and decode speed of each LM
+    if args["dev_text"] is not None:
+        from kenlm_report import report_variants
+
+        path_report = os.path.join(
+            lm_root_dir, f"{args['dataset_name']}_{args['n_gram']}g_report.json"
+        )
+        report_variants(
+            lm_bin_file_paths,
+            args["dev_text"],
+            clean_fn=remove_special_characters,
+            path_report=path_report,
+            max_utts=args["report_utts"],
+        )
 
 
 if __name__ == "__main__":
@@ -156,6 +321,68 @@ if __name__ == "__main__":
         type=str,
         help="Name of the dataset. This will be the name of the final mdoel.",
     )
+    parser.add_argument(
+        "-j",
+        "--num-workers",
+        dest="num_workers",
+        default=os.cpu_count(),
+        type=int,
+        help="Number of processes to clean the corpus (it is streamed into lmplz).",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        dest="chunk_size",
+        default=10000,
+        type=int,
+        help="Number of lines of the corpus cleaned at once by each process.",
+    )
+    parser.add_argument(
+        "--prune",
+        dest="prunes",
+        action="append",
+        default=None,
+        help="Pruning thresholds of lmplz, one per order, e.g., '0 0 1' (prunes\n"
+        "singleton 3-grams and 4-grams). Pass it several times to train several LMs.",
+    )
+    parser.add_argument(
+        "--quantize",
+        dest="quantizations",
+        action="append",
+        default=None,
+        help="Bits to quantize the probabilities and backoffs in build_binary, e.g.,\n"
+        "'8 8' (-q 8 -b 8). Pass it several times to build several binaries.",
+    )
+    parser.add_argument(
+        "--array-compression",
+        dest="arrays",
+        action="append",
+        type=int,
+        default=None,
+        help="Maximum bits of the pointer compression in build_binary (-a), e.g., 64.\n"
+        "Pass it several times to build several binaries.",
+    )
+    parser.add_argument(
+        "--ngram-counter",
+        dest="ngram_counter",
+        action="store_true",
+        help="Train the ARPA LM with ngram_counter.py (Python) even if lmplz is\n"
+        "installed, e.g., to cross-check the output of KenLM. It is used by default\n"
+        "when lmplz is not installed.",
+    )
+    parser.add_argument(
+        "--dev-text",
+        dest="dev_text",
+        default=None,
+        help="Kaldi text file of a dev set. If given, we report the size, load time,\n"
+        "perplexity and decode speed of each LM (binary).",
+    )
+    parser.add_argument(
+        "--report-utts",
+        dest="report_utts",
+        default=200,
+        type=int,
+        help="Number of dev utterances used to measure the decode speed.",
+    )
 
     parser.add_argument(
         "--target_dir",
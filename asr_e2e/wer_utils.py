@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+"""\
+Utils to compute word error rate (WER) and character error rate (CER) incrementally.
+
+We align each reference/hypothesis pair with a vectorized Levenshtein distance
+(one numpy operation per row of the cost matrix) and only keep the counts of
+substitutions, insertions and deletions. Thus, we can evaluate while decoding,
+without storing all the transcripts in memory.
+
+The counts can be broken down by speaker and airport. These are read from the
+utterance ids created by data/utils/spd_xml2csv_batch.py:
+    <keyprefix><airport>_<freq>_<date>_<time>-<speaker>--<t_beg>-<t_end>
+    e.g., atco2_test-set-4h_LKPR_RUZYNE_Radar_120_520MHz_20201025_174652-A--000012-000345
+"""
+
+import os
+import re
+from collections import defaultdict
+
+import numpy as np
+
+# name of the fields we keep per each accumulator
+FIELDS = ("sub", "ins", "del", "ref")
+
+# utterance id of ATCO2 corpora, see: data/utils/spd_xml2csv_batch.py
+_UTT_ID_REGEX = re.compile(r"^(?P<reco>.+)-(?P<spk>[^-]*)--(?P<beg>\d+)-(?P<end>\d+)$")
+# date and time at the end of the recording key, e.g., _20201025_174652
+_RECO_DATE_REGEX = re.compile(r"_[0-9]*_[0-9]*$")
+# airport ICAO code, e.g., LKPR, LSZH, EGPF
+_ICAO_REGEX = re.compile(r"^[A-Z]{4}$")
+
+
+def levenshtein_counts(ref, hyp):
+    """Align two sequences of tokens and count the edit operations.
+    Inputs:
+        - ref: list of reference tokens (words or characters)
+        - hyp: list of hypothesis tokens
+    Output:
+        - numpy array with [substitutions, insertions, deletions, reference length]
+    """
+    n, m = len(ref), len(hyp)
+    if n == 0 or m == 0:
+        return np.array([0, m, n, n], dtype=np.int64)
+
+    # map the tokens to integers, so we can compare them with numpy
+    vocab = {}
+    ref_ids = np.fromiter((vocab.setdefault(x, len(vocab)) for x in ref), np.int32, n)
+    hyp_ids = np.fromiter((vocab.setdefault(x, len(vocab)) for x in hyp), np.int32, m)
+    mismatch = (ref_ids[:, None] != hyp_ids[None, :]).astype(np.int32)
+
+    # cost matrix, first row and column are only insertions/deletions
+    cost = np.empty((n + 1, m + 1), dtype=np.int32)
+    positions = np.arange(m + 1, dtype=np.int32)
+    cost[0] = positions
+    row = np.empty(m + 1, dtype=np.int32)
+
+    for i in range(1, n + 1):
+        prev = cost[i - 1]
+        # match/substitution and deletion do not depend on the current row,
+        row[0] = i
+        np.minimum(prev[:-1] + mismatch[i - 1], prev[1:] + 1, out=row[1:])
+        # insertions: cost[i, j] = min_k<=j (row[k] + j - k), i.e., a running minimum
+        cost[i] = np.minimum.accumulate(row - positions) + positions
+
+    # backtrace to split the distance into the edit operations
+    n_sub, n_ins, n_del = 0, 0, 0
+    i, j = n, m
+    while i > 0 and j > 0:
+        if cost[i, j] == cost[i - 1, j - 1] + mismatch[i - 1, j - 1]:
+            n_sub += mismatch[i - 1, j - 1]
+            i, j = i - 1, j - 1
+        elif cost[i, j] == cost[i - 1, j] + 1:
+            n_del += 1
+            i -= 1
+        else:
+            n_ins += 1
+            j -= 1
+    n_del += i
+    n_ins += j
+
+    return np.array([n_sub, n_ins, n_del, n], dtype=np.int64)
+
+
+def split_words(text):
+    """Tokens used to compute the WER"""
+    return text.split()
+
+
+def split_chars(text):
+    """Tokens used to compute the CER (spaces are counted, as in jiwer)"""
+    return list(" ".join(text.split()))
+
+
+class ErrorRateAccumulator:
+    """Accumulates the edit operations of one system, one utterance at a time.
+    unit: 'word' for WER or 'char' for CER
+    """
+
+    def __init__(self, unit="word"):
+        self.unit = unit
+        self.tokenize = split_words if unit == "word" else split_chars
+        self.totals = np.zeros(len(FIELDS), dtype=np.int64)
+        self.groups = defaultdict(lambda: np.zeros(len(FIELDS), dtype=np.int64))
+        self.num_utts = 0
+
+    def update(self, ref, hyp, groups=None):
+        """Add one utterance, 'groups' is a dict, e.g., {'speaker': 'A', 'airport': 'LKPR'}"""
+        counts = levenshtein_counts(self.tokenize(ref), self.tokenize(hyp))
+        self.totals += counts
+        self.num_utts += 1
+        for name, value in (groups or {}).items():
+            self.groups[(name, value)] += counts
+        return counts
+
+    @staticmethod
+    def error_rate(counts):
+        """(S + I + D) / N in percentage"""
+        if counts[3] == 0:
+            return 0.0
+        return float(100.0 * (counts[0] + counts[1] + counts[2]) / counts[3])
+
+    def result(self):
+        """error rate over all the utterances seen so far"""
+        return self.error_rate(self.totals)
+
+    def to_dict(self):
+        """totals and breakdowns in a dictionary"""
+        out = {"unit": self.unit, "utterances": self.num_utts}
+        out.update(dict(zip(FIELDS, self.totals.tolist())))
+        out["error_rate"] = self.result()
+        out["breakdown"] = {
+            f"{name}={value}": dict(
+                zip(FIELDS, counts.tolist()), error_rate=self.error_rate(counts)
+            )
+            for (name, value), counts in sorted(self.groups.items())
+        }
+        return out
+
+    def report(self, title=""):
+        """human readable table with the totals and the breakdowns"""
+        name = "WER" if self.unit == "word" else "CER"
+        lines = [
+            f"{name} {title}: \t\t{self.result():2f}",
+            "\t{:<40} {:>8} {:>8} {:>8} {:>8} {:>10}".format(
+                "subset", "#sub", "#ins", "#del", "#ref", name
+            ),
+        ]
+        rows = [("all", self.totals)] + [
+            (f"{k}={v}", counts) for (k, v), counts in sorted(self.groups.items())
+        ]
+        for subset, counts in rows:
+            lines.append(
+                "\t{:<40} {:>8} {:>8} {:>8} {:>8} {:>10.2f}".format(
+                    subset, *counts.tolist(), self.error_rate(counts)
+                )
+            )
+        return "\n".join(lines) + "\n"
+
+
+def parse_utt_id(utt_id):
+    """Get speaker and airport from an ATCO2 utterance id (see header of this file).
+    Returns an empty dict if the id does not follow the convention.
+    """
+    match = _UTT_ID_REGEX.match(utt_id)
+    if match is None:
+        return {}
+
+    reco = _RECO_DATE_REGEX.sub("", match.group("reco"))
+    return {"speaker": match.group("spk"), "airport": get_airport_code(reco)}
+
+
+def get_airport_code(name):
+    """ICAO code of the airport in a recording/frequency name, e.g.,
+    LKPR_RUZYNE_Radar_120_520MHz -> LKPR. The key prefix has also underscores,
+    so we look for the first 4-letter upper case field.
+    """
+    return next((x for x in name.split("_") if _ICAO_REGEX.match(x)), name)
+
+
+def load_utt2info(path_to_file):
+    """Load a Kaldi-like file 'utt_id value', e.g., utt2airport or utt2speaker_callsign"""
+    utt2info = {}
+    if path_to_file is None or not os.path.isfile(path_to_file):
+        return utt2info
+    with open(path_to_file, "r") as rd:
+        for line in rd:
+            fields = line.split()
+            if len(fields) > 1:
+                utt2info[fields[0]] = fields[1]
+    return utt2info
+
+
+def get_utt_groups(utt_id, utt2role=None, utt2airport=None):
+    """Groups used in the breakdown of one utterance. We prefer the values
+    in utt2speaker_callsign/utt2airport files (when given) over the utterance id
+    """
+    groups = parse_utt_id(utt_id)
+    if utt2role and utt_id in utt2role:
+        groups["speaker"] = utt2role[utt_id]
+    if utt2airport and utt_id in utt2airport:
+        groups["airport"] = get_airport_code(utt2airport[utt_id])
+    return groups
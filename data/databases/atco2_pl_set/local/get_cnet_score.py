@@ -36,8 +36,34 @@ def get_mean_wordconf_in_cnet(cnet_file):
     return mean_conf
 
 
+def get_mean_wordconf_in_ctm(ctm_file):
+    """compute mean word_confidence per key (1st column) of a CTM file,
+    e.g., the 'hypo.ctm' written by asr_e2e/eval_model.py, exclude <eps>"""
+
+    sum_conf, num_words = {}, {}
+
+    with open(ctm_file, "r") as f_in:
+        for line in f_in:
+            fields = line.split()
+            if len(fields) < 6 or fields[4] == "<eps>":
+                continue
+            key, wrd_conf = fields[0], float(fields[5])
+            sum_conf[key] = sum_conf.get(key, 0.0) + wrd_conf
+            num_words[key] = num_words.get(key, 0) + 1
+
+    return {key: sum_conf[key] / num_words[key] for key in sum_conf}
+
+
 def main():
     # parse arguments from CLI
+    # - get_cnet_score.py <cnet_list>
+    # - get_cnet_score.py --ctm <ctm_file>, confidences of our own ASR model
+    if sys.argv[1] == "--ctm":
+        ctm_file = sys.argv[2]
+        for ctm_key, mean_conf in get_mean_wordconf_in_ctm(ctm_file).items():
+            print(f"{ctm_key} {mean_conf:.8f} {ctm_file}")
+        return
+
     cnet_list = sys.argv[1]
 
     with open(cnet_list, "r") as f_cl:
@@ -26,6 +26,14 @@ def main(data, cnet_path=None):
 
     for rec_key, cnet_conf, cnet_file in data:
 
+        # confidences from the CTM of our own ASR model (get_cnet_score.py --ctm),
+        # there is no LID/SNR in the path, so we only apply the confidence rule
+        if cnet_file.endswith(".ctm"):
+            data_selected_english.append((rec_key, cnet_conf, cnet_file))
+            if cnet_conf > 0.8:
+                data_selected.append((rec_key, cnet_conf, cnet_file))
+            continue
+
         path, lid_score, snr, fname = cnet_file.rsplit("/", maxsplit=3)
         lid_score = float(lid_score)
         snr = int(snr)
@@ -14,27 +14,24 @@
 """
 
 import argparse
+import os
+import sys
+
+# the text cleaning is shared with the NER and speaker role recipes
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../ner")
+)
+from text_cleaning import clean_utterance
 
 
 def clean_input_utterance(input_text):
-    """Function to clean the input utterance
+    """Function to clean the input utterance (see ner/text_cleaning.py)
     Inputs:
         - input text
     Output:
-        - cleaned text
+        - cleaned and lower-cased text
     """
-
-    # remove all the words starting with <> or [],
-    sequence = " ".join(filter(lambda x: x[0] != "<", input_text.strip().split()))
-    sequence = " ".join(filter(lambda x: x[-1] != ">", sequence.split()))
-    sequence = " ".join(filter(lambda x: x[0] != "[", sequence.split()))
-    sequence = " ".join(filter(lambda x: x[-1] != "]", sequence.split()))
-
-    # remove the greetings in ATCO2 format dobry_den_(greet)
-    sequence = " ".join(filter(lambda x: "(" not in x, sequence.split()))
-
-    # return and lower case
-    return sequence.lower()
+    return clean_utterance(input_text, lower=True)
 
 
 def text_to_tags(text, tag="O"):
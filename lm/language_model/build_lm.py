@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+DESCRIPTION = """\
+Build one interpolated n-gram LM (KenLM binary) from several text corpora,
+the Python version of the steps in RUN_LM_TRAINING.sh, without SRILM:
+
+    1. prepare: normalize and dedupe each corpus (in parallel)
+    2. train:   one LM per corpus with lmplz (in parallel)
+    3. weights: estimate the interpolation weights (lambdas) on a dev set (EM)
+    4. mix:     linear interpolation of the LMs into one ARPA file
+    5. binary:  KenLM binary of the mixed LM, and perplexity on the dev set
+
+The corpora are defined in a JSON config file (see corpora.json), paths are
+relative to the config file. Each step is cached in --workdir with a hash of its
+inputs, so only the steps whose inputs changed are run again.
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+# ======================================================================
+# cache of the steps
+# ======================================================================
+
+
+def hash_files(paths, extra=""):
+    """sha1 of the content of some files (read in blocks) and an extra string"""
+    sha1 = hashlib.sha1(extra.encode("utf-8"))
+    for path in paths:
+        sha1.update(path.encode("utf-8"))
+        with open(path, "rb") as rd:
+            for block in iter(lambda: rd.read(1024 * 1024), b""):
+                sha1.update(block)
+    return sha1.hexdigest()
+
+
+class StepCache:
+    """Stores the key (hash of the inputs) of each finished step in workdir/.stamps,
+    a step is skipped if its key did not change and its outputs exist"""
+
+    def __init__(self, workdir, force=False):
+        self.folder = os.path.join(workdir, ".stamps")
+        self.force = force
+        os.makedirs(self.folder, exist_ok=True)
+
+    def is_done(self, step, key, outputs):
+        stamp = os.path.join(self.folder, step)
+        if self.force or not os.path.isfile(stamp):
+            return False
+        if not all(os.path.exists(x) for x in outputs):
+            return False
+        with open(stamp, "r") as rd:
+            return rd.read().strip() == key
+
+    def done(self, step, key):
+        with open(os.path.join(self.folder, step), "w") as f:
+            f.write(key + "\n")
+
+
+# ======================================================================
+# 1. prepare the corpora
+# ======================================================================
+
+
+def normalize_line(line, kaldi=False):
+    """Same as 'f_preprocess' + 'Any-Lower' in RUN_LM_TRAINING.sh: remove the
+    <tags> and [annotations], extra spaces, and lowercase"""
+    if kaldi:
+        line = line.split(" ", maxsplit=1)[1] if " " in line.strip() else ""
+    line = re.sub(r"<[a-z]*>", "", line)
+    line = re.sub(r"\[[^]]*\]", "", line)
+    return " ".join(line.split()).lower()
+
+
+def read_corpus_lines(corpus):
+    """Lines of all the files of a corpus, maybe piped through a filter command"""
+    for path in corpus["files"]:
+        if corpus.get("filter"):
+            with open(path, "rb") as rd:
+                output = subprocess.run(
+                    shlex.split(corpus["filter"]),
+                    stdin=rd,
+                    capture_output=True,
+                    check=True,
+                    cwd=corpus.get("folder"),
+                ).stdout
+            yield from output.decode("utf-8").splitlines()
+        else:
+            with open(path, "r", encoding="utf-8") as rd:
+                yield from rd
+
+
+def prepare_corpus(corpus, output_path):
+    """Normalize and dedupe (sort | uniq) one corpus, runs in the process pool"""
+    kaldi = corpus.get("format", "text") == "kaldi"
+    lines = (normalize_line(x, kaldi=kaldi) for x in read_corpus_lines(corpus))
+    lines = [x for x in lines if x]
+    if corpus.get("dedupe", True):
+        lines = sorted(set(lines))
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.writelines(x + "\n" for x in lines)
+    return len(lines)
+
+
+# ======================================================================
+# 2. train one LM per corpus
+# ======================================================================
+
+
+def train_corpus_lm(corpus_path, arpa_path, order=3, limit_vocab=None):
+    """n-gram LM of one corpus with lmplz (modified Kneser-Ney). We use
+    --discount_fallback, the small corpora (e.g., runway numbers) do not have
+    enough singletons to estimate the discounts"""
+    cmd = (
+        f"lmplz -o {order} --discount_fallback --text {corpus_path} --arpa {arpa_path}"
+    )
+    if limit_vocab is not None:
+        cmd += f" --limit_vocab_file {limit_vocab}"
+    print(cmd)
+    subprocess.run(shlex.split(cmd), stdout=sys.stdout, stderr=sys.stderr, check=True)
+
+
+def read_arpa_ngrams(arpa_path):
+    """n-grams (tuples of words) of an ARPA file, per order (probabilities are not kept)"""
+    ngrams = defaultdict(list)
+    order = 0
+    with open(arpa_path, "r", encoding="utf-8") as rd:
+        for line in rd:
+            line = line.strip()
+            if not line or line.startswith("\\data\\") or line.startswith("ngram "):
+                continue
+            match = re.match(r"^\\(\d+)-grams:$", line)
+            if match:
+                order = int(match.group(1))
+            elif line == "\\end\\":
+                break
+            elif order > 0:
+                ngrams[order].append(tuple(line.split("\t")[1].split(" ")))
+    return ngrams
+
+
+# ======================================================================
+# 3. interpolation weights
+# ======================================================================
+
+
+def dev_token_probs(models, sentences):
+    """Probability of each dev token (words + </s>) with each LM, array (tokens, LMs).
+    The probability is 0 for the words out of the vocabulary of a LM, and the
+    tokens that are OOV for all the LMs are discarded"""
+    columns = []
+    for model in models:
+        column = []
+        for sentence in sentences:
+            column += [
+                0.0 if oov else 10.0**prob
+                for prob, _, oov in model.full_scores(sentence, bos=True, eos=True)
+            ]
+        columns.append(column)
+
+    probs = np.array(columns).T
+    return probs[probs.sum(axis=1) > 0]
+
+
+def optimize_weights(probs, max_iters=200, tolerance=1e-6):
+    """Interpolation weights that maximize the likelihood of the dev tokens (EM),
+    like 'compute-best-mix' in SRILM. Returns the weights and the dev perplexity"""
+    weights = np.full(probs.shape[1], 1.0 / probs.shape[1])
+    previous_log_prob = -np.inf
+    for _ in range(max_iters):
+        mixture = probs @ weights
+        log_prob = np.log(mixture).sum()
+        # posterior of each LM for each token, averaged over the tokens
+        weights = (probs * weights / mixture[:, None]).mean(axis=0)
+        if log_prob - previous_log_prob < tolerance * abs(log_prob):
+            break
+        previous_log_prob = log_prob
+    return weights, float(np.exp(-log_prob / len(probs)))
+
+
+# ======================================================================
+# 4. mix the LMs
+# ======================================================================
+
+
+def mix_lms(models, arpa_paths, weights, output_path, order=3):
+    """Static linear interpolation of the LMs into one ARPA file:
+        p(w|h) = sum_i weight_i * p_i(w|h), for all the n-grams of all the LMs
+    p_i(w|h) is computed by KenLM (with backoff), then, the backoff weights of
+    the mixed LM are recomputed so the probabilities sum to one (like 'ngram
+    -mix-lm' in SRILM)"""
+    import kenlm
+
+    # all the n-grams of all the LMs, lower orders first
+    ngrams = defaultdict(set)
+    for arpa_path in arpa_paths:
+        for n, grams in read_arpa_ngrams(arpa_path).items():
+            ngrams[n].update(grams)
+
+    # KenLM state after a history, cached per LM
+    state_cache = [dict() for _ in models]
+
+    def history_state(i, history):
+        if history not in state_cache[i]:
+            state = kenlm.State()
+            if history[:1] == ("<s>",):
+                models[i].BeginSentenceWrite(state)
+                words = history[1:]
+            else:
+                models[i].NullContextWrite(state)
+                words = history
+            for word in words:
+                next_state = kenlm.State()
+                models[i].BaseScore(state, word, next_state)
+                state = next_state
+            state_cache[i][history] = state
+        return state_cache[i][history]
+
+    def mixed_prob(history, word):
+        prob = 0.0
+        for i, model in enumerate(models):
+            if word in model or word == "<unk>":
+                log10_prob = model.BaseScore(
+                    history_state(i, history), word, kenlm.State()
+                )
+                prob += weights[i] * 10.0**log10_prob
+        return prob
+
+    # log10 probabilities of the mixed LM
+    log10_probs = {}
+    for n in range(1, order + 1):
+        for ngram in ngrams[n]:
+            if ngram == ("<s>",):
+                log10_probs[ngram] = -99.0
+            else:
+                log10_probs[ngram] = np.log10(
+                    max(mixed_prob(ngram[:-1], ngram[-1]), 1e-99)
+                )
+
+    # backoff weights, histories with lower order first (their backoff is needed)
+    backoffs = {}
+
+    def lookup(history, word):
+        """log10 p(word|history) in the mixed LM (with backoff)"""
+        log10_backoff = 0.0
+        while history + (word,) not in log10_probs:
+            log10_backoff += backoffs.get(history, 0.0)
+            history = history[1:]
+        return log10_backoff + log10_probs[history + (word,)]
+
+    for n in range(1, order):
+        children = defaultdict(list)
+        for ngram in ngrams[n + 1]:
+            children[ngram[:-1]].append(ngram[-1])
+
+        for history, words in children.items():
+            numerator = 1.0 - sum(10.0 ** log10_probs[history + (w,)] for w in words)
+            denominator = 1.0 - sum(10.0 ** lookup(history[1:], w) for w in words)
+            backoffs[history] = np.log10(
+                max(numerator, 1e-10) / max(denominator, 1e-10)
+            )
+
+    # write the ARPA file
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("\n\\data\\\n")
+        for n in range(1, order + 1):
+            f.write(f"ngram {n}={len(ngrams[n])}\n")
+        for n in range(1, order + 1):
+            f.write(f"\n\\{n}-grams:\n")
+            for ngram in sorted(ngrams[n]):
+                line = f"{log10_probs[ngram]:.6f}\t{' '.join(ngram)}"
+                if n < order:
+                    line += f"\t{backoffs.get(ngram, 0.0):.6f}"
+                f.write(line + "\n")
+        f.write("\n\\end\\\n")
+
+
+# ======================================================================
+# the pipeline
+# ======================================================================
+
+
+def load_config(path_config):
+    """JSON config, the paths of the files are relative to the config file"""
+    with open(path_config, "r") as rd:
+        config = json.load(rd)
+    folder = os.path.dirname(os.path.abspath(path_config))
+
+    def resolve(corpus):
+        corpus["files"] = [os.path.join(folder, x) for x in corpus["files"]]
+        # the filter commands also run in the folder of the config file
+        corpus["folder"] = folder
+        return corpus
+
+    config["dev"] = resolve(config["dev"])
+    corpora = {}
+    for name, corpus in config["corpora"].items():
+        corpus = resolve(corpus)
+        missing = [x for x in corpus["files"] if not os.path.isfile(x)]
+        if missing and corpus.get("build"):
+            # some resources are generated by a script, e.g., waypoint_text
+            subprocess.run(corpus["build"], shell=True, check=True, cwd=folder)
+            missing = [x for x in corpus["files"] if not os.path.isfile(x)]
+        if missing and corpus.get("optional", False):
+            print(f"Warning, skipping corpus {name}, missing files: {missing}")
+            continue
+        if missing:
+            raise FileNotFoundError(f"Corpus {name}, missing files: {missing}")
+        corpora[name] = corpus
+    config["corpora"] = corpora
+    return config
+
+
+def build(
+    config, workdir, lm_name, order=3, limit_vocab=None, num_workers=4, force=False
+):
+    """Run the pipeline, returns the path to the KenLM binary"""
+    import kenlm
+
+    os.makedirs(f"{workdir}/corpora", exist_ok=True)
+    os.makedirs(f"{workdir}/lms", exist_ok=True)
+    cache = StepCache(workdir, force=force)
+    corpora = dict(config["corpora"], dev=config["dev"])
+
+    # 1. prepare the corpora (and the dev set) in parallel
+    keys = {}
+    with concurrent.futures.ProcessPoolExecutor(num_workers) as pool:
+        jobs = {}
+        for name, corpus in corpora.items():
+            output_path = f"{workdir}/corpora/{name}"
+            keys[name] = hash_files(corpus["files"], json.dumps(corpus, sort_keys=True))
+            if cache.is_done(f"prepare_{name}", keys[name], [output_path]):
+                print(f"*** prepare {name}: inputs did not change, skipping ***")
+                continue
+            jobs[name] = pool.submit(prepare_corpus, corpus, output_path)
+        for name, job in jobs.items():
+            print(f"*** prepare {name}: {job.result()} lines ***")
+            cache.done(f"prepare_{name}", keys[name])
+
+    # 2. one LM per corpus, lmplz runs in parallel (threads wait for the processes)
+    names = list(config["corpora"])
+    arpa_paths = [f"{workdir}/lms/{name}.o{order}g.arpa" for name in names]
+    vocab_key = hash_files([limit_vocab]) if limit_vocab else ""
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as pool:
+        jobs = {}
+        for name, arpa_path in zip(names, arpa_paths):
+            keys[f"lm_{name}"] = hash_files([], f"{keys[name]} {order} {vocab_key}")
+            if cache.is_done(f"lm_{name}", keys[f"lm_{name}"], [arpa_path]):
+                print(f"*** train {name}: inputs did not change, skipping ***")
+                continue
+            jobs[name] = pool.submit(
+                train_corpus_lm,
+                f"{workdir}/corpora/{name}",
+                arpa_path,
+                order,
+                limit_vocab,
+            )
+        for name, job in jobs.items():
+            job.result()
+            cache.done(f"lm_{name}", keys[f"lm_{name}"])
+
+    with open(f"{workdir}/corpora/dev", "r", encoding="utf-8") as rd:
+        dev_sentences = [x.strip() for x in rd if x.strip()]
+    models = [kenlm.Model(x) for x in arpa_paths]
+
+    # 3. interpolation weights on the dev set
+    path_weights = f"{workdir}/lms/{lm_name}.weights.json"
+    keys["weights"] = hash_files(
+        [], " ".join([keys["dev"]] + [keys[f"lm_{x}"] for x in names])
+    )
+    if cache.is_done("weights", keys["weights"], [path_weights]):
+        print("*** weights: inputs did not change, skipping ***")
+    else:
+        weights, ppl = optimize_weights(dev_token_probs(models, dev_sentences))
+        with open(path_weights, "w") as f:
+            json.dump(
+                {"weights": dict(zip(names, weights.tolist())), "dev_ppl": ppl},
+                f,
+                indent=2,
+            )
+        cache.done("weights", keys["weights"])
+
+    with open(path_weights, "r") as rd:
+        weights = json.load(rd)["weights"]
+    for name in names:
+        print(f"    lambda {name:30s} {weights[name]:.4f}")
+
+    # 4. mix the LMs, and 5. KenLM binary
+    path_arpa = f"{workdir}/lms/{lm_name}.o{order}g.arpa"
+    path_binary = f"{workdir}/lms/{lm_name}.o{order}g.binary"
+    keys["mix"] = hash_files([], keys["weights"] + json.dumps(weights, sort_keys=True))
+    if cache.is_done("mix", keys["mix"], [path_binary]):
+        print("*** mix: inputs did not change, skipping ***")
+    else:
+        mix_lms(models, arpa_paths, [weights[x] for x in names], path_arpa, order=order)
+        cmd = f"build_binary trie {path_arpa} {path_binary}"
+        print(cmd)
+        subprocess.run(
+            shlex.split(cmd), stdout=sys.stdout, stderr=sys.stderr, check=True
+        )
+        os.remove(path_arpa)
+        cache.done("mix", keys["mix"])
+
+    mixed_model = kenlm.Model(path_binary)
+    num_tokens = sum(len(x.split()) + 1 for x in dev_sentences)
+    log10_prob = sum(mixed_model.score(x, bos=True, eos=True) for x in dev_sentences)
+    print(
+        f"*** dev perplexity of {path_binary}: {10.0 ** (-log10_prob / num_tokens):.2f}"
+    )
+    return path_binary
+
+
+def parse_args():
+    """parser"""
+    parser = argparse.ArgumentParser(
+        description=DESCRIPTION, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--config",
+        default=os.path.join(os.path.dirname(__file__), "corpora.json"),
+        help="JSON file with the corpora and the dev set, see corpora.json",
+    )
+    parser.add_argument("--order", type=int, default=3, help="order of the n-gram LM")
+    parser.add_argument(
+        "--limit-vocab",
+        default=None,
+        help="Vocabulary file (words separated by spaces/newlines) to restrict the LMs",
+    )
+    parser.add_argument("--lm-name", default="all_data", help="name of the final LM")
+    parser.add_argument("-j", "--num-workers", type=int, default=4)
+    parser.add_argument(
+        "--force", action="store_true", help="Run all the steps, ignore the cache"
+    )
+
+    # must give,
+    parser.add_argument(
+        "--workdir", required=True, help="Folder for the corpora, the LMs and the cache"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Main code execution"""
+    args = parse_args()
+
+    for tool in ["lmplz", "build_binary"]:
+        if shutil.which(tool) is None:
+            print(f"Missing {tool}! please install KenLM: https://github.com/kpu/kenlm")
+            sys.exit(1)
+
+    path_binary = build(
+        load_config(args.config),
+        args.workdir,
+        args.lm_name,
+        order=args.order,
+        limit_vocab=args.limit_vocab,
+        num_workers=args.num_workers,
+        force=args.force,
+    )
+    print(f"Done! LM in {path_binary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+# File with some utils to cache the cleaned and tokenized test sets on disk
+#   - the key of a cached test set is the hash of the content of the file, the
+#     fingerprint of the tokenizer (vocabulary, normalization, special tokens and
+#     max length, not its path) and the label map. Thus, all the checkpoints of a
+#     model share the cached test sets, and a modified file is tokenized again
+#   - the test sets are stored as pre-tokenized arrays (see memmap_utils.py), so
+#     evaluating a checkpoint only runs the forward passes
+
+import hashlib
+import json
+import os
+
+from memmap_utils import load_pretokenized, write_pretokenized
+
+# bump it if the format of the cached data changes
+CACHE_VERSION = 1
+
+
+def file_fingerprint(path_to_file, chunk_size=1 << 20):
+    """SHA-256 of the content of a file"""
+    digest = hashlib.sha256()
+    with open(path_to_file, "rb") as rd:
+        for chunk in iter(lambda: rd.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer):
+    """SHA-256 of what defines the output of a tokenizer, independently of the
+    folder where it is stored"""
+    digest = hashlib.sha256(type(tokenizer).__name__.encode("utf8"))
+    if getattr(tokenizer, "is_fast", False):
+        digest.update(tokenizer.backend_tokenizer.to_str().encode("utf8"))
+    else:
+        vocab = sorted(tokenizer.get_vocab().items())
+        digest.update(json.dumps(vocab).encode("utf8"))
+        digest.update(str(tokenizer.init_kwargs.get("do_lower_case")).encode("utf8"))
+    digest.update(
+        json.dumps([tokenizer.model_max_length, tokenizer.all_special_tokens]).encode(
+            "utf8"
+        )
+    )
+    return digest.hexdigest()
+
+
+def cached_test_set(cache_dir, path_to_file, tokenizer, task, build_fn, extra=None):
+    """Load a cleaned and tokenized test set from the cache, build_fn() is only
+    called (and its output stored) on a cache miss.
+    build_fn returns: utt_ids, encodings (without padding), labels (or None), meta
+    extra: anything else the output depends on, e.g., the label map of the model
+    Outputs: encodings, labels and info (utt_ids, meta) of the test set
+    """
+    key = hashlib.sha256(
+        json.dumps(
+            {
+                "version": CACHE_VERSION,
+                "task": task,
+                "file": file_fingerprint(path_to_file),
+                "tokenizer": tokenizer_fingerprint(tokenizer),
+                "extra": extra,
+            },
+            sort_keys=True,
+        ).encode("utf8")
+    ).hexdigest()[:20]
+    name = os.path.basename(path_to_file.rstrip("/"))
+    prefix = f"{cache_dir}/{name}.{task}.{key}"
+
+    if not os.path.isfile(f"{prefix}.json"):
+        print(f"Cache miss, cleaning and tokenizing: {path_to_file}")
+        os.makedirs(cache_dir, exist_ok=True)
+        utt_ids, encodings, labels, meta = build_fn()
+
+        # write under a temporary prefix and move the files, the .json (last one)
+        # marks a complete entry, even with concurrent evaluations
+        tmp_prefix = f"{prefix}.tmp{os.getpid()}"
+        write_pretokenized(tmp_prefix, utt_ids, encodings, labels, meta=meta)
+        for path in sorted(os.listdir(cache_dir), key=lambda x: x.endswith(".json")):
+            if path.startswith(os.path.basename(tmp_prefix) + "."):
+                suffix = path[len(os.path.basename(tmp_prefix)) :]
+                os.replace(f"{cache_dir}/{path}", f"{prefix}{suffix}")
+    else:
+        print(f"Using the cached test set: {prefix}")
+
+    return load_pretokenized(prefix)
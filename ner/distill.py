@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+"""\
+Script to distill a fine-tuned NER model (ner/train_ner.py) or speaker role model
+(speaker_role/train_sec_classification.py) into a small and fast student (2-4
+layers), for real-time tagging on CPU.
+
+The student is initialized from the teacher (embeddings, evenly spaced layers and
+classifier) and trained on the soft labels (logits) of the teacher over unlabeled
+transcripts, e.g., the ATCO2-PL-set (Kaldi text file, no tags are needed).
+
+The output folder contains the student and the tokenizer, it can be used as any
+other model by inference_ner.py, eval_ner.py or eval_sec_classification.py. If a
+labeled --test-data is given, the F1 gap and the CPU latency speedup w.r.t. the
+teacher are written in {output_folder}/distillation_report.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+import torch
+import transformers
+from distill_utils import (
+    DistillationTrainer,
+    UnlabeledDataset,
+    build_student,
+    evaluate_f1,
+    measure_latency,
+    read_test_set,
+    read_transcripts,
+)
+from onnx_utils import MODEL_CLASSES
+from transformers import (
+    AutoTokenizer,
+    DataCollatorWithPadding,
+    TrainingArguments,
+    set_seed,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-t",
+        "--task",
+        choices=list(MODEL_CLASSES),
+        default="token-classification",
+        help="token-classification (NER) or sequence-classification (speaker role)",
+    )
+    parser.add_argument(
+        "-l",
+        "--num-layers",
+        type=int,
+        default=4,
+        help="Number of transformer layers of the student (2-4)",
+    )
+    parser.add_argument(
+        "-T",
+        "--temperature",
+        type=float,
+        default=2.0,
+        help="Temperature of the soft labels of the teacher",
+    )
+
+    # some training parameters
+    parser.add_argument(
+        "-s", "--seed", type=int, default=1234, help="Seed for training"
+    )
+    parser.add_argument(
+        "-tb", "--train-batch-size", type=int, default=32, help="Training batch size"
+    )
+    parser.add_argument(
+        "--learning-rate", type=float, default=1e-4, help="Learning rate"
+    )
+    parser.add_argument(
+        "--warmup-steps", type=int, default=500, help="Number of warm up steps"
+    )
+    parser.add_argument(
+        "--logging-steps", type=int, default=500, help="Logging steps size"
+    )
+    parser.add_argument(
+        "--max-steps",
+        type=int,
+        default=10000,
+        help="Maximum number of steps to train the student",
+    )
+    parser.add_argument(
+        "--max-train-samples",
+        type=int,
+        default=-1,
+        help="Maximum number of unlabeled transcripts, -1 to use all of them",
+    )
+    parser.add_argument(
+        "--report-to",
+        type=str,
+        default=None,
+        help="Where to report the results, you can choose e.g., WANDB",
+    )
+
+    # evaluation of teacher vs student
+    parser.add_argument(
+        "--test-data",
+        default=None,
+        help="Labeled test set for the report: utt2text_tags (NER) or utt2spk_id",
+    )
+    parser.add_argument(
+        "--latency-batch-size",
+        type=int,
+        default=1,
+        help="Utterances per call when measuring the CPU latency",
+    )
+
+    parser.add_argument("teacher_model", help="Folder with the fine-tuned teacher")
+    parser.add_argument(
+        "train_data",
+        help="Unlabeled transcripts (Kaldi text), e.g., ATCO2-PL-set train/text",
+    )
+    parser.add_argument(
+        "output_folder", help="Folder where to store the student and the report"
+    )
+    return parser.parse_args()
+
+
+def report_teacher_student(args, teacher, student, tokenizer):
+    """F1 gap and CPU latency speedup of the student w.r.t. the teacher"""
+    encodings, labels = read_test_set(
+        args.test_data, args.task, tokenizer, teacher.config.label2id
+    )
+    sentences = tokenizer.batch_decode(
+        encodings["input_ids"][:500], skip_special_tokens=True
+    )
+
+    report = {"test_data": args.test_data, "num_layers": args.num_layers}
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    for name, model in [("teacher", teacher), ("student", student)]:
+        report[f"{name}_f1"] = evaluate_f1(
+            model, tokenizer, encodings, labels, device=device
+        )
+        report[f"{name}_latency_ms"] = measure_latency(
+            model, tokenizer, sentences, batch_size=args.latency_batch_size
+        )
+    report["f1_gap"] = report["teacher_f1"] - report["student_f1"]
+    report["speedup"] = report["teacher_latency_ms"] / report["student_latency_ms"]
+
+    with open(f"{args.output_folder}/distillation_report", "w") as f:
+        f.write(f"TEACHER: {args.teacher_model}\nSTUDENT: {args.output_folder}\n")
+        f.write(f"TEST DATASET: {args.test_data}\n\n")
+        f.write(
+            f"F1 (macro)  teacher: {report['teacher_f1']:.2f}% "
+            f"student: {report['student_f1']:.2f}% "
+            f"(gap: {report['f1_gap']:.2f}%)\n"
+        )
+        f.write(
+            f"CPU latency teacher: {report['teacher_latency_ms']:.2f} ms "
+            f"student: {report['student_latency_ms']:.2f} ms "
+            f"(speedup: {report['speedup']:.2f}x, "
+            f"batch size {args.latency_batch_size})\n"
+        )
+    with open(f"{args.output_folder}/distillation_report.json", "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def main(args):
+    """Main code execution"""
+    # Setup logging
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+    logger.setLevel(logging.INFO)
+    transformers.utils.logging.set_verbosity(logging.INFO)
+    set_seed(args.seed)
+    os.makedirs(args.output_folder, exist_ok=True)
+
+    logger.info(f"*** Loading the teacher ({args.task}): {args.teacher_model} ***")
+    teacher = MODEL_CLASSES[args.task].from_pretrained(args.teacher_model)
+    tokenizer = AutoTokenizer.from_pretrained(
+        args.teacher_model, use_fast=True, do_lower_case=True
+    )
+
+    student, layers = build_student(teacher, args.num_layers)
+    logger.info(f"*** Student with the layers {layers} of the teacher ***")
+
+    # unlabeled transcripts, tokenized without padding (done by the collator)
+    max_sentences = None if args.max_train_samples == -1 else args.max_train_samples
+    sentences = read_transcripts(args.train_data, max_sentences=max_sentences)
+    logger.info(f"*** {len(sentences)} unlabeled transcripts ***")
+    train_dataset = UnlabeledDataset(tokenizer(sentences, truncation=True))
+
+    training_args = TrainingArguments(
+        report_to=args.report_to,
+        output_dir=args.output_folder,
+        per_device_train_batch_size=args.train_batch_size,
+        learning_rate=args.learning_rate,
+        warmup_steps=args.warmup_steps,
+        weight_decay=0.01,
+        logging_dir=args.output_folder + "/logs",
+        logging_steps=args.logging_steps,
+        max_steps=args.max_steps,
+        save_strategy="no",
+        seed=args.seed,
+    )
+    trainer = DistillationTrainer(
+        model=student,
+        args=training_args,
+        train_dataset=train_dataset,
+        data_collator=DataCollatorWithPadding(tokenizer),
+        teacher=teacher,
+        temperature=args.temperature,
+    )
+
+    logger.info("*** Distillation ***")
+    train_results = trainer.train()
+    trainer.log_metrics("train", train_results.metrics)
+    trainer.save_metrics("train", train_results.metrics)
+    trainer.save_model(output_dir=f"{args.output_folder}/")
+    tokenizer.save_pretrained(f"{args.output_folder}/")
+
+    if args.test_data is not None:
+        logger.info("*** Teacher vs student ***")
+        report = report_teacher_student(args, teacher, student.cpu(), tokenizer)
+        logger.info(
+            f"F1 gap: {report['f1_gap']:.2f}%, CPU speedup: {report['speedup']:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
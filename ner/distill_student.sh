@@ -0,0 +1,77 @@
+#!/bin/bash
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License 
+
+# script to distill a fine-tuned BERT-base NER (or speaker role) model into a small
+# student (2-4 layers), trained on the logits of the teacher over the unlabeled
+# transcripts of the ATCO2-PL-set. The student is evaluated against the teacher
+# (F1 gap and CPU latency speedup) on a labeled test set.
+
+# You can pass a qsub command (SunGrid Engine)
+#       :an example is passing --cmd "src/sge/queue.pl h='*'-V", add your configuration
+
+set -euo pipefail
+
+# static vars
+cmd='none'
+
+# reporting, default=none, you can use Weight & Biases, report_to=wandb
+report_to=none
+
+# teacher model and task: token-classification (NER) or sequence-classification (speaker role)
+task=token-classification
+teacher_model=experiments/results/ner/baseline/bert-base-uncased/1234/atco2_test_set_1h
+num_layers=4
+temperature=2.0
+
+# training params
+seed=1234
+train_batch_size=32
+learning_rate=1e-4
+warmup_steps=500
+logging_steps=500
+max_steps=10000
+
+# default is -1, which means using all the unlabeled transcripts
+max_number_of_samples="-1"
+output_dir=experiments/results/distillation
+
+# unlabeled transcripts (ATCO2-PL-set) and labeled test set for the report
+train_data=experiments/data/atco2_pl_set/train/text
+test_data=experiments/data/other/atco2_test_set_1h/ner/utt2text_tags
+# test_data=experiments/data/other/uwb_atcc/test/spkid_exp/utt2spk_id  # speaker role
+
+# with this we can parse options from CLI
+. data/utils/parse_options.sh
+
+output_folder=$output_dir/$task/$(basename $teacher_model)_${num_layers}layers/$seed
+
+# configure a GPU to use if we a defined 'CMD'
+if [ ! "$cmd" == 'none' ]; then
+  basename=distill_${task}_${num_layers}layers_${seed}_${max_steps}steps
+  cmd="$cmd -N ${basename} ${output_folder}/log/${basename}.log"
+else
+  cmd=''
+fi
+
+$cmd python3 ner/distill.py \
+  --task $task \
+  --num-layers $num_layers \
+  --temperature $temperature \
+  --report-to $report_to \
+  --seed $seed \
+  --train-batch-size $train_batch_size \
+  --learning-rate $learning_rate \
+  --warmup-steps $warmup_steps \
+  --logging-steps $logging_steps \
+  --max-steps $max_steps \
+  --max-train-samples $max_number_of_samples \
+  --test-data "$test_data" \
+  $teacher_model $train_data $output_folder
+
+echo "Done distilling $teacher_model into a $num_layers-layer student ($task)"
+exit 0
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+# File with some utils to distill the BERT-base NER and speaker role models
+#   - student: same architecture with 2-4 layers, initialized from the embeddings,
+#     a subset of the layers and the classifier of the teacher
+#   - Trainer that fits the student to the soft labels (logits) of the teacher on
+#     unlabeled transcripts (e.g., ATCO2-PL-set)
+#   - F1 on a labeled test set and CPU latency, to compare teacher and student
+
+import copy
+import time
+
+import numpy as np
+import torch
+from ner_utils import clean_input_utterance, encode_tags, read_atc_ner_data
+from sklearn.metrics import f1_score
+from torch import nn
+from transformers import Trainer
+
+
+def build_student(teacher, num_layers):
+    """Copy of the teacher with num_layers transformer layers, evenly spaced in the
+    teacher (first and last layers included). The student has the same class as the
+    teacher, thus it is loaded/used as any other fine-tuned model"""
+    config = copy.deepcopy(teacher.config)
+    layers = np.linspace(0, config.num_hidden_layers - 1, num_layers).round()
+    config.num_hidden_layers = num_layers
+    student = type(teacher)(config)
+
+    # map the layers of the student to the ones of the teacher
+    teacher_state = teacher.state_dict()
+    student_state = {}
+    for key in student.state_dict():
+        source = key
+        if ".encoder.layer." in key:
+            prefix, rest = key.split(".encoder.layer.", 1)
+            layer, rest = rest.split(".", 1)
+            source = f"{prefix}.encoder.layer.{int(layers[int(layer)])}.{rest}"
+        student_state[key] = teacher_state[source]
+    student.load_state_dict(student_state)
+    return student, layers.astype(int).tolist()
+
+
+def distillation_loss(student_logits, teacher_logits, attention_mask=None, T=2.0):
+    """KL divergence between the softened distributions of teacher and student,
+    scaled by T^2. For token classification, only the non-padding tokens count"""
+    log_p_student = nn.functional.log_softmax(student_logits / T, dim=-1)
+    p_teacher = nn.functional.softmax(teacher_logits / T, dim=-1)
+    kl = (p_teacher * (torch.log(p_teacher + 1e-12) - log_p_student)).sum(dim=-1)
+
+    if kl.dim() == 2 and attention_mask is not None:
+        mask = attention_mask.to(kl.dtype)
+        return (kl * mask).sum() / mask.sum() * T**2
+    return kl.mean() * T**2
+
+
+class DistillationTrainer(Trainer):
+    """Trainer where the loss of the student is the distillation loss w.r.t. the
+    logits of the (frozen) teacher, computed on the fly for each batch"""
+
+    def __init__(self, *args, teacher=None, temperature=2.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.teacher = teacher.to(self.args.device).eval()
+        self.temperature = temperature
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        inputs.pop("labels", None)
+        outputs = model(**inputs)
+        with torch.no_grad():
+            teacher_logits = self.teacher(**inputs).logits
+
+        loss = distillation_loss(
+            outputs.logits,
+            teacher_logits,
+            attention_mask=inputs.get("attention_mask"),
+            T=self.temperature,
+        )
+        return (loss, outputs) if return_outputs else loss
+
+
+class UnlabeledDataset(torch.utils.data.Dataset):
+    """Dataset of tokenized utterances (without padding and labels)"""
+
+    def __init__(self, encodings):
+        self.encodings = encodings
+
+    def __getitem__(self, idx):
+        return {key: val[idx] for key, val in self.encodings.items()}
+
+    def __len__(self):
+        return len(self.encodings["input_ids"])
+
+
+def read_transcripts(path_to_file, max_sentences=None):
+    """Cleaned, lower-cased transcripts of a Kaldi text file (<utt_id> <text>),
+    e.g., the unlabeled ATCO2-PL-set"""
+    sentences = []
+    with open(path_to_file, "r") as rd:
+        for line in rd:
+            sentence = clean_input_utterance(" ".join(line.split(" ")[1:]).rstrip())
+            if sentence.strip():
+                sentences.append(sentence.lower())
+            if max_sentences is not None and len(sentences) == max_sentences:
+                break
+    return sentences
+
+
+def read_test_set(path_to_file, task, tokenizer, label2id):
+    """Tokenized sentences and labels of a labeled test set:
+    - token-classification: utt2text_tags, labels aligned to the first subword
+    - sequence-classification: utt2spk_id (<id> <0/1> <atco/pilot> <text>)
+    """
+    if task == "token-classification":
+        texts, tags = read_atc_ner_data(path_to_file)
+        encodings = tokenizer(
+            texts,
+            is_split_into_words=True,
+            return_offsets_mapping=True,
+            truncation=True,
+        )
+        labels = encode_tags(label2id, tags, encodings)
+        encodings.pop("offset_mapping")
+        return encodings, labels
+
+    sentences, labels = [], []
+    with open(path_to_file, "r") as rd:
+        for line in rd:
+            fields = line.rstrip().split(" ")
+            sentences.append(clean_input_utterance(" ".join(fields[3:])).lower())
+            labels.append(int(fields[1]))
+    return tokenizer(sentences, truncation=True), labels
+
+
+def evaluate_f1(model, tokenizer, encodings, labels, batch_size=32, device="cpu"):
+    """Macro F1 (%) of a NER (per word) or speaker role (per utterance) model"""
+    model.to(device).eval()
+    reference, hypothesis = [], []
+    with torch.inference_mode():
+        for idx in range(0, len(labels), batch_size):
+            batch = tokenizer.pad(
+                {
+                    key: value[idx : idx + batch_size]
+                    for key, value in encodings.items()
+                },
+                return_tensors="pt",
+            ).to(device)
+            pred = model(**batch).logits.argmax(dim=-1).cpu().numpy()
+
+            for row, label in enumerate(labels[idx : idx + batch_size]):
+                if np.ndim(label) == 0:
+                    reference.append(label)
+                    hypothesis.append(pred[row])
+                    continue
+                label = np.asarray(label)
+                mask = label != -100
+                reference.extend(label[mask])
+                hypothesis.extend(pred[row, : len(label)][mask])
+    return 100 * f1_score(reference, hypothesis, average="macro")
+
+
+def measure_latency(model, tokenizer, sentences, batch_size=1, device="cpu"):
+    """Mean latency (ms) per call of batch_size utterances, e.g., batch_size=1 for
+    real-time tagging of a frequency. The first calls are a warm-up"""
+    model.to(device).eval()
+    batches = [
+        tokenizer(
+            sentences[idx : idx + batch_size],
+            padding=True,
+            truncation=True,
+            return_tensors="pt",
+        ).to(device)
+        for idx in range(0, len(sentences), batch_size)
+    ]
+
+    timings = []
+    with torch.inference_mode():
+        for position, batch in enumerate(batches[:5] + batches):
+            start = time.perf_counter()
+            model(**batch)
+            if position >= min(5, len(batches)):
+                timings.append(time.perf_counter() - start)
+    return 1000 * float(np.mean(timings))
@@ -19,18 +19,15 @@ HuggingFace repository: https://huggingface.co/bert-base-uncased
 import argparse
 import os
 
+from cache_utils import cached_test_set
 from ner_utils import (
-    ATCDataset_for_ner,
-    compute_metrics,
+    compute_metrics_from_ids,
     encode_tags,
+    predict_token_classification,
     read_atc_ner_data,
+    throughput_report,
 )
-from transformers import (
-    AutoModelForTokenClassification,
-    AutoTokenizer,
-    DataCollatorWithPadding,
-    Trainer,
-)
+from transformers import AutoModelForTokenClassification, AutoTokenizer
 
 
 def parse_args():
@@ -50,6 +47,21 @@ def parse_args():
         default=1,
         help="Batch size you want to use for decoding",
     )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=None,
+        help="Maximum number of tokens per batch (including padding). The utterances "
+        "are sorted by length and each batch is padded to its longest utterance",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Folder to cache the tokenized test sets, keyed by the content of the "
+        "file and the tokenizer. Checkpoints with the same tokenizer and labels "
+        "re-use them, thus, only the forward passes are run",
+    )
 
     parser.add_argument(
         "-m",
@@ -110,40 +122,59 @@ def main(args):
     tag2id = eval_model.config.label2id
     id2tag = eval_model.config.id2label
 
-    # Trainer, only  instantiated for testing, and using standard DataCollator,
-    trainer = Trainer(
-        model=eval_model, data_collator=DataCollatorWithPadding(tokenizer)
-    )
-
     # main loop,
     for path_to_file, dataset_name in zip(path_to_files, test_set_names):
 
         print(f"******  NAMED-ENTITY RECOGNITION (for ATC)  ******")
         print(f"----    Evaluating dataset: --> {dataset_name} -----")
 
-        # converting the data to model's format,
-        eval_texts, eval_tags = read_atc_ner_data(path_to_file)
-
-        # Tokenize, pad and package data for forward pass,
-        eval_encodings = tokenizer(
-            eval_texts,
-            is_split_into_words=True,
-            return_offsets_mapping=True,
-            padding=True,
-            truncation=True,
+        # converting the data to model's format, or fetch it from the cache
+        def _build_test_set(path_to_file=path_to_file):
+            eval_texts, eval_tags = read_atc_ner_data(path_to_file)
+
+            # Tokenize without padding, each batch is padded to its own longest utterance
+            eval_encodings = tokenizer(
+                eval_texts,
+                is_split_into_words=True,
+                return_offsets_mapping=True,
+                truncation=True,
+            )
+            eval_labels = encode_tags(tag2id, eval_tags, eval_encodings)
+            # we don't want to pass this to the model
+            eval_encodings.pop("offset_mapping")
+            return range(len(eval_texts)), eval_encodings, eval_labels, {}
+
+        if args.cache_dir is not None:
+            eval_encodings, eval_labels, _ = cached_test_set(
+                args.cache_dir,
+                path_to_file,
+                tokenizer,
+                "ner",
+                _build_test_set,
+                extra=sorted(tag2id.items()),
+            )
+        else:
+            _, eval_encodings, eval_labels, _ = _build_test_set()
+
+        # run forward pass (batches bucketed by length), evaluate and, print the metrics
+        pred_ids, stats = predict_token_classification(
+            eval_model,
+            eval_encodings,
+            batch_size=args.batch_size,
+            max_tokens=args.max_tokens,
+            pad_token_id=tokenizer.pad_token_id,
         )
-        eval_labels = encode_tags(tag2id, eval_tags, eval_encodings)
-        eval_encodings.pop("offset_mapping")  # we don't want to pass this to the model
-        eval_dataset = ATCDataset_for_ner(eval_encodings, eval_labels)
-
-        # run forward pass, evaluate and, print the metrics
-        raw_pred, raw_labels, _ = trainer.predict(eval_dataset)
         path_to_output_file = f"{output_folder}/{dataset_name}_metrics"
 
-        metrics = compute_metrics(
-            raw_pred, raw_labels, label_list=id2tag, log_folder=path_to_output_file
+        metrics = compute_metrics_from_ids(
+            pred_ids, eval_labels, label_list=id2tag, log_folder=path_to_output_file
         )
 
+        # throughput of the forward passes
+        print(throughput_report(stats))
+        with open(path_to_output_file, "a") as f:
+            print(throughput_report(stats), file=f)
+
 
 if __name__ == "__main__":
     args = parse_args()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+"""\
+Script to export a fine-tuned NER model (ner/train_ner.py) or speaker role model
+(speaker_role/train_sec_classification.py) to ONNX, for fast CPU inference.
+
+The output folder contains:
+    - model.onnx: fp32 graph with dynamic batch and sequence axes
+    - model.int8.onnx: dynamic int8 quantization of the graph (--quantize)
+    - config.json and the tokenizer files
+
+The graphs are used by inference_ner.py and eval_sec_classification.py with
+--onnx-model /path/to/model.onnx. If --parity-file is given, the labels of each
+graph are compared with the ones of the PyTorch model (agreement and F1).
+"""
+
+import argparse
+import os
+
+from onnx_utils import (
+    MODEL_CLASSES,
+    OnnxModel,
+    export_onnx,
+    parity_check,
+    quantize_onnx,
+)
+from transformers import AutoTokenizer
+
+
+def read_sentences(path_to_file, max_sentences=1000):
+    """Transcripts of a Kaldi text, utt2text_tags or utt2spk_id file"""
+    sentences = []
+    with open(path_to_file, "r") as rd:
+        for line in rd:
+            if "utt2text_tags" in path_to_file:
+                sentence = line.split(";")[1]
+            elif "utt2spk_id" in path_to_file:
+                sentence = " ".join(line.split(" ")[3:])
+            else:
+                sentence = " ".join(line.split(" ")[1:])
+
+            if sentence.strip():
+                sentences.append(sentence.strip().lower())
+            if len(sentences) == max_sentences:
+                break
+    return sentences
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-t",
+        "--task",
+        choices=list(MODEL_CLASSES),
+        default="token-classification",
+        help="token-classification (NER) or sequence-classification (speaker role)",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        default=None,
+        help="Tokenizer to use, by default the one stored with the model",
+    )
+    parser.add_argument(
+        "-q",
+        "--quantize",
+        action="store_true",
+        help="Also write a dynamic int8 quantized graph (model.int8.onnx)",
+    )
+    parser.add_argument("--opset", type=int, default=14, help="ONNX opset version")
+    parser.add_argument(
+        "--parity-file",
+        default=None,
+        help="Kaldi text, utt2text_tags or utt2spk_id file to compare the labels of the "
+        "ONNX graphs with the ones of the PyTorch model",
+    )
+
+    parser.add_argument(
+        "-m",
+        "--input-model",
+        required=True,
+        help="Folder where the final model is stored",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-folder",
+        required=True,
+        help="Folder where to store the ONNX graphs",
+    )
+
+    return parser.parse_args()
+
+
+def main(args):
+    """Main code execution"""
+
+    print(f"\nExporting the model: {args.input_model} ({args.task}) to ONNX\n")
+    model = MODEL_CLASSES[args.task].from_pretrained(args.input_model)
+    tokenizer = AutoTokenizer.from_pretrained(
+        args.tokenizer or args.input_model, use_fast=True, do_lower_case=True
+    )
+
+    # config and tokenizer are stored next to the graphs
+    os.makedirs(args.output_folder, exist_ok=True)
+    model.config.save_pretrained(args.output_folder)
+    tokenizer.save_pretrained(args.output_folder)
+
+    path_onnx = export_onnx(
+        model,
+        tokenizer,
+        f"{args.output_folder}/model.onnx",
+        task=args.task,
+        opset=args.opset,
+    )
+    onnx_files = [path_onnx]
+    if args.quantize:
+        onnx_files.append(
+            quantize_onnx(path_onnx, f"{args.output_folder}/model.int8.onnx")
+        )
+
+    for path in onnx_files:
+        print(f"{path}: {os.path.getsize(path) / 1024**2:.1f} MB")
+
+    if args.parity_file is not None:
+        sentences = read_sentences(args.parity_file)
+        print(f"\nParity check against PyTorch on {len(sentences)} sentences")
+        for path in onnx_files:
+            parity = parity_check(model, OnnxModel(path), tokenizer, sentences)
+            print(
+                f"{os.path.basename(path)}: label agreement {parity['agreement']:.2f}%, "
+                f"F1 {parity['f1']:.2f}% ({parity['labels']} labels)"
+            )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+"""\
+Script to perform ONLY INFERENCE with a joint NER + speaker role model (see
+train_joint.py). Each utterance is tokenized once and both outputs come from a
+single forward pass of the shared encoder:
+    - {test_name}_inference: NER tags, 'uttid;text;tags' (as inference_ner.py)
+    - {test_name}_utt2spk_id_extracted: speaker role, 'uttid role confidence text'
+      (as speaker_role/eval_sec_classification.py)
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+from inference_ner import probs_to_utt2text_tags, read_utterances, write_utt2text_tags
+from joint_utils import BertForJointNerSpeakerRole
+from ner_utils import length_bucketed_batches, pad_batch, throughput_report
+from transformers import AutoTokenizer
+
+
+def joint_inference(model, tokenizer, sequences, batch_size=32, max_tokens=None):
+    """NER tags and speaker role (label, confidence) of a list of utterances, from
+    one forward pass per batch (batches bucketed by length)"""
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model.to(device)
+    model.eval()
+
+    encodings = tokenizer(sequences, return_offsets_mapping=True, truncation=True)
+    offset_mapping = encodings.pop("offset_mapping")
+    lengths = [len(x) for x in encodings["input_ids"]]
+
+    token_probs = [None] * len(sequences)
+    role_probs = np.zeros((len(sequences), len(model.config.id2role)))
+    stats = {"utterances": len(lengths), "tokens": sum(lengths), "padded_tokens": 0}
+
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for indices in length_bucketed_batches(lengths, batch_size, max_tokens):
+            batch = pad_batch(encodings, indices, tokenizer.pad_token_id)
+            batch = {key: value.to(device) for key, value in batch.items()}
+            outputs = model(**batch)
+
+            probs = torch.softmax(outputs.logits.float(), dim=-1).cpu().numpy()
+            role_probs[indices] = (
+                torch.softmax(outputs.role_logits.float(), dim=-1).cpu().numpy()
+            )
+            stats["padded_tokens"] += probs.shape[0] * probs.shape[1]
+            for row, idx in enumerate(indices):
+                token_probs[idx] = probs[row, : lengths[idx]]
+    stats["seconds"] = time.perf_counter() - start
+
+    ner_outputs = probs_to_utt2text_tags(
+        tokenizer,
+        sequences,
+        encodings,
+        offset_mapping,
+        token_probs,
+        model.config.id2label,
+    )
+    roles = [
+        {"label": model.config.id2role[idx], "score": score}
+        for idx, score in zip(role_probs.argmax(axis=1), role_probs.max(axis=1))
+    ]
+    return ner_outputs, roles, stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=32,
+        help="Batch size you want to use for decoding",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=None,
+        help="Maximum number of tokens per batch (including padding)",
+    )
+
+    parser.add_argument(
+        "-m",
+        "--input-model",
+        required=True,
+        help="Folder where the final joint model is stored",
+    )
+    parser.add_argument(
+        "-i",
+        "--input-files",
+        required=True,
+        help="String with paths to text or utt2text_tags files to be evaluated, it needs to match the 'test_names' variables",
+    )
+    parser.add_argument(
+        "-n",
+        "--test-names",
+        required=True,
+        help="Name of the test sets to be evaluated",
+    )
+
+    parser.add_argument(
+        "-o", "--output-folder", required=True, help="Folder where to store the outputs"
+    )
+
+    return parser.parse_args()
+
+
+def main(args):
+    """Main code execution"""
+
+    # input model and some detailed outputs
+    path_to_files = args.input_files.rstrip().split(" ")
+    test_set_names = args.test_names.rstrip().split(" ")
+    output_folder = args.output_folder
+
+    # evaluating that the number of test set names matches the amount of paths passed:
+    assert len(path_to_files) == len(
+        test_set_names
+    ), "number of test files and their names differ"
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Fetch the Model and tokenizer
+    print("\nLoading the joint NER + speaker role model\n")
+    model = BertForJointNerSpeakerRole.from_pretrained(args.input_model)
+    tokenizer = AutoTokenizer.from_pretrained(
+        args.input_model, use_fast=True, do_lower_case=True
+    )
+
+    # main loop,
+    for path_to_file, dataset_name in zip(path_to_files, test_set_names):
+
+        print(f"******  NER + SPEAKER ROLE (for ATC)  ******")
+        print(f"----    Evaluating dataset: --> {dataset_name} -----")
+
+        utterances = list(read_utterances(path_to_file))
+        if not utterances:
+            print(f"No utterances left after cleaning in {path_to_file}, skipping")
+            continue
+        utt_ids, sequences = zip(*utterances)
+        ner_outputs, roles, stats = joint_inference(
+            model,
+            tokenizer,
+            list(sequences),
+            batch_size=args.batch_size,
+            max_tokens=args.max_tokens,
+        )
+        print(throughput_report(stats))
+
+        # print the results in txt files
+        with open(f"{output_folder}/{dataset_name}_inference", "w") as output_f:
+            write_utt2text_tags(utt_ids, ner_outputs, output_f)
+
+        path_to_output_file = f"{output_folder}/{dataset_name}_utt2spk_id_extracted"
+        with open(path_to_output_file, "w") as output_f:
+            for utt_id, role, transcript in zip(utt_ids, roles, sequences):
+                output_f.write(
+                    f"{utt_id} {role['label']} {role['score']:.2f} {transcript}\n"
+                )
+        print(f"Done. Outputs in {output_folder}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
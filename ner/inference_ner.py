@@ -19,49 +19,187 @@ HuggingFace repository: https://huggingface.co/bert-base-uncased
 """
 
 import argparse
+import itertools
 import os
+import sys
 
 import numpy as np
 import torch
-from ner_utils import clean_input_utterance
-from transformers import BertForTokenClassification, BertTokenizerFast, pipeline
+from ner_utils import (
+    clean_input_utterance,
+    predict_token_classification,
+    throughput_report,
+)
+from onnx_utils import OnnxModel
+from transformers import BertForTokenClassification, BertTokenizerFast
+
+
+def aggregate_word_labels(token_probs, word_ids):
+    """Average the label probabilities of the subwords of each word and pick the
+    best label, i.e., aggregation_strategy="average" of the HuggingFace pipeline.
+    Special tokens have word_id -1 and are ignored"""
+    valid = word_ids >= 0
+    num_words = word_ids[valid].max() + 1 if valid.any() else 0
+
+    scores = np.zeros((num_words, token_probs.shape[1]), dtype=token_probs.dtype)
+    np.add.at(scores, word_ids[valid], token_probs[valid])
+    scores /= np.bincount(word_ids[valid], minlength=num_words)[:, None]
+    return scores.argmax(axis=-1)
+
+
+def get_tag(label):
+    """split a label in BIO prefix and entity, labels without prefix continue ('I')"""
+    if label.startswith("B-") or label.startswith("I-"):
+        return label[0], label[2:]
+    return "I", label
+
+
+def convert_to_utt2text_tags(tokenizer, tokens, word_ids, word_labels, id2label):
+    """Group the words in entities (same output as the HuggingFace pipeline with
+    ignore_labels=["O"]) and convert them to text and tags"""
+
+    # strings of each word, [UNK] tokens were already replaced by the original text
+    words = [[] for _ in range(len(word_labels))]
+    for token, word_id in zip(tokens, word_ids):
+        if word_id >= 0:
+            words[word_id].append(token)
+    words = [tokenizer.convert_tokens_to_string(x) for x in words]
+
+    # adjacent words with the same entity are grouped, unless the label is 'B-'
+    groups = []
+    for word, label_id in zip(words, word_labels):
+        bi, entity = get_tag(id2label[label_id])
+        if groups and groups[-1][0] == entity and bi != "B":
+            groups[-1][1].append(word)
+        else:
+            groups.append((entity, [word]))
+
+    text_list, tags_list = [], []
+    for entity, group_words in groups:
+        if entity == "O":
+            continue
+        # get the transcript and fix normalization
+        word = tokenizer.convert_tokens_to_string(group_words)
+        word = word.replace("x - ray", "x-ray") if "x - ray" in word else word
+        word = word.replace(" ' ", "'") if "x - ray" in word else word
+        word = word.split()
+
+        text_list += word
+        tags_list += ["B-" + entity] + ["I-" + entity] * (len(word) - 1)
+
+    assert len(text_list) == len(tags_list), "text and tags list have differnt size"
+    return {"text": text_list, "tags": tags_list}
+
+
+def tag_utterances(
+    model, tokenizer, sequences, batch_size=32, max_tokens=None, device=None
+):
+    """Tag a list of utterances: they are tokenized once in bulk (with offsets),
+    the forward passes run in length-bucketed batches and the word-level tags are
+    aggregated from the subword probabilities"""
+    encodings = tokenizer(sequences, return_offsets_mapping=True, truncation=True)
+    offset_mapping = encodings.pop("offset_mapping")
+
+    probs, stats = predict_token_classification(
+        model,
+        encodings,
+        batch_size=batch_size,
+        max_tokens=max_tokens,
+        pad_token_id=tokenizer.pad_token_id,
+        device=device,
+        return_probs=True,
+    )
 
+    outputs = probs_to_utt2text_tags(
+        tokenizer, sequences, encodings, offset_mapping, probs, model.config.id2label
+    )
+    return outputs, stats
 
-def convert_to_utt2text_tags(predictions):
-    """convert the pipeline output of HuggingFace to text and tags"""
 
+def probs_to_utt2text_tags(
+    tokenizer, sequences, encodings, offset_mapping, probs, id2label
+):
+    """Word-level text and tags of each utterance, from the subword probabilities"""
     outputs = []
-    for prediction in predictions:
-        text_list = []
-        tags_list = []
-        for sample in prediction:
-            # extract data
-            entity = sample["entity_group"]
-
-            # get the transcript and fix normalization
-            word = sample["word"].rstrip()
-            word = word.replace("x - ray", "x-ray") if "x - ray" in word else word
-            word = word.replace(" ' ", "'") if "x - ray" in word else word
-            word = word.split()
-
-            # get the tags
-            tags = np.full(shape=len(word), fill_value="I-" + entity)
-            tags[0] = "B-" + entity
-
-            # append text and tags
-            text_list.append(word)
-            tags_list.append(tags)
-        # flatten the list
-        text_list = [x for xs in text_list for x in xs]
-        tags_list = [x for xs in tags_list for x in xs]
-        assert len(text_list) == len(tags_list), "text and tags list have differnt size"
-
-        # create the final object
-        outputs.append({"text": text_list, "tags": tags_list})
-
+    for idx, sequence in enumerate(sequences):
+        word_ids = np.array(
+            [-1 if x is None else x for x in encodings.word_ids(idx)], dtype=int
+        )
+        tokens = tokenizer.convert_ids_to_tokens(encodings["input_ids"][idx])
+        tokens = [
+            sequence[start:end] if token == tokenizer.unk_token else token
+            for token, (start, end) in zip(tokens, offset_mapping[idx])
+        ]
+        word_labels = aggregate_word_labels(probs[idx], word_ids)
+        outputs.append(
+            convert_to_utt2text_tags(tokenizer, tokens, word_ids, word_labels, id2label)
+        )
     return outputs
 
 
+def read_utterances(path_to_file):
+    """Generator of (utt_id, cleaned utterance) of a Kaldi text file [uttid text] or
+    an utt2text_tags file [uttid;text;tags], '-' reads a Kaldi text from stdin.
+    Empty utterances are skipped"""
+    # check if using utt2text_tags, the transcript is on column 2 (split by ';')
+    # otherwise is in column 2 [uttid text]
+    is_utt2text_tags = True if "utt2text_tags" in path_to_file else False
+
+    rd = sys.stdin if path_to_file == "-" else open(path_to_file, "r")
+    try:
+        for line in rd:
+
+            if is_utt2text_tags:
+                ids = line.split(";")[0].rstrip()
+                # clean the input utterance
+                sample = clean_input_utterance(line.split(";")[1].rstrip())
+            else:
+                ids = line.split(" ")[0].rstrip()
+                # clean the input utterance
+                sample = clean_input_utterance(" ".join(line.split(" ")[1:]).rstrip())
+
+            # continue if sample is empty
+            if sample == "" or sample == " ":
+                continue
+            yield ids, sample
+    finally:
+        if rd is not sys.stdin:
+            rd.close()
+
+
+def write_utt2text_tags(utt_ids, predictions, output_f):
+    """write the predictions in 'uttid;text;tags' format"""
+    for ids, prediction in zip(utt_ids, predictions):
+        text = " ".join(prediction["text"])
+        tags = ",".join(prediction["tags"])
+        output_f.write(f"{ids};{text};{tags}\n")
+
+
+def stream_inference(
+    model, tokenizer, path_to_file, output_f, chunk_size=1000, **tag_args
+):
+    """Streaming inference with bounded memory, the utterances are read in chunks of
+    chunk_size, tagged in batches and written to output_f (flushed after each chunk),
+    e.g., to tag the output of an ASR decoder piped to stdin"""
+    utterances = read_utterances(path_to_file)
+    stats = {"utterances": 0, "tokens": 0, "padded_tokens": 0, "seconds": 0.0}
+
+    while True:
+        chunk = list(itertools.islice(utterances, chunk_size))
+        if not chunk:
+            break
+        utt_ids, sequences = zip(*chunk)
+        predictions, chunk_stats = tag_utterances(
+            model, tokenizer, list(sequences), **tag_args
+        )
+        write_utt2text_tags(utt_ids, predictions, output_f)
+        output_f.flush()
+
+        for key in stats:
+            stats[key] += chunk_stats[key]
+    return stats
+
+
 class ATCDataset(torch.utils.data.Dataset):
     """\
     Dataset for NER of ATC data. We will extract the main entities, like
@@ -74,32 +212,11 @@ class ATCDataset(torch.utils.data.Dataset):
         utt_id = []
         encodings = []
 
-        with open(path_to_file, "r") as rd:
-            # check if using utt2text_tags, the transcript is on column 4
-            # otherwise is in column 2 [uttid text]
-            is_utt2text_tags = True if "utt2text_tags" in path_to_file else False
-
-            for line in rd:
-
-                if is_utt2text_tags:
-                    ids = line.split(";")[0].rstrip()
-                    # clean the input utterance
-                    sample = clean_input_utterance(line.split(";")[1].rstrip())
-                else:
-                    ids = line.split(" ")[0].rstrip()
-                    # clean the input utterance
-                    sample = clean_input_utterance(
-                        " ".join(line.split(" ")[1:]).rstrip()
-                    )
-
-                # continue if sample is empty
-                if sample == "" or sample == " ":
-                    continue
-
-                # append to output dictionaries
-                sequences.append(sample)
-                utt_id.append(ids)
-                encodings.append([ids, sample])
+        for ids, sample in read_utterances(path_to_file):
+            # append to output dictionaries
+            sequences.append(sample)
+            utt_id.append(ids)
+            encodings.append([ids, sample])
 
         self.sequences = sequences
         self.utt_id = utt_id
@@ -123,6 +240,31 @@ def parse_args():
         default=1,
         help="Batch size you want to use for decoding",
     )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=None,
+        help="Maximum number of tokens per batch (including padding)",
+    )
+    parser.add_argument(
+        "--onnx-model",
+        default=None,
+        help="Run the model with ONNX Runtime on CPU, path to the model.onnx (or "
+        "model.int8.onnx) written by export_onnx.py",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read the input files in chunks and write the outputs incrementally, "
+        "with bounded memory. Use '-' as input file to read a Kaldi text from stdin "
+        "and '-' as output folder to write to stdout",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1000,
+        help="Number of utterances read at once in streaming mode",
+    )
 
     parser.add_argument(
         "-m",
@@ -164,22 +306,46 @@ def main(args):
         test_set_names
     ), "number of test files and their names differ"
 
+    # in streaming mode the logs go to stderr, stdout can be the output
+    log_f = sys.stderr if args.stream else sys.stdout
+
     # create the output directory, in 'evaluations folder'
-    os.makedirs(os.path.dirname(output_folder), exist_ok=True)
+    if output_folder != "-":
+        os.makedirs(os.path.dirname(output_folder), exist_ok=True)
 
     # Fetch the Model and tokenizer
-    print("\nLoading the TOKEN classification recognition model (NER)\n")
-    eval_model = BertForTokenClassification.from_pretrained(token_classification_model)
+    print("\nLoading the TOKEN classification recognition model (NER)\n", file=log_f)
+    if args.onnx_model is not None:
+        eval_model = OnnxModel(args.onnx_model)
+    else:
+        eval_model = BertForTokenClassification.from_pretrained(
+            token_classification_model
+        )
     tokenizer = BertTokenizerFast.from_pretrained("bert-base-uncased")
-
-    # Pipeline for sequence classification
-    seq_cla = pipeline(
-        "token-classification",
-        model=eval_model,
-        tokenizer=tokenizer,
-        aggregation_strategy="average",
-        ignore_labels=["O"],
-    )
+    tag_args = {"batch_size": args.batch_size, "max_tokens": args.max_tokens}
+    if args.onnx_model is not None:
+        tag_args["device"] = "cpu"
+
+    if args.stream:
+        for path_to_file, dataset_name in zip(path_to_files, test_set_names):
+            print(f"----    Streaming dataset: --> {dataset_name} -----", file=log_f)
+            if output_folder == "-":
+                output_f = sys.stdout
+            else:
+                output_f = open(f"{output_folder}/{dataset_name}_inference", "w")
+
+            stats = stream_inference(
+                eval_model,
+                tokenizer,
+                path_to_file,
+                output_f,
+                chunk_size=args.chunk_size,
+                **tag_args,
+            )
+            if output_f is not sys.stdout:
+                output_f.close()
+            print(throughput_report(stats), file=log_f)
+        return
 
     # main loop,
     for path_to_file, dataset_name in zip(path_to_files, test_set_names):
@@ -187,30 +353,22 @@ def main(args):
         print(f"******  NAMED-ENTITY RECOGNITION (for ATC)  ******")
         print(f"----    Evaluating dataset: --> {dataset_name} -----")
 
-        # create the dataset and DataLoader objects
+        # read the dataset and run inference on the whole database
         test_dataset = ATCDataset(path_to_file)
-        dataLoader_ATC = torch.utils.data.DataLoader(
-            test_dataset, batch_size=args.batch_size, shuffle=False
+        utt_ids_out = test_dataset.utt_id
+        inference_out, stats = tag_utterances(
+            eval_model,
+            tokenizer,
+            test_dataset.sequences,
+            **tag_args,
         )
-
-        inference_out, utt_ids_out = [], []
-        # run inference on the whole database
-        for local_batch in dataLoader_ATC:
-            utt_ids_out += local_batch[0]
-            inference = seq_cla(list(local_batch[1]), batch_size=args.batch_size)
-            inference_out += convert_to_utt2text_tags(inference)
-
-        # join the predictions
-        output_dict = []
-        for ids, predictions in zip(utt_ids_out, inference_out):
-            text = " ".join(predictions["text"])
-            tags = ",".join(predictions["tags"])
-            output_dict.append(f"{ids};{text};{tags}")
+        print(throughput_report(stats))
 
         # print the results in a txt file
         path_to_output_file = f"{output_folder}/{dataset_name}_inference"
 
-        print("\n".join(map(str, output_dict)), file=open(path_to_output_file, "w"))
+        with open(path_to_output_file, "w") as output_f:
+            write_utt2text_tags(utt_ids_out, inference_out, output_f)
         print(
             f"Done performing inference on: {dataset_name}. Output in: '{path_to_output_file}'"
         )
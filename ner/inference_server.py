@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+"""\
+Local text inference server for the NER and speaker role models, e.g., to tag the
+utterances of a live transcription pipeline one by one without paying the start-up
+of inference_ner.py or eval_sec_classification.py for each of them.
+
+Both models are loaded once. The concurrent requests are grouped in micro-batches
+(one worker per model) of up to --max-batch-size utterances. Once the queue is
+empty, a worker only waits for more requests if the recent arrivals predict them
+soon, and at most --max-wait-ms after the arrival of the oldest one.
+
+Endpoints (JSON), over TCP (--host/--port) or a Unix socket (--unix-socket):
+    POST /ner            {"text": "..."} or {"texts": [...]} -> NER text and tags
+    POST /speaker-role   same input -> speaker role label and confidence
+    POST /tag            same input -> both
+    GET  /metrics        queue depth, batch sizes and latencies of each model
+    GET  /health
+
+See server_client.py for a test client and load generator.
+"""
+
+import argparse
+import os
+import sys
+
+import torch
+from inference_ner import tag_utterances
+from onnx_utils import load_model
+from server_utils import MicroBatcher, make_http_server
+from text_cleaning import clean_utterances
+from transformers import AutoTokenizer
+
+# the speaker role classifier is shared with the speaker_role recipe
+SPEAKER_ROLE_FOLDER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "../speaker_role"
+)
+
+
+class InferenceServer:
+    """Routes the requests to the micro-batchers of the loaded models. backends maps
+    a task ('ner', 'speaker_role') to a function over a list of utterances"""
+
+    ROUTES = {"/ner": ["ner"], "/speaker-role": ["speaker_role"]}
+
+    def __init__(self, backends, max_batch_size=32, max_wait_ms=10.0):
+        self.batchers = {
+            task: MicroBatcher(
+                backend, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms
+            )
+            for task, backend in backends.items()
+        }
+
+    def handle(self, method, path, payload):
+        """Returns the HTTP status and the JSON response of a request"""
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok", "models": list(self.batchers)}
+        if method == "GET" and path == "/metrics":
+            return 200, {task: x.metrics() for task, x in self.batchers.items()}
+        if method != "POST" or path not in list(self.ROUTES) + ["/tag"]:
+            return 404, {"error": f"unknown endpoint: {method} {path}"}
+
+        tasks = self.ROUTES.get(path, list(self.batchers))
+        missing = [task for task in tasks if task not in self.batchers]
+        if missing:
+            return 404, {"error": f"model not loaded: {', '.join(missing)}"}
+
+        # checked before queuing, a bad utterance would fail its whole micro-batch
+        single = "text" in payload
+        texts = [payload["text"]] if single else payload["texts"]
+        if not isinstance(texts, list) or not all(isinstance(x, str) for x in texts):
+            return 400, {"error": "'text' must be a string, 'texts' a list of strings"}
+
+        # one request per utterance, so they are batched with the other clients
+        futures = {
+            task: [self.batchers[task].submit(text) for text in texts] for task in tasks
+        }
+        outputs = [
+            {task: futures[task][idx].result() for task in tasks}
+            for idx in range(len(texts))
+        ]
+        return 200, outputs[0] if single else {"outputs": outputs}
+
+
+def ner_backend(model, tokenizer, max_tokens=None, device=None):
+    """NER of a list of utterances: {"text": [...], "tags": [...]} each"""
+
+    def _ner(texts):
+        sequences = clean_utterances(texts, lower=True)
+        outputs, _ = tag_utterances(
+            model,
+            tokenizer,
+            sequences,
+            batch_size=len(sequences),
+            max_tokens=max_tokens,
+            device=device,
+        )
+        return outputs
+
+    return _ner
+
+
+def speaker_role_backend(model, tokenizer):
+    """Speaker role of a list of utterances: {"label": ..., "score": ...} each"""
+    sys.path.insert(0, SPEAKER_ROLE_FOLDER)
+    from sec_classification_utils import classify_sequences
+
+    def _speaker_role(texts):
+        labels, scores = classify_sequences(
+            model,
+            tokenizer,
+            clean_utterances(texts, lower=True),
+            batch_size=len(texts),
+        )
+        return [
+            {"label": label, "score": float(score)}
+            for label, score in zip(labels, scores)
+        ]
+
+    return _speaker_role
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+
+    parser.add_argument("--ner-model", default=None, help="Folder of the NER model")
+    parser.add_argument(
+        "--ner-onnx-model",
+        default=None,
+        help="Run the NER model with ONNX Runtime, path to model.onnx",
+    )
+    parser.add_argument(
+        "--speaker-role-model", default=None, help="Folder of the speaker role model"
+    )
+    parser.add_argument(
+        "--speaker-role-onnx-model",
+        default=None,
+        help="Run the speaker role model with ONNX Runtime, path to model.onnx",
+    )
+
+    parser.add_argument(
+        "-b",
+        "--max-batch-size",
+        type=int,
+        default=32,
+        help="Maximum number of utterances per micro-batch",
+    )
+    parser.add_argument(
+        "-w",
+        "--max-wait-ms",
+        type=float,
+        default=10.0,
+        help="Maximum time (ms) that a request waits for its micro-batch to fill up",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=None,
+        help="Maximum number of (padded) tokens per forward pass of the NER model",
+    )
+
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on")
+    parser.add_argument("-p", "--port", type=int, default=8000, help="TCP port")
+    parser.add_argument(
+        "--unix-socket",
+        default=None,
+        help="Listen on this Unix socket instead of TCP",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log requests")
+
+    args = parser.parse_args()
+    if args.ner_model is None and args.speaker_role_model is None:
+        parser.error("give at least one of --ner-model and --speaker-role-model")
+    return args
+
+
+def main(args):
+    """Main code execution"""
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    backends = {}
+
+    if args.ner_model is not None:
+        print(f"Loading the NER model: {args.ner_model}")
+        model = load_model(args.ner_model, "token-classification", args.ner_onnx_model)
+        tokenizer = AutoTokenizer.from_pretrained(
+            args.ner_model, use_fast=True, do_lower_case=True
+        )
+        backends["ner"] = ner_backend(
+            model,
+            tokenizer,
+            max_tokens=args.max_tokens,
+            device="cpu" if args.ner_onnx_model is not None else device,
+        )
+
+    if args.speaker_role_model is not None:
+        print(f"Loading the speaker role model: {args.speaker_role_model}")
+        model = load_model(
+            args.speaker_role_model,
+            "sequence-classification",
+            args.speaker_role_onnx_model,
+        )
+        if args.speaker_role_onnx_model is None:
+            model.to(device).eval()
+        tokenizer = AutoTokenizer.from_pretrained(
+            args.speaker_role_model, use_fast=True, do_lower_case=True
+        )
+        backends["speaker_role"] = speaker_role_backend(model, tokenizer)
+
+    app = InferenceServer(
+        backends, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms
+    )
+    server = make_http_server(
+        app,
+        host=args.host,
+        port=args.port,
+        unix_socket=args.unix_socket,
+        verbose=args.verbose,
+    )
+    address = args.unix_socket or f"http://{args.host}:{args.port}"
+    print(f"Serving {', '.join(backends)} on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
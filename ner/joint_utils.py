@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+# File with some utils for the joint NER + speaker role model
+#   - one BERT encoder shared by a token classification head (NER) and a
+#     sequence classification head (speaker role: atco/pilot)
+#   - reading/merging the NER (utt2text_tags) and speaker role (utt2spk_id) data
+
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import torch
+from ner_utils import clean_input_utterance, encode_tags, pad_batch
+from torch import nn
+from transformers import BertModel, BertPreTrainedModel
+from transformers.utils import ModelOutput
+
+# Define the tags of the speaker role head (same as speaker_role/)
+role2id = {"atco": 0, "pilot": 1}
+id2role = {0: "atco", 1: "pilot"}
+
+
+@dataclass
+class JointClassifierOutput(ModelOutput):
+    """Outputs of the joint model: token logits (NER) and sequence logits (role)"""
+
+    loss: Optional[torch.FloatTensor] = None
+    logits: torch.FloatTensor = None
+    role_logits: torch.FloatTensor = None
+
+
+class BertForJointNerSpeakerRole(BertPreTrainedModel):
+    """BERT encoder with two heads, both computed from one forward pass:
+        - token classification (NER), on top of the hidden states
+        - sequence classification (speaker role), on top of the pooled output
+    The labels of the role head are stored in config.id2role/role2id. Samples
+    without NER tags (labels=-100) or without role (role_labels=-100) only
+    contribute to the loss of the other head.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.num_labels = config.num_labels
+        self.role_loss_weight = getattr(config, "role_loss_weight", 1.0)
+        # the keys of id2role are strings after loading the config from json
+        config.role2id = getattr(config, "role2id", role2id)
+        config.id2role = {
+            int(k): v for k, v in getattr(config, "id2role", id2role).items()
+        }
+        num_roles = len(config.role2id)
+
+        self.bert = BertModel(config, add_pooling_layer=True)
+        classifier_dropout = (
+            config.classifier_dropout
+            if config.classifier_dropout is not None
+            else config.hidden_dropout_prob
+        )
+        self.dropout = nn.Dropout(classifier_dropout)
+        self.classifier = nn.Linear(config.hidden_size, config.num_labels)
+        self.role_classifier = nn.Linear(config.hidden_size, num_roles)
+
+        # Initialize weights and apply final processing
+        self.post_init()
+
+    def forward(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        token_type_ids=None,
+        labels=None,
+        role_labels=None,
+    ):
+        outputs = self.bert(
+            input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+        )
+        logits = self.classifier(self.dropout(outputs[0]))
+        role_logits = self.role_classifier(self.dropout(outputs[1]))
+
+        # each head only uses the samples that have labels for it
+        loss = None
+        loss_fct = nn.CrossEntropyLoss(ignore_index=-100)
+        if labels is not None and (labels != -100).any():
+            loss = loss_fct(logits.view(-1, self.num_labels), labels.view(-1))
+        if role_labels is not None and (role_labels != -100).any():
+            role_loss = self.role_loss_weight * loss_fct(role_logits, role_labels)
+            loss = role_loss if loss is None else loss + role_loss
+        if loss is None and (labels is not None or role_labels is not None):
+            loss = logits.sum() * 0.0
+
+        return JointClassifierOutput(loss=loss, logits=logits, role_logits=role_logits)
+
+
+def read_joint_data(path_ner_data=None, path_role_data=None, max_seq_len=120):
+    """Read and merge (by utterance id) the NER data (utt2text_tags: id;text;tags)
+    and the speaker role data (utt2spk_id: id <0/1> <atco/pilot> text).
+    Outputs: utt_ids, words, tags (None if no NER tags), roles (-100 if no role)
+    """
+    utt_ids, texts, tags = [], [], []
+    if path_ner_data is not None:
+        with open(path_ner_data, "r", encoding="utf8") as f:
+            for sample in f:
+                line = sample.strip().split(";")
+                text = line[1].rstrip().split(" ")
+                if len(text) > max_seq_len:
+                    continue
+                utt_ids.append(line[0])
+                texts.append(text)
+                tags.append(line[2].rstrip().split(","))
+
+    utt2role = {}
+    if path_role_data is not None:
+        with open(path_role_data, "r", encoding="utf8") as f:
+            for line in f:
+                fields = line.rstrip().split(" ")
+                utt2role[fields[0]] = (role2id[fields[2]], " ".join(fields[3:]))
+
+    roles = [utt2role.get(utt_id, (-100, ""))[0] for utt_id in utt_ids]
+
+    # utterances that only have speaker role are added without NER tags
+    ner_utt_ids = set(utt_ids)
+    for utt_id, (role, text) in utt2role.items():
+        text = clean_input_utterance(text).lower().split()
+        if utt_id in ner_utt_ids or not text or len(text) > max_seq_len:
+            continue
+        utt_ids.append(utt_id)
+        texts.append(text)
+        tags.append(None)
+        roles.append(role)
+
+    return utt_ids, texts, tags, roles
+
+
+def encode_joint_data(tokenizer, tag2id, texts, tags):
+    """Tokenize the utterances (without padding) and align the NER tags to the
+    subwords, utterances without NER tags get only -100 labels"""
+    encodings = tokenizer(
+        texts, is_split_into_words=True, return_offsets_mapping=True, truncation=True
+    )
+    dummy_tags = [x if x is not None else ["O"] * len(y) for x, y in zip(tags, texts)]
+    labels = encode_tags(tag2id, dummy_tags, encodings)
+    assert len(labels) == len(texts), "some NER tags could not be aligned"
+
+    labels = [x if y is not None else [-100] * len(x) for x, y in zip(labels, tags)]
+    encodings.pop("offset_mapping")  # we don't want to pass this to the model
+    return encodings, labels
+
+
+class ATCDataset_for_joint(torch.utils.data.Dataset):
+    """Dataset for the joint model, each item has the NER labels (per subword)
+    and the speaker role label (per utterance). The utterances are not padded,
+    see JointDataCollator"""
+
+    def __init__(self, encodings, labels, roles):
+        self.encodings = encodings
+        self.labels = labels
+        self.roles = roles
+
+    def __getitem__(self, idx):
+        item = {key: val[idx] for key, val in self.encodings.items()}
+        item["labels"] = self.labels[idx]
+        item["role_labels"] = self.roles[idx]
+        return item
+
+    def __len__(self):
+        return len(self.labels)
+
+
+class JointDataCollator:
+    """Pad each batch to its longest utterance (labels with -100)"""
+
+    def __init__(self, tokenizer):
+        self.pad_token_id = tokenizer.pad_token_id
+
+    def __call__(self, features):
+        keys = [x for x in features[0] if x not in ["labels", "role_labels"]]
+        encodings = {key: [x[key] for x in features] for key in keys}
+        batch = pad_batch(
+            encodings,
+            range(len(features)),
+            self.pad_token_id,
+            labels=[x["labels"] for x in features],
+        )
+        batch["role_labels"] = torch.tensor([x["role_labels"] for x in features])
+        return batch
+
+
+def role_metrics(role_logits, role_labels):
+    """Accuracy of the speaker role head, on the samples with role"""
+    mask = np.asarray(role_labels) != -100
+    pred = np.argmax(role_logits, axis=-1)
+    return (
+        float(np.mean(pred[mask] == np.asarray(role_labels)[mask]))
+        if mask.any()
+        else 0.0
+    )
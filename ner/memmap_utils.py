@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+# File with some utils for pre-tokenized, memory-mapped training data
+#   - the tokenizer output of a whole corpus is written once to flat arrays
+#     (input_ids int32, masks and labels int16) plus an offsets index
+#   - the datasets return zero-copy slices of the memory-mapped arrays, so the
+#     DataLoader workers share the pages instead of duplicating Python lists
+#   - the k-fold splits (gen_kfolds.py) select their utterances by id from one
+#     shared pre-tokenized copy of the corpus
+
+import json
+import os
+
+import numpy as np
+import torch
+
+DTYPES = {
+    "input_ids": np.int32,
+    "attention_mask": np.int16,
+    "token_type_ids": np.int16,
+    "labels": np.int16,
+}
+
+# value used to pad each field in a batch
+PAD_VALUES = {"attention_mask": 0, "token_type_ids": 0, "labels": -100}
+
+
+def write_pretokenized(path_prefix, utt_ids, encodings, labels=None, meta=None):
+    """Write the tokenized utterances (no padding) to flat arrays:
+        - {prefix}.{field}.bin: concatenation of all the utterances
+        - {prefix}.offsets.npy: start of each utterance in the flat arrays (n+1)
+        - {prefix}.json: fields, dtypes, utterance ids and meta (e.g., tag2id)
+    labels can be per token (NER) or one int per utterance (speaker role)
+    """
+    lengths = np.array([len(x) for x in encodings["input_ids"]], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    np.save(f"{path_prefix}.offsets.npy", offsets)
+
+    fields = {key: encodings[key] for key in DTYPES if key in encodings}
+    label_level = None
+    if labels is not None:
+        # the labels of an empty corpus (e.g., test set) are stored empty
+        is_utterance = len(labels) > 0 and np.ndim(labels[0]) == 0
+        label_level = "utterance" if is_utterance else "token"
+        fields["labels"] = labels
+
+    for key, values in fields.items():
+        if key == "labels" and label_level == "utterance":
+            array = np.asarray(values, dtype=DTYPES[key])
+        else:
+            array = np.fromiter(
+                (x for value in values for x in value),
+                dtype=DTYPES[key],
+                count=offsets[-1],
+            )
+        array.tofile(f"{path_prefix}.{key}.bin")
+
+    with open(f"{path_prefix}.json", "w") as f:
+        json.dump(
+            {
+                "fields": list(fields),
+                "dtypes": {key: np.dtype(DTYPES[key]).name for key in fields},
+                "label_level": label_level,
+                "num_utterances": len(lengths),
+                "num_tokens": int(offsets[-1]),
+                "utt_ids": list(utt_ids),
+                "meta": meta or {},
+            },
+            f,
+        )
+    return path_prefix
+
+
+def read_pretokenized_meta(path_prefix):
+    """Description of a pre-tokenized corpus (fields, utt_ids, meta, ...)"""
+    with open(f"{path_prefix}.json", "r") as f:
+        return json.load(f)
+
+
+def open_array(path_prefix, key, dtype, mode="r"):
+    """Memory-mapped array of one field, np.memmap can not map an empty file, e.g.,
+    a test set without utterances left after cleaning"""
+    path = f"{path_prefix}.{key}.bin"
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode)
+
+
+def load_pretokenized(path_prefix):
+    """Read a pre-tokenized corpus back as per-utterance sequences (zero-copy slices
+    of the memory-mapped arrays), e.g., a cached test set (see cache_utils.py)
+    Outputs: encodings (dict of lists), labels (None if not stored) and its info"""
+    info = read_pretokenized_meta(path_prefix)
+    offsets = np.load(f"{path_prefix}.offsets.npy")
+    spans = list(zip(offsets[:-1], offsets[1:]))
+
+    encodings, labels = {}, None
+    for key in info["fields"]:
+        array = open_array(path_prefix, key, info["dtypes"][key])
+        if key == "labels" and info["label_level"] == "utterance":
+            labels = np.asarray(array)
+        elif key == "labels":
+            labels = [array[start:end] for start, end in spans]
+        else:
+            encodings[key] = [array[start:end] for start, end in spans]
+    return encodings, labels, info
+
+
+def select_indices(path_prefix, path_to_file, sep=";"):
+    """Indices (in the pre-tokenized corpus) of the utterances of a data file, the
+    utterance id is in the first column, e.g., the train/test folds of gen_kfolds.py
+    Utterances missing from the corpus (e.g., a header) are skipped"""
+    utt2idx = {
+        x: i for i, x in enumerate(read_pretokenized_meta(path_prefix)["utt_ids"])
+    }
+    indices = []
+    with open(path_to_file, "r", encoding="utf8") as rd:
+        for line in rd:
+            utt_id = line.split(sep)[0].strip()
+            if utt_id in utt2idx:
+                indices.append(utt2idx[utt_id])
+    return np.array(indices, dtype=np.int64)
+
+
+class MemmapDataset(torch.utils.data.Dataset):
+    """Dataset over a pre-tokenized corpus (see write_pretokenized). Each item is a
+    dict of zero-copy tensors (slices of the memory-mapped arrays), indices selects
+    a subset of the utterances, e.g., one fold"""
+
+    def __init__(self, path_prefix, indices=None):
+        info = read_pretokenized_meta(path_prefix)
+        self.meta = info["meta"]
+        self.label_level = info["label_level"]
+        self.offsets = np.load(f"{path_prefix}.offsets.npy")
+
+        # copy-on-write mode: the slices are writable (torch.from_numpy needs it),
+        # but nothing is copied unless they are modified
+        self.arrays = {
+            key: open_array(path_prefix, key, info["dtypes"][key], mode="c")
+            for key in info["fields"]
+        }
+        self.indices = (
+            np.arange(info["num_utterances"])
+            if indices is None
+            else np.asarray(indices)
+        )
+
+    def __getitem__(self, idx):
+        idx = self.indices[idx]
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+
+        item = {}
+        for key, array in self.arrays.items():
+            if key == "labels" and self.label_level == "utterance":
+                item[key] = torch.tensor(int(array[idx]))
+            else:
+                item[key] = torch.from_numpy(array[start:end])
+        return item
+
+    def __len__(self):
+        return len(self.indices)
+
+
+class DynamicPaddingCollator:
+    """Pad each batch to its longest utterance and convert it to int64: input_ids
+    with the pad token, masks with 0 and token labels with -100. Per utterance
+    labels (sequence classification) are stacked"""
+
+    def __init__(self, tokenizer):
+        self.pad_values = {"input_ids": tokenizer.pad_token_id, **PAD_VALUES}
+
+    def __call__(self, features):
+        max_len = max(len(x["input_ids"]) for x in features)
+
+        batch = {}
+        for key in features[0]:
+            if np.ndim(features[0][key]) == 0:
+                batch[key] = torch.tensor([int(x[key]) for x in features])
+                continue
+            batch[key] = torch.full(
+                (len(features), max_len), self.pad_values[key], dtype=torch.long
+            )
+            for row, feature in enumerate(features):
+                values = torch.as_tensor(feature[key])
+                batch[key][row, : len(values)] = values
+        return batch
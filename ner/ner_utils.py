@@ -16,9 +16,13 @@ BERT paper (ours): https://arxiv.org/abs/1810.04805
 HuggingFace repository: https://huggingface.co/bert-base-uncased
 """
 
+import itertools
+import time
+
 import numpy as np
 import torch
 from sklearn.metrics import classification_report, jaccard_score
+from text_cleaning import clean_utterance
 
 
 class ATCDataset_for_ner(torch.utils.data.Dataset):
@@ -41,46 +45,172 @@ class ATCDataset_for_ner(torch.utils.data.Dataset):
 
 def encode_tags(tag2id, tags, encodings):
     """Function to encode the tags in the format needed by the model.
-    This is due to using of subword units
+    This is due to using of subword units: the first subword of each word gets
+    the tag of the word, the other subwords (and special tokens) get -100, not
+    used during loss calculation.
+    The alignment is vectorized over the whole corpus, from the flat word_ids
+    (fast tokenizers) or offset mapping. Truncated utterances only get the tags
+    of the words that were kept.
     """
+    if len(encodings["input_ids"]) == 0:
+        return []
+    lengths = np.array([len(x) for x in encodings["input_ids"]], dtype=np.int64)
+    doc_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    doc_index = np.repeat(np.arange(len(lengths)), lengths)
+
+    # flat tag ids of the whole corpus, and start of the tags of each utterance
+    num_tags = np.array([len(doc) for doc in tags], dtype=np.int64)
+    tag_starts = np.concatenate([[0], np.cumsum(num_tags)[:-1]]).astype(np.int64)
+    tag_ids = np.array([tag2id[tag] for doc in tags for tag in doc], dtype=np.int64)
+
+    if encodings.is_fast:
+        # index of the word of each subword (-1 for special and padding tokens)
+        word_ids = np.array(
+            list(
+                itertools.chain.from_iterable(
+                    encodings.word_ids(i) for i in range(len(lengths))
+                )
+            ),
+            dtype=float,
+        )
+        word_index = np.nan_to_num(word_ids, nan=-1).astype(np.int64)
+        previous = np.concatenate([[-1], word_index[:-1]])
+        previous[doc_starts] = -1
+        is_first = (word_index >= 0) & (word_index != previous)
+    else:
+        # the first subword of each word starts at 0 (offsets are word-relative)
+        offsets = np.array(
+            list(itertools.chain.from_iterable(encodings["offset_mapping"])),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        is_first = (offsets[:, 0] == 0) & (offsets[:, 1] != 0)
+        count = np.cumsum(is_first)
+        count_before_doc = count[doc_starts] - is_first[doc_starts]
+        word_index = count - 1 - count_before_doc[doc_index]
+
+    valid = is_first & (word_index < num_tags[doc_index])
+    labels = np.full(len(doc_index), -100, dtype=np.int64)
+    labels[valid] = tag_ids[tag_starts[doc_index[valid]] + word_index[valid]]
+
+    return [x.tolist() for x in np.split(labels, np.cumsum(lengths)[:-1])]
+
+
+def length_bucketed_batches(lengths, batch_size, max_tokens=None):
+    """Group the utterances in batches of similar length, so each batch is padded
+    to its own maximum length (and not to the longest utterance of the set).
+    Inputs:
+        - lengths: number of tokens of each utterance
+        - batch_size: maximum number of utterances per batch
+        - max_tokens: maximum number of tokens per batch, including the padding
+    Output:
+        - list of arrays with the indices of the utterances of each batch
+    """
+    order = np.argsort(lengths, kind="stable")
+    batches, batch, batch_max_len = [], [], 0
+    for idx in order:
+        new_max_len = max(batch_max_len, lengths[idx])
+        is_full = len(batch) == batch_size or (
+            max_tokens is not None and new_max_len * (len(batch) + 1) > max_tokens
+        )
+        if batch and is_full:
+            batches.append(np.array(batch))
+            batch, new_max_len = [], lengths[idx]
+        batch.append(idx)
+        batch_max_len = new_max_len
+
+    if batch:
+        batches.append(np.array(batch))
+    return batches
+
+
+def pad_batch(encodings, indices, pad_token_id, labels=None):
+    """Pad the utterances of one batch to the longest one, returns torch tensors.
+    The labels are padded with -100 (not used by the loss and the metrics)
+    """
+    max_len = max(len(encodings["input_ids"][i]) for i in indices)
+    pad_values = {"input_ids": pad_token_id, "attention_mask": 0, "token_type_ids": 0}
 
-    labels = [[tag2id[tag] for tag in doc] for doc in tags]
-    encoded_labels = []
-    cnt = 0
-    for doc_labels, doc_offset in zip(labels, encodings.offset_mapping):
-
-        # create an empty array of -100, not used during loss calculation
-        doc_enc_labels = np.ones(len(doc_offset), dtype=int) * -100
-        arr_offset = np.array(doc_offset)
-        try:
-            doc_enc_labels[
-                (arr_offset[:, 0] == 0) & (arr_offset[:, 1] != 0)
-            ] = doc_labels
-        except:
-            print(f"Error generating the encoding of line: {cnt}")
+    batch = {}
+    for key, pad_value in pad_values.items():
+        if key not in encodings:
             continue
-        encoded_labels.append(doc_enc_labels.tolist())
-        cnt += 1
-
-    return encoded_labels
+        batch[key] = torch.full((len(indices), max_len), pad_value, dtype=torch.long)
+        for row, idx in enumerate(indices):
+            values = encodings[key][idx]
+            batch[key][row, : len(values)] = torch.tensor(values)
+
+    if labels is not None:
+        batch["labels"] = torch.full((len(indices), max_len), -100, dtype=torch.long)
+        for row, idx in enumerate(indices):
+            batch["labels"][row, : len(labels[idx])] = torch.tensor(labels[idx])
+    return batch
+
+
+def predict_token_classification(
+    model,
+    encodings,
+    batch_size=32,
+    max_tokens=None,
+    pad_token_id=0,
+    device=None,
+    return_probs=False,
+):
+    """Batched forward passes of a token classification model over utterances that
+    are tokenized without padding. The batches are bucketed by length.
+    Outputs:
+        - predicted label id of each token, one array per utterance (original order),
+          or the label probabilities of each token (tokens x labels) if return_probs
+        - stats: number of utterances, tokens (without padding), padded tokens and
+          seconds spent in the forward passes
+    """
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    model.to(device)
+    model.eval()
+
+    lengths = [len(x) for x in encodings["input_ids"]]
+    predictions = [None] * len(lengths)
+    stats = {"utterances": len(lengths), "tokens": sum(lengths), "padded_tokens": 0}
+
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for indices in length_bucketed_batches(lengths, batch_size, max_tokens):
+            batch = pad_batch(encodings, indices, pad_token_id)
+            batch = {key: value.to(device) for key, value in batch.items()}
+            logits = model(**batch).logits
+            if return_probs:
+                outputs = torch.softmax(logits.float(), dim=-1).cpu().numpy()
+            else:
+                outputs = logits.argmax(dim=-1).cpu().numpy()
+            stats["padded_tokens"] += outputs.shape[0] * outputs.shape[1]
+
+            for row, idx in enumerate(indices):
+                predictions[idx] = outputs[row, : lengths[idx]]
+
+    if device == "cuda":
+        torch.cuda.synchronize()
+    stats["seconds"] = time.perf_counter() - start
+    return predictions, stats
+
+
+def throughput_report(stats):
+    """Throughput of the forward passes, in utterances and tokens per second"""
+    seconds = max(stats["seconds"], 1e-9)
+    return (
+        f"THROUGHPUT: {stats['utterances'] / seconds:.2f} utterances/s, "
+        f"{stats['tokens'] / seconds:.2f} tokens/s "
+        f"({stats['utterances']} utterances, {stats['tokens']} tokens, "
+        f"{stats['padded_tokens']} with padding, {stats['seconds']:.2f} s)"
+    )
 
 
 def clean_input_utterance(input_text):
-    """Function to clean the input utterance
+    """Function to clean the input utterance (see text_cleaning.py)
     Inputs:
         - input text
     Output:
         - cleaned text
     """
-    # remove all the words starting with <> or [],
-    sequence = " ".join(filter(lambda x: x[0] != "<", input_text.rstrip().split()))
-    sequence = " ".join(filter(lambda x: x[-1] != ">", sequence.split()))
-    sequence = " ".join(filter(lambda x: x[0] != "[", sequence.split()))
-    sequence = " ".join(filter(lambda x: x[-1] != "]", sequence.split()))
-
-    # remove the greetings in ATCO2 format dobry_den_(greet)
-    sequence = " ".join(filter(lambda x: "(" not in x, sequence.split()))
-    return sequence
+    return clean_utterance(input_text)
 
 
 def read_atc_ner_data(file_path, max_seq_len=120):
@@ -146,6 +276,13 @@ def compute_metrics(predictions, labels, label_list, log_folder=None):
     predictions, labels and label_list (id2tag) are used to compute it.
     """
     predictions = np.argmax(predictions, axis=2)
+    return compute_metrics_from_ids(predictions, labels, label_list, log_folder)
+
+
+def compute_metrics_from_ids(predictions, labels, label_list, log_folder=None):
+    """Same as compute_metrics, but with the predicted label ids (after argmax),
+    given per utterance, thus, the utterances can have different lengths
+    """
 
     # Remove ignored index (special tokens)
     true_predictions = [
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+# File with some utils to run the BERT models on CPU with ONNX Runtime
+#   - export of the NER (token classification) and speaker role (sequence
+#     classification) models to ONNX, with dynamic batch and sequence axes
+#   - optional dynamic int8 quantization of the exported graph
+#   - runtime wrapper with the same interface as the PyTorch models
+#   - parity check (label agreement and F1) against the PyTorch model
+
+import inspect
+import os
+import types
+
+import numpy as np
+import torch
+from sklearn.metrics import f1_score
+from transformers import (
+    AutoConfig,
+    AutoModelForSequenceClassification,
+    AutoModelForTokenClassification,
+)
+
+MODEL_CLASSES = {
+    "token-classification": AutoModelForTokenClassification,
+    "sequence-classification": AutoModelForSequenceClassification,
+}
+
+
+def export_onnx(model, tokenizer, path_onnx, task, opset=14):
+    """Export a (token or sequence) classification model to ONNX. The batch and
+    sequence axes are dynamic, so the graph accepts any dynamically padded batch"""
+    model.eval()
+    dummy = tokenizer(
+        ["lufthansa three two five", "cleared to land"],
+        padding=True,
+        return_tensors="pt",
+    )
+    input_names = [
+        x
+        for x in ["input_ids", "attention_mask", "token_type_ids"]
+        if x in dummy and x in inspect.signature(model.forward).parameters
+    ]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+    if task == "token-classification":
+        dynamic_axes["logits"][1] = "sequence"
+
+    # newer PyTorch versions default to the dynamo exporter, we keep TorchScript
+    export_args = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        export_args["dynamo"] = False
+
+    os.makedirs(os.path.dirname(os.path.abspath(path_onnx)), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(dummy[name] for name in input_names),
+            path_onnx,
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            do_constant_folding=True,
+            **export_args,
+        )
+    return path_onnx
+
+
+def quantize_onnx(path_onnx, path_quantized):
+    """Dynamic int8 quantization of the weights (MatMul/Gemm) of an ONNX graph"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(path_onnx, path_quantized, weight_type=QuantType.QInt8)
+    return path_quantized
+
+
+class OnnxModel:
+    """ONNX Runtime model (CPU) with the interface of the HuggingFace models used by
+    the inference scripts: model(**batch).logits, model.config, .to() and .eval().
+    The config (labels) is read from the folder of the ONNX file"""
+
+    def __init__(self, path_onnx, num_threads=None):
+        import onnxruntime as ort
+
+        self.config = AutoConfig.from_pretrained(os.path.dirname(path_onnx))
+        options = ort.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            path_onnx, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [x.name for x in self.session.get_inputs()]
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+    def __call__(self, **inputs):
+        feeds = {
+            name: np.asarray(inputs[name].cpu(), dtype=np.int64)
+            for name in self.input_names
+            if name in inputs
+        }
+        logits = self.session.run(["logits"], feeds)[0]
+        return types.SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+def load_model(input_model, task, onnx_model=None):
+    """Load the PyTorch model, or the ONNX Runtime wrapper if onnx_model is given"""
+    if onnx_model is not None:
+        print(f"Using the ONNX Runtime backend (CPU): {onnx_model}")
+        return OnnxModel(onnx_model)
+    return MODEL_CLASSES[task].from_pretrained(input_model)
+
+
+def parity_check(torch_model, onnx_model, tokenizer, sequences, batch_size=16):
+    """Compare the labels of the ONNX model with the ones of the PyTorch model:
+    label agreement (%) and macro F1 of the ONNX labels w.r.t. the PyTorch labels.
+    For token classification, the labels of all the (non-padding) tokens are used"""
+    torch_model.eval()
+    reference, hypothesis = [], []
+    for idx in range(0, len(sequences), batch_size):
+        batch = tokenizer(
+            sequences[idx : idx + batch_size],
+            padding=True,
+            truncation=True,
+            return_tensors="pt",
+        )
+        with torch.inference_mode():
+            ref_ids = torch_model(**batch).logits.argmax(dim=-1)
+        hyp_ids = onnx_model(**batch).logits.argmax(dim=-1)
+
+        if ref_ids.dim() == 2:
+            mask = batch["attention_mask"].bool()
+            ref_ids, hyp_ids = ref_ids[mask], hyp_ids[mask]
+        reference.append(ref_ids.numpy())
+        hypothesis.append(hyp_ids.numpy())
+
+    reference, hypothesis = np.concatenate(reference), np.concatenate(hypothesis)
+    return {
+        "labels": len(reference),
+        "agreement": 100 * np.mean(reference == hypothesis),
+        "f1": 100 * f1_score(reference, hypothesis, average="macro"),
+    }
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+"""\
+Script to pre-tokenize a NER (utt2text_tags) or speaker role (utt2spk_id) corpus
+into memory-mapped arrays (see memmap_utils.py), e.g.:
+
+    python3 ner/pretokenize.py --task ner \\
+        experiments/data/other/atco2_test_set_1h/ner/utt2text_tags \\
+        experiments/data/other/atco2_test_set_1h/ner/pretokenized/utt2text_tags
+
+Then, train_ner.py (or speaker_role/train_sec_classification.py) with
+--pretokenized /path/to/prefix selects the utterances of the train/val/test files
+(e.g., the k-fold CSVs of gen_kfolds.py) from this single copy, by utterance id.
+"""
+
+import argparse
+import os
+import sys
+
+from memmap_utils import write_pretokenized
+from ner_utils import encode_tags
+from transformers import AutoTokenizer
+
+# the speaker role data is read with the utils of the speaker_role recipe
+SPEAKER_ROLE_FOLDER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "../speaker_role"
+)
+
+
+def read_ner_corpus(path_to_file, max_seq_len=120):
+    """utt_ids, words and tags of an utt2text_tags file (id;text;tags), as in
+    read_atc_ner_data"""
+    utt_ids, texts, tags = [], [], []
+    with open(path_to_file, "r", encoding="utf8") as f:
+        for sample in f:
+            line = sample.strip().split(";")
+            text = line[1].rstrip().split(" ")
+            if len(text) > max_seq_len:
+                continue
+            utt_ids.append(line[0])
+            texts.append(text)
+            tags.append(line[2].rstrip().split(","))
+    return utt_ids, texts, tags
+
+
+def pretokenize_ner(tokenizer, path_to_file, path_prefix):
+    """Pre-tokenize a NER corpus, labels aligned to the subwords. The tag2id map is
+    stored with the data, so all the folds use the same one"""
+    utt_ids, texts, tags = read_ner_corpus(path_to_file)
+    unique_tags = set(tag for doc in tags for tag in doc) | {"O"}
+    tag2id = {tag: id for id, tag in enumerate(sorted(unique_tags))}
+
+    encodings = tokenizer(
+        texts, is_split_into_words=True, return_offsets_mapping=True, truncation=True
+    )
+    labels = encode_tags(tag2id, tags, encodings)
+    assert len(labels) == len(utt_ids), "some NER tags could not be aligned"
+    encodings.pop("offset_mapping")
+
+    return write_pretokenized(
+        path_prefix, utt_ids, encodings, labels, meta={"tag2id": tag2id}
+    )
+
+
+def pretokenize_speaker_role(tokenizer, path_to_file, path_prefix):
+    """Pre-tokenize a speaker role corpus, one label (spk_id) per utterance"""
+    sys.path.insert(0, SPEAKER_ROLE_FOLDER)
+    from sec_classification_utils import load_data_from_text_file
+
+    data, spk_id, _ = load_data_from_text_file(path_to_file)
+    with open(path_to_file, "r") as rd:
+        utt_ids = [line.split(" ")[0] for line in rd]
+
+    encodings = tokenizer(data, truncation=True)
+    return write_pretokenized(path_prefix, utt_ids, encodings, spk_id)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-t",
+        "--task",
+        choices=["ner", "speaker-role"],
+        default="ner",
+        help="ner (utt2text_tags) or speaker-role (utt2spk_id) corpus",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        default="bert-base-uncased",
+        help="Tokenizer to use, it must be the one of the model to fine-tune",
+    )
+
+    parser.add_argument("input_file", help="utt2text_tags or utt2spk_id file")
+    parser.add_argument(
+        "output_prefix",
+        help="Prefix of the output files, e.g., /path/to/pretokenized/utt2text_tags",
+    )
+    return parser.parse_args()
+
+
+def main(args):
+    """Main code execution"""
+    tokenizer = AutoTokenizer.from_pretrained(
+        args.tokenizer, use_fast=True, do_lower_case=True
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_prefix)), exist_ok=True)
+
+    if args.task == "ner":
+        pretokenize_ner(tokenizer, args.input_file, args.output_prefix)
+    else:
+        pretokenize_speaker_role(tokenizer, args.input_file, args.output_prefix)
+    print(f"Done. Pre-tokenized data in {args.output_prefix}.*")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
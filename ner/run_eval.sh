@@ -18,6 +18,8 @@ DATA=experiments/data
 
 # model related vars
 batch_size=10
+max_tokens=4096
+cache_dir=experiments/cache/eval
 
 # vars of the model and input/output folder
 input_model=bert-base-uncased
@@ -52,7 +54,8 @@ mkdir -p $output_folder/evaluations
 # running the command
 $cmd python3 ner/eval_ner.py \
   --input-model "$output_folder/" \
-  --batch-size $batch_size \
+  --batch-size $batch_size --max-tokens $max_tokens \
+  ${cache_dir:+--cache-dir $cache_dir} \
   --input-files "$input_files" --test-names "$test_names" \
   --output-folder $output_folder/evaluations
 
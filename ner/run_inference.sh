@@ -18,6 +18,7 @@ DATA=experiments/data/other
 
 # model related vars
 batch_size=10
+max_tokens=4096
 
 # vars of the model and input/output folder
 input_model=bert-base-uncased
@@ -52,7 +53,7 @@ mkdir -p $output_folder/inference
 # running the command
 $cmd python3 ner/inference_ner.py \
   --input-model "$output_folder/" \
-  --batch-size $batch_size \
+  --batch-size $batch_size --max-tokens $max_tokens \
   --input-files "$input_files" --test-names "$test_names" \
   --output-folder $output_folder/inference
 
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+DESCRIPTION = """\
+K-fold cross-validation of the NER model (train_ner.py), with the folds trained
+concurrently:
+    1. the folds are generated with gen_kfolds.py (if they do not exist yet)
+    2. the corpus is pre-tokenized once (pretokenize.py), all the folds select
+       their utterances from this single copy
+    3. the folds run in parallel worker processes, each one with a budget of CPU
+       threads (and optionally one of the given GPUs)
+    4. the seqeval metrics of each fold (test_results.json) are aggregated in one
+       summary with means and standard deviations (kfold_summary.json)
+
+Each fold resumes from its last checkpoint, and the folds already finished are
+skipped, thus, the script can be re-run after an interruption.
+"""
+
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from pretokenize import pretokenize_ner
+from transformers import AutoTokenizer
+
+NER_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def generate_folds(args):
+    """Run gen_kfolds.py, only if some of the fold files are missing"""
+    fold_files = [
+        f"{args.folds_dir}/{split}_fold{fold}.csv"
+        for fold in range(1, args.k + 1)
+        for split in ["train", "test"]
+    ]
+    if all(os.path.isfile(x) for x in fold_files):
+        print(f"Using the {args.k} folds in {args.folds_dir}")
+        return
+
+    print(f"Generating {args.k} folds in {args.folds_dir}")
+    subprocess.run(
+        [
+            sys.executable,
+            f"{NER_FOLDER}/gen_kfolds.py",
+            "--input_csv",
+            args.input_csv,
+            "--k",
+            str(args.k),
+            "--seed",
+            str(args.seed),
+            "--save_dir",
+            args.folds_dir,
+        ],
+        check=True,
+    )
+
+
+def run_fold(fold, args, gpu=None):
+    """Train and evaluate one fold with train_ner.py in a worker process, the
+    output (and log) goes to {output_dir}/fold{fold}. Returns the return code"""
+    fold_dir = f"{args.output_dir}/fold{fold}"
+    if os.path.isfile(f"{fold_dir}/test_results.json"):
+        print(f"fold {fold}: already done, skipping")
+        return 0
+    os.makedirs(fold_dir, exist_ok=True)
+
+    cmd = [
+        sys.executable,
+        f"{NER_FOLDER}/train_ner.py",
+        "--pretokenized",
+        args.pretokenized,
+        "--test-data",
+        f"{args.folds_dir}/test_fold{fold}.csv",
+        "--resume",
+        *shlex.split(args.train_args),
+        f"{args.folds_dir}/train_fold{fold}.csv",
+        fold_dir,
+    ]
+
+    # CPU-thread budget (and GPU) of the fold
+    env = dict(os.environ)
+    for var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        env[var] = str(args.threads_per_fold)
+    if gpu is not None:
+        env["CUDA_VISIBLE_DEVICES"] = gpu
+
+    print(f"fold {fold}: training ({args.threads_per_fold} threads, gpu={gpu})")
+    with open(f"{fold_dir}/train.log", "a") as log:
+        returncode = subprocess.run(
+            cmd, env=env, stdout=log, stderr=subprocess.STDOUT
+        ).returncode
+
+    status = "done" if returncode == 0 else f"FAILED, see {fold_dir}/train.log"
+    print(f"fold {fold}: {status}")
+    return returncode
+
+
+def aggregate_metrics(args):
+    """Mean and standard deviation of the test metrics of all the folds"""
+    fold_metrics = {}
+    for fold in range(1, args.k + 1):
+        path = f"{args.output_dir}/fold{fold}/test_results.json"
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                fold_metrics[fold] = json.load(f)
+
+    names = sorted(set(key for x in fold_metrics.values() for key in x))
+    summary = {"folds": fold_metrics, "mean": {}, "std": {}}
+    for name in names:
+        values = np.array([x[name] for x in fold_metrics.values() if name in x])
+        summary["mean"][name] = float(values.mean())
+        summary["std"][name] = float(values.std())
+
+    print(f"\n*** {len(fold_metrics)}/{args.k} folds ***")
+    print(f"{'metric':30s} {'mean':>8s} {'std':>8s}")
+    for name in names:
+        print(f"{name:30s} {summary['mean'][name]:8.4f} {summary['std'][name]:8.4f}")
+
+    with open(f"{args.output_dir}/kfold_summary.json", "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"\nsummary written in {args.output_dir}/kfold_summary.json")
+    return summary
+
+
+def parse_args():
+    """parser"""
+    parser = argparse.ArgumentParser(
+        description=DESCRIPTION, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("-k", "--k", type=int, default=5, help="Number of folds")
+    parser.add_argument(
+        "--seed", type=int, default=2222, help="Seed to generate the folds"
+    )
+    parser.add_argument(
+        "--folds-dir",
+        default=None,
+        help="Folder with the folds, default: {input_csv folder}/{k}_kfold",
+    )
+    parser.add_argument(
+        "--pretokenized",
+        default=None,
+        help="Prefix of the pre-tokenized corpus, it is created if it does not exist\n"
+        "default: {input_csv folder}/pretokenized/{input_csv name}",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        default="bert-base-uncased",
+        help="Tokenizer used to pre-tokenize the corpus (the one of the model)",
+    )
+    parser.add_argument(
+        "-j",
+        "--num-parallel",
+        type=int,
+        default=2,
+        help="Number of folds trained at the same time",
+    )
+    parser.add_argument(
+        "--threads-per-fold",
+        type=int,
+        default=None,
+        help="CPU threads of each fold, default: number of CPUs / num-parallel",
+    )
+    parser.add_argument(
+        "--gpus",
+        default="",
+        help="GPUs to use, e.g., '0 1', assigned to the folds round-robin",
+    )
+    parser.add_argument(
+        "--train-args",
+        default="",
+        help="Extra arguments for train_ner.py, e.g., '--max-steps 3000 --seed 1234'",
+    )
+
+    parser.add_argument(
+        "input_csv", help="NER corpus (utt2text_tags) to split in folds"
+    )
+    parser.add_argument(
+        "output_dir", help="Output folder, one sub-folder per fold and the summary"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Main code execution"""
+    args = parse_args()
+
+    input_folder = os.path.dirname(os.path.abspath(args.input_csv))
+    args.folds_dir = args.folds_dir or f"{input_folder}/{args.k}_kfold"
+    args.pretokenized = args.pretokenized or (
+        f"{input_folder}/pretokenized/{os.path.basename(args.input_csv)}"
+    )
+    args.threads_per_fold = args.threads_per_fold or max(
+        1, (os.cpu_count() or 1) // args.num_parallel
+    )
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # 1. folds and 2. pre-tokenized corpus, both are only created once
+    generate_folds(args)
+    if not os.path.isfile(f"{args.pretokenized}.json"):
+        print(f"Pre-tokenizing {args.input_csv} in {args.pretokenized}")
+        os.makedirs(os.path.dirname(args.pretokenized), exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(
+            args.tokenizer, use_fast=True, do_lower_case=True
+        )
+        pretokenize_ner(tokenizer, args.input_csv, args.pretokenized)
+
+    # 3. train the folds concurrently
+    gpus = args.gpus.split()
+    with ThreadPoolExecutor(max_workers=args.num_parallel) as executor:
+        returncodes = list(
+            executor.map(
+                lambda fold: run_fold(
+                    fold, args, gpus[(fold - 1) % len(gpus)] if gpus else None
+                ),
+                range(1, args.k + 1),
+            )
+        )
+
+    # 4. aggregate the metrics of the folds
+    aggregate_metrics(args)
+    if any(returncodes):
+        sys.exit(f"{sum(x != 0 for x in returncodes)} folds failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+"""\
+Test client and load generator for inference_server.py. N concurrent clients send
+single-utterance requests and the client-side latencies, the throughput and the
+server metrics (queue depth, batch sizes, latencies) are reported, e.g.:
+
+    python3 ner/server_client.py --url http://127.0.0.1:8000 --endpoint /tag \\
+        --concurrency 16 --requests 2000 --input-file /path/to/kaldi/text
+
+With --stub, a local server with stub models (a fixed cost per batch plus a cost
+per utterance, no model is loaded) is started in the same process, to test the
+micro-batching settings (--max-batch-size, --max-wait-ms) without GPUs or models.
+"""
+
+import argparse
+import http.client
+import json
+import random
+import socket
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from server_utils import make_http_server
+
+# some ATC-like utterances, used if no --input-file is given
+STUB_UTTERANCES = [
+    "lufthansa one two three contact ruzyne radar one two seven decimal one two five",
+    "ryanair four five alpha descend flight level eight zero",
+    "csa two charlie cleared to land runway two four wind calm",
+    "oscar kilo papa alpha bravo taxi to holding point alpha one",
+    "good morning speedbird five six climbing flight level one two zero",
+    "wizzair one bravo squawk four six two one",
+]
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket"""
+
+    def __init__(self, path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class InferenceClient:
+    """Client of inference_server.py, one persistent connection per thread"""
+
+    def __init__(self, url=None, unix_socket=None):
+        self.url = urllib.parse.urlparse(url or "http://127.0.0.1:8000")
+        self.unix_socket = unix_socket
+        self.local = threading.local()
+
+    def _connection(self):
+        if getattr(self.local, "connection", None) is None:
+            if self.unix_socket is not None:
+                self.local.connection = UnixHTTPConnection(self.unix_socket)
+            else:
+                self.local.connection = http.client.HTTPConnection(
+                    self.url.hostname, self.url.port or 80, timeout=60
+                )
+        return self.local.connection
+
+    def request(self, method, path, payload=None):
+        body = json.dumps(payload).encode("utf8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body else {}
+        connection = self._connection()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = json.loads(response.read())
+        except (ConnectionError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            raise
+        if response.status != 200:
+            raise RuntimeError(f"{method} {path}: {response.status} {data}")
+        return data
+
+    def tag(self, text, endpoint="/tag"):
+        return self.request("POST", endpoint, {"text": text})
+
+    def metrics(self):
+        return self.request("GET", "/metrics")
+
+
+def stub_backend(task, batch_ms=5.0, utterance_ms=0.2):
+    """Stub model: sleeps a fixed time per batch plus a time per utterance (as a
+    forward pass), returns outputs with the format of the real backends"""
+
+    def _backend(texts):
+        time.sleep((batch_ms + utterance_ms * len(texts)) / 1000)
+        if task == "ner":
+            return [{"text": x.split(), "tags": ["O"] * len(x.split())} for x in texts]
+        return [{"label": "atco", "score": 0.5} for _ in texts]
+
+    return _backend
+
+
+def start_stub_server(args):
+    """inference_server.py with stub models, served from a background thread"""
+    from inference_server import InferenceServer
+
+    app = InferenceServer(
+        {
+            "ner": stub_backend("ner", args.stub_batch_ms, args.stub_utterance_ms),
+            "speaker_role": stub_backend(
+                "speaker_role", args.stub_batch_ms, args.stub_utterance_ms
+            ),
+        },
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+    )
+    server = make_http_server(app, port=0, unix_socket=args.unix_socket)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if args.unix_socket is None:
+        args.url = f"http://127.0.0.1:{server.server_address[1]}"
+    return server
+
+
+def run_load(client, utterances, endpoint, num_requests, concurrency):
+    """Send num_requests single-utterance requests from concurrency threads, returns
+    the latency (s) of each request and the total time"""
+
+    def _send(idx):
+        start = time.perf_counter()
+        client.tag(utterances[idx % len(utterances)], endpoint=endpoint)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(_send, range(num_requests)))
+    return np.array(latencies), time.perf_counter() - start
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server URL")
+    parser.add_argument(
+        "--unix-socket", default=None, help="Connect to a Unix socket instead of TCP"
+    )
+    parser.add_argument(
+        "-e",
+        "--endpoint",
+        default="/tag",
+        choices=["/tag", "/ner", "/speaker-role"],
+        help="Endpoint to load",
+    )
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=8, help="Concurrent clients"
+    )
+    parser.add_argument(
+        "-n", "--requests", type=int, default=1000, help="Number of requests"
+    )
+    parser.add_argument(
+        "-i",
+        "--input-file",
+        default=None,
+        help="Kaldi text file with the utterances to send, default: stub utterances",
+    )
+
+    # local stub server
+    parser.add_argument(
+        "--stub",
+        action="store_true",
+        help="Start a local server with stub models and load it",
+    )
+    parser.add_argument("--max-batch-size", type=int, default=32, help="(--stub)")
+    parser.add_argument("--max-wait-ms", type=float, default=10.0, help="(--stub)")
+    parser.add_argument(
+        "--stub-batch-ms", type=float, default=5.0, help="(--stub) cost per batch"
+    )
+    parser.add_argument(
+        "--stub-utterance-ms",
+        type=float,
+        default=0.2,
+        help="(--stub) cost per utterance",
+    )
+    return parser.parse_args()
+
+
+def main(args):
+    """Main code execution"""
+    server = start_stub_server(args) if args.stub else None
+
+    utterances = STUB_UTTERANCES
+    if args.input_file is not None:
+        with open(args.input_file, "r") as rd:
+            utterances = [" ".join(line.split()[1:]) for line in rd if line.strip()]
+    random.seed(1234)
+    random.shuffle(utterances)
+
+    client = InferenceClient(url=args.url, unix_socket=args.unix_socket)
+    print(f"Example {args.endpoint}: {client.tag(utterances[0], args.endpoint)}")
+
+    latencies, seconds = run_load(
+        client, utterances, args.endpoint, args.requests, args.concurrency
+    )
+    p50, p95, p99 = 1000 * np.percentile(latencies, [50, 95, 99])
+    print(
+        f"\n{args.requests} requests, {args.concurrency} concurrent clients: "
+        f"{args.requests / seconds:.1f} requests/s"
+    )
+    print(f"client latency (ms): p50 {p50:.2f}, p95 {p95:.2f}, p99 {p99:.2f}")
+
+    print("\nserver metrics:")
+    print(json.dumps(client.metrics(), indent=2))
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
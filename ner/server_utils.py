@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+# File with some utils for the text inference server (inference_server.py)
+#   - adaptive micro-batching of concurrent requests: one worker thread per model
+#     takes the queued utterances in batches of up to max_batch_size. Once the queue
+#     is empty, it only waits for the next request if the recent arrivals predict
+#     one soon, and never beyond max_wait_ms after the arrival of the oldest one.
+#     Thus, a lone request is dispatched at once and, under high load, the batches
+#     fill up from the backlog
+#   - queue depth, batch size and latency metrics (over the last requests)
+#   - HTTP server over TCP or over a Unix socket
+
+import http.server
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Queue of single-utterance requests served in micro-batches by one worker
+    thread. process_fn takes a list of utterances and returns one output each"""
+
+    def __init__(self, process_fn, max_batch_size=32, max_wait_ms=10.0, window=10000):
+        self.process_fn = process_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+
+        # mean gap (s) between the arrivals of the requests collected for the same
+        # batch, the gaps spanning a dispatch (e.g., a client waiting for its
+        # previous response) do not predict the next arrival and are not counted
+        self.mean_gap = 0.0
+        self.last_arrival = None
+        self.dispatches = 0
+
+        # metrics, the latencies are kept for the last `window` requests
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_queue_depth = 0
+        self.latencies = deque(maxlen=window)
+        self.queue_waits = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.compute_times = deque(maxlen=window)
+
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, item):
+        """Queue one utterance, returns a Future with its output"""
+        future = Future()
+        arrival = time.perf_counter()
+        with self.lock:
+            previous = self.last_arrival
+            if previous is not None and previous[1] == self.dispatches:
+                gap = min(arrival - previous[0], self.max_wait)
+                self.mean_gap = 0.8 * self.mean_gap + 0.2 * gap
+            self.last_arrival = (arrival, self.dispatches)
+            self.queue.put((arrival, item, future))
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return future
+
+    def _next_batch(self):
+        """Block until a request arrives, then collect the queued ones until the
+        batch is full. With an empty queue, wait for the next request up to twice
+        the mean gap between arrivals, bounded by the deadline of the oldest one"""
+        batch = [self.queue.get()]
+        deadline = batch[0][0] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            with self.lock:
+                wait = min(deadline - time.perf_counter(), 2 * self.mean_gap)
+            if wait <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=wait))
+            except queue.Empty:
+                break
+        with self.lock:
+            self.dispatches += 1
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            start = time.perf_counter()
+            try:
+                outputs = self.process_fn([item for _, item, _ in batch])
+                for (_, _, future), output in zip(batch, outputs):
+                    future.set_result(output)
+            except Exception as error:
+                for _, _, future in batch:
+                    future.set_exception(error)
+                with self.lock:
+                    self.errors += len(batch)
+            end = time.perf_counter()
+
+            with self.lock:
+                self.requests += len(batch)
+                self.batches += 1
+                self.batch_sizes.append(len(batch))
+                self.compute_times.append(end - start)
+                for arrival, _, _ in batch:
+                    self.queue_waits.append(start - arrival)
+                    self.latencies.append(end - arrival)
+
+    def metrics(self):
+        """Queue depth, batch sizes and latencies (ms) of the last requests"""
+
+        def _percentiles(values):
+            if not values:
+                return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0}
+            values = 1000 * np.asarray(values)
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            return {
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "mean": float(values.mean()),
+            }
+
+        with self.lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "requests": self.requests,
+                "batches": self.batches,
+                "errors": self.errors,
+                "mean_batch_size": (
+                    float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0
+                ),
+                "latency_ms": _percentiles(self.latencies),
+                "queue_wait_ms": _percentiles(self.queue_waits),
+                "batch_compute_ms": _percentiles(self.compute_times),
+            }
+
+
+class JSONRequestHandler(http.server.BaseHTTPRequestHandler):
+    """GET/POST with JSON bodies, the requests are answered by server.app.handle.
+    The connections are kept alive (HTTP/1.1), each client re-uses its own"""
+
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, no Nagle delays on small responses
+    disable_nagle_algorithm = True
+
+    def _reply(self, method):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length)) if length else {}
+            status, response = self.server.app.handle(method, self.path, payload)
+        except (ValueError, KeyError, TypeError) as error:
+            status, response = 400, {"error": str(error)}
+        except Exception as error:
+            # e.g., a failure of the model (CUDA OOM), the client can retry on the
+            # same connection
+            status, response = 500, {"error": f"{type(error).__name__}: {error}"}
+
+        body = json.dumps(response).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply("GET")
+
+    def do_POST(self):
+        self._reply("POST")
+
+    def address_string(self):
+        # the client address is empty with Unix sockets
+        return self.client_address[0] if self.client_address else "unix-socket"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ThreadingHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+
+
+def make_http_server(app, host="127.0.0.1", port=8000, unix_socket=None, verbose=False):
+    """HTTP server (one thread per connection) that answers with app.handle, over
+    TCP or over a Unix socket if unix_socket is given"""
+    if unix_socket is not None:
+        server = ThreadingUnixHTTPServer(unix_socket, JSONRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), JSONRequestHandler)
+    server.app = app
+    server.verbose = verbose
+    return server
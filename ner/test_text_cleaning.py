@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+# Golden tests of text_cleaning.py against the previous implementations of
+# clean_input_utterance (ner_utils.py, speaker_role/sec_classification_utils.py and
+# data/utils/get_tags_speaker.py), run with: python3 -m pytest ner/test_text_cleaning.py
+
+import random
+
+import pytest
+from text_cleaning import clean_utterance, clean_utterances
+
+
+def legacy_ner(input_text):
+    """clean_input_utterance of ner_utils.py"""
+    sequence = " ".join(filter(lambda x: x[0] != "<", input_text.rstrip().split()))
+    sequence = " ".join(filter(lambda x: x[-1] != ">", sequence.split()))
+    sequence = " ".join(filter(lambda x: x[0] != "[", sequence.split()))
+    sequence = " ".join(filter(lambda x: x[-1] != "]", sequence.split()))
+    sequence = " ".join(filter(lambda x: "(" not in x, sequence.split()))
+    return sequence
+
+
+def legacy_speaker_role(input_text):
+    """clean_input_utterance of sec_classification_utils.py and get_tags_speaker.py"""
+    sequence = " ".join(filter(lambda x: x[0] != "<", input_text.strip().split()))
+    sequence = " ".join(filter(lambda x: x[-1] != ">", sequence.split()))
+    sequence = " ".join(filter(lambda x: x[0] != "[", sequence.split()))
+    sequence = " ".join(filter(lambda x: x[-1] != "]", sequence.split()))
+    sequence = " ".join(filter(lambda x: "(" not in x, sequence.split()))
+    return sequence.lower()
+
+
+GOLDEN = [
+    ("", ""),
+    ("   \n", ""),
+    ("Lufthansa One Two Three", "Lufthansa One Two Three"),
+    ("  ryanair   four\tfive alpha \n", "ryanair four five alpha"),
+    ("[noise] csa two charlie [#unk]", "csa two charlie"),
+    ("<speaker> oscar kilo </speaker>", "oscar kilo"),
+    ("<ovl>hello</ovl> world", "world"),
+    ("hello<ovl> there [hesitation", "there"),
+    ("dobry_den_(greet) Lufthansa", "Lufthansa"),
+    ("good (morning) speedbird", "good speedbird"),
+    ("one a<b c]d e[f g>h", "one a<b c]d e[f g>h"),
+    (") stays ]] [[ <> ( x", ") stays x"),
+    ("DOBRY_DEN_(greet) SQUAWK four", "SQUAWK four"),
+]
+
+
+@pytest.mark.parametrize("text,expected", GOLDEN)
+def test_golden(text, expected):
+    assert clean_utterance(text) == expected
+    assert clean_utterance(text, lower=True) == expected.lower()
+    assert legacy_ner(text) == expected
+    assert legacy_speaker_role(text) == expected.lower()
+
+
+def test_random_against_legacy():
+    words = [
+        "lufthansa",
+        "One",
+        "TWO",
+        "<speaker>",
+        "</speaker>",
+        "[noise]",
+        "[#unk]",
+        "dobry_den_(greet)",
+        "(x",
+        "a>",
+        "]b",
+        "<ovl>hi",
+        "x[y",
+        "İstanbul",
+        "",
+    ]
+    spaces = [" ", "  ", "\t", "\n", "\u00a0", "\u2028"]
+    rng = random.Random(1234)
+    texts = [
+        "".join(
+            rng.choice(words) + rng.choice(spaces) for _ in range(rng.randint(0, 12))
+        )
+        for _ in range(2000)
+    ]
+
+    assert clean_utterances(texts) == [legacy_ner(x) for x in texts]
+    assert clean_utterances(texts, lower=True) == [
+        legacy_speaker_role(x) for x in texts
+    ]
+    assert [clean_utterance(x) for x in texts] == clean_utterances(texts)
+
+
+def test_wrappers():
+    import os
+    import sys
+
+    import ner_utils
+
+    folder = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(folder, "../speaker_role"))
+    sys.path.insert(0, os.path.join(folder, "../data/utils"))
+    import get_tags_speaker
+    import sec_classification_utils
+
+    text = "<speaker> Dobry_den_(greet) CSA two [noise] Charlie"
+    assert ner_utils.clean_input_utterance(text) == legacy_ner(text)
+    for module in [sec_classification_utils, get_tags_speaker]:
+        assert module.clean_input_utterance(text) == legacy_speaker_role(text)
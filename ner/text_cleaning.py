@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+# Cleaning of the input utterances, shared by the NER and speaker role recipes
+# (training, evaluation and inference) and by the data preparation scripts:
+#   - the words starting with < or [, ending with > or ], and the ATCO2 greetings
+#     (e.g., dobry_den_(greet)) are removed, the whitespace is normalized
+#   - one compiled regex per word, the lines without any of these characters
+#     only have their whitespace normalized
+
+import re
+
+# characters of the words to remove, lines without them are kept as they are
+MARKUP_CHARS = frozenset("<>[](")
+
+# words starting with <> or [], or with a greeting in ATCO2 format
+DROP_WORD = re.compile(r"^[<\[]|[>\]]$|\(")
+
+
+def clean_utterance(input_text, lower=False):
+    """Function to clean the input utterance
+    Inputs:
+        - input text
+        - lower: whether to lower case the output (speaker role models)
+    Output:
+        - cleaned text
+    """
+    if MARKUP_CHARS.isdisjoint(input_text):
+        sequence = " ".join(input_text.split())
+    else:
+        sequence = " ".join(
+            [word for word in input_text.split() if not DROP_WORD.search(word)]
+        )
+    return sequence.lower() if lower else sequence
+
+
+def clean_utterances(input_texts, lower=False):
+    """Same as clean_utterance, for a list of utterances"""
+    plain, search = MARKUP_CHARS.isdisjoint, DROP_WORD.search
+    sequences = [
+        (
+            " ".join(text.split())
+            if plain(text)
+            else " ".join([word for word in text.split() if not search(word)])
+        )
+        for text in input_texts
+    ]
+    return [x.lower() for x in sequences] if lower else sequences
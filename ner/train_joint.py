@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+"""\
+Script to train a joint named entity recognition + speaker role model. One
+pretrained BERT-base-uncased encoder* is shared by a token classification head
+(NER, as ner/train_ner.py) and a sequence classification head (atco/pilot, as
+speaker_role/train_sec_classification.py), so both outputs come from a single
+forward pass at inference time (see inference_joint.py).
+
+The format of the train/dev/test sets should be:
+    - NER: <id>;<text>;<tokens> (utt2text_tags)
+    - speaker role: <id> <0/1> <atco/pilot> <transcript> (utt2spk_id)
+Both files are merged by utterance id, the utterances present in only one of
+them are used only for the corresponding head.
+
+* Other models can be used as well, e.g., bert-base-cased
+BERT paper (ours): https://arxiv.org/abs/1810.04805
+HuggingFace repository: https://huggingface.co/bert-base-uncased
+"""
+
+import argparse
+import logging
+import random
+import sys
+
+import datasets
+import numpy as np
+import torch
+import transformers
+from joint_utils import (
+    ATCDataset_for_joint,
+    BertForJointNerSpeakerRole,
+    JointDataCollator,
+    encode_joint_data,
+    id2role,
+    read_joint_data,
+    role2id,
+    role_metrics,
+)
+from ner_utils import compute_metrics_from_ids
+from sklearn.metrics import classification_report
+from sklearn.model_selection import train_test_split
+from transformers import (
+    AutoConfig,
+    AutoTokenizer,
+    Trainer,
+    TrainingArguments,
+    set_seed,
+)
+
+logger = logging.getLogger(__name__)
+
+# getting the device (CPU/GPU)
+if torch.cuda.is_available():
+    device = torch.device("cuda")
+    print(f"There are {torch.cuda.device_count()} GPU(s) available.")
+    print("Device name:", torch.cuda.get_device_name(0))
+else:
+    print("No GPU available, using the CPU instead.")
+    device = -1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    # reporting vars
+    parser.add_argument(
+        "--report-to",
+        type=str,
+        default=None,
+        help="Where to report the results, you can choose e.g., WANDB",
+    )
+
+    # some training parameters
+    parser.add_argument(
+        "-e",
+        "--epochs",
+        type=int,
+        default=5,
+        help="Number of epochs of fine-tuning/training",
+    )
+    parser.add_argument(
+        "-s", "--seed", type=int, default=1234, help="Seed for training"
+    )
+    parser.add_argument(
+        "-tb", "--train-batch-size", type=int, default=32, help="Training batch size"
+    )
+    parser.add_argument(
+        "-eb", "--eval-batch-size", type=int, default=16, help="Evaluation batch size"
+    )
+    parser.add_argument(
+        "--gradient-accumulation-steps",
+        type=int,
+        default=1,
+        help="Number of gradient accumulation steps",
+    )
+    parser.add_argument(
+        "--warmup-steps", type=int, default=500, help="Number of warm up steps"
+    )
+    parser.add_argument(
+        "--logging-steps", type=int, default=1000, help="Logging steps size"
+    )
+    parser.add_argument(
+        "--save-steps", type=int, default=1000, help="Number of steps to save the model"
+    )
+    parser.add_argument(
+        "--eval-steps", type=int, default=500, help="Perform evaluation each N steps"
+    )
+    parser.add_argument(
+        "--max-steps",
+        type=int,
+        default=3000,
+        help="Maximum number of steps to train the model",
+    )
+    parser.add_argument(
+        "--max-train-samples",
+        type=int,
+        default=-1,
+        help="Maximum number of training samples to use during training. pass -1 to use the whole training set",
+    )
+
+    parser.add_argument(
+        "--input-model",
+        default=None,
+        help="Path to a previously trained model, to fine tune it",
+    )
+    parser.add_argument(
+        "--role-loss-weight",
+        type=float,
+        default=1.0,
+        help="Weight of the speaker role loss, added to the NER loss",
+    )
+    parser.add_argument(
+        "--val-data",
+        default=None,
+        help="Validation files, NER (utt2text_tags) and speaker role (utt2spk_id) "
+        "separated by a space",
+    )
+    parser.add_argument(
+        "--test-data",
+        default=None,
+        help="Test files, NER (utt2text_tags) and speaker role (utt2spk_id) "
+        "separated by a space",
+    )
+
+    parser.add_argument(
+        "train_data",
+        help="Train file used for training the NER head (utt2text_tags)",
+    )
+    parser.add_argument(
+        "train_role_data",
+        help="Train file used for training the speaker role head (utt2spk_id)",
+    )
+    parser.add_argument(
+        "output_folder",
+        help="name of the output folder to store the joint model and tokenizer",
+    )
+    return parser.parse_args()
+
+
+def main(args):
+    """Main code execution"""
+
+    # Setup logging (following HuggingFace style)
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+
+    log_level = logging.INFO
+    logger.setLevel(log_level)
+    datasets.utils.logging.set_verbosity(log_level)
+    transformers.utils.logging.set_verbosity(log_level)
+    transformers.utils.logging.enable_default_handler()
+    transformers.utils.logging.enable_explicit_format()
+
+    # first, set all the seeds:
+    torch.manual_seed(args.seed)
+    torch.cuda.manual_seed(args.seed)
+    torch.cuda.manual_seed_all(args.seed)
+    random.seed(args.seed)
+    torch.backends.cudnn.benchmark = False
+    torch.backends.cudnn.deterministic = True
+    set_seed(args.seed)
+
+    # change "model name" to use another NLP system from Huggingface
+    model_name = (
+        args.input_model if args.input_model is not None else "bert-base-uncased"
+    )
+    output_directory = args.output_folder
+
+    logger.info("*** Loading the Tokenizer (FastTokenizer) ***")
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_name, use_fast=True, do_lower_case=True
+    )
+
+    # read train and validation data
+    logger.info("*** Loading and preparing training and validation data ***")
+    train_data = read_joint_data(args.train_data, args.train_role_data)
+
+    # split the train data in case there is not val data available
+    if args.val_data == "" or args.val_data == None:
+        logger.info(
+            "*** You did not give validation data, splitting it in train/dev from train ***"
+        )
+        percentage = 0.1 if len(train_data[0]) < 100000 else 5000 / len(train_data[0])
+        logger.info(f"*** taking {percentage*100}% of train data for dev set ***")
+
+        splits = train_test_split(*train_data, test_size=percentage)
+        train_data, val_data = splits[0::2], splits[1::2]
+    else:
+        logger.info("*** Using the validation data files ***")
+        val_data = read_joint_data(*args.val_data.split())
+
+    _, train_texts, train_tags, train_roles = train_data
+    _, val_texts, val_tags, val_roles = val_data
+    logger.info(
+        f"*** {len(train_texts)} train utterances, "
+        f"{sum(x is not None for x in train_tags)} with NER tags, "
+        f"{sum(x != -100 for x in train_roles)} with speaker role ***"
+    )
+
+    # create sets with the tags, the 'O' label is standard in NER systems
+    unique_tags = set(tag for doc in train_tags + val_tags if doc for tag in doc)
+    unique_tags.add("O")
+    logger.info(f"*** There are {len(unique_tags)} unique tags ***")
+    tag2id = {tag: id for id, tag in enumerate(sorted(unique_tags))}
+    id2tag = {id: tag for tag, id in tag2id.items()}
+
+    # Tokenize text and generate the datasets
+    logger.info("*** Tokenizing the train/val sets ***")
+    train_encodings, train_labels = encode_joint_data(
+        tokenizer, tag2id, train_texts, train_tags
+    )
+    val_encodings, val_labels = encode_joint_data(
+        tokenizer, tag2id, val_texts, val_tags
+    )
+    train_dataset = ATCDataset_for_joint(train_encodings, train_labels, train_roles)
+    val_dataset = ATCDataset_for_joint(val_encodings, val_labels, val_roles)
+
+    # reduce the data in the training set in case we want to use less samples
+    if args.max_train_samples is not None and args.max_train_samples != -1:
+        max_train_samples = min(len(train_dataset), args.max_train_samples)
+        logger.info(
+            f"*** Reducing the training dataset size to: {max_train_samples} ***"
+        )
+
+        indices = torch.arange(max_train_samples)
+        train_dataset = torch.utils.data.Subset(train_dataset, indices)
+
+    # either, prepare the test set passed or use validation as 'final' test set
+    if args.test_data is not None:
+        _, test_texts, test_tags, test_roles = read_joint_data(*args.test_data.split())
+        test_encodings, test_labels = encode_joint_data(
+            tokenizer, tag2id, test_texts, test_tags
+        )
+        test_dataset = ATCDataset_for_joint(test_encodings, test_labels, test_roles)
+    else:
+        test_dataset = val_dataset
+
+    # Fetch the model (shared encoder, NER and speaker role heads)
+    logger.info("*** Loading the joint NER + speaker role model ***")
+    # the attributes of the role head are not in BertConfig, they must be set on the
+    # config (from_pretrained would pass them to the model constructor)
+    config = AutoConfig.from_pretrained(
+        model_name, num_labels=len(tag2id), label2id=tag2id, id2label=id2tag
+    )
+    config.role2id = role2id
+    config.id2role = id2role
+    config.role_loss_weight = args.role_loss_weight
+    base_model = BertForJointNerSpeakerRole.from_pretrained(model_name, config=config)
+
+    # function to compute metrics during training
+    def compute_metrics_training(p):
+        (logits, role_logits), (labels, role_labels) = p
+        predictions = np.argmax(logits, axis=2)
+
+        # Remove ignored index (special tokens and utterances without NER tags)
+        true_predictions = [
+            [id2tag[p] for (p, l) in zip(prediction, label) if l != -100]
+            for prediction, label in zip(predictions, labels)
+        ]
+        true_labels = [
+            [id2tag[l] for (p, l) in zip(prediction, label) if l != -100]
+            for prediction, label in zip(predictions, labels)
+        ]
+
+        # Metrics
+        metric = datasets.load_metric("seqeval")
+        results = metric.compute(predictions=true_predictions, references=true_labels)
+
+        return {
+            "precision": results["overall_precision"],
+            "recall": results["overall_recall"],
+            "f1": results["overall_f1"],
+            "accuracy": results["overall_accuracy"],
+            "role_accuracy": role_metrics(role_logits, role_labels),
+        }
+
+    # Define TrainingArguments for Trainer object
+    training_args = TrainingArguments(
+        report_to=args.report_to,
+        output_dir=output_directory,
+        num_train_epochs=args.epochs,
+        per_device_train_batch_size=args.train_batch_size,
+        per_device_eval_batch_size=args.eval_batch_size,
+        load_best_model_at_end=True,
+        warmup_steps=args.warmup_steps,
+        weight_decay=0.001,
+        gradient_accumulation_steps=args.gradient_accumulation_steps,
+        evaluation_strategy="steps",
+        logging_dir=output_directory + "/logs",
+        logging_steps=args.logging_steps,
+        max_steps=args.max_steps,
+        save_steps=args.save_steps,
+        eval_steps=args.eval_steps,
+        save_total_limit=0,
+        label_names=["labels", "role_labels"],
+    )
+
+    # Define Trainer object
+    trainer = Trainer(
+        model=base_model,
+        args=training_args,
+        train_dataset=train_dataset,
+        eval_dataset=val_dataset,
+        compute_metrics=compute_metrics_training,
+        data_collator=JointDataCollator(tokenizer),
+    )
+
+    # fine-tune the model
+    logger.info("*** Training ***")
+    train_results = trainer.train()
+    metrics = train_results.metrics
+
+    # saving the final model and tokenizer after fine-tuning it,
+    trainer.log_metrics("train", metrics)
+    trainer.save_metrics("train", metrics)
+    trainer.save_state()
+    trainer.save_model(output_dir=f"{output_directory}/")
+    tokenizer.save_pretrained(f"{output_directory}/")
+
+    # Performing a last evaluation of the test dataset,
+    logger.info("*** Evaluate ***")
+
+    # Make prediction and compute metrics of both heads,
+    (logits, role_logits), (labels, role_labels), _ = trainer.predict(test_dataset)
+    compute_metrics_from_ids(
+        np.argmax(logits, axis=2),
+        labels,
+        label_list=id2tag,
+        log_folder=f"{output_directory}/classification_report",
+    )
+
+    mask = role_labels != -100
+    role_report = classification_report(
+        y_true=role_labels[mask],
+        y_pred=np.argmax(role_logits, axis=1)[mask],
+        labels=list(id2role),
+        target_names=list(id2role.values()),
+    )
+    print(role_report)
+    with open(f"{output_directory}/role_classification_report", "w") as f:
+        print(role_report, file=f)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
@@ -21,6 +21,7 @@ HuggingFace repository: https://huggingface.co/bert-base-uncased
 
 import argparse
 import logging
+import os
 import random
 import sys
 
@@ -29,6 +30,12 @@ import numpy as np
 import torch
 import transformers
 from datasets import load_metric
+from memmap_utils import (
+    DynamicPaddingCollator,
+    MemmapDataset,
+    read_pretokenized_meta,
+    select_indices,
+)
 from ner_utils import (
     ATCDataset_for_ner,
     compute_metrics,
@@ -46,6 +53,7 @@ from transformers import (
     TrainingArguments,
     set_seed,
 )
+from transformers.trainer_utils import get_last_checkpoint
 
 logger = logging.getLogger(__name__)
 
@@ -123,6 +131,17 @@ def parse_args():
         default=None,
         help="Path to a previously trained model, to fine tune it",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume the training from the last checkpoint in the output folder",
+    )
+    parser.add_argument(
+        "--pretokenized",
+        default=None,
+        help="Prefix of the pre-tokenized corpus (see pretokenize.py), the utterances "
+        "of the train/val/test files are selected from it by id",
+    )
     parser.add_argument(
         "--val-data",
         default=None,
@@ -143,46 +162,9 @@ def parse_args():
     return parser.parse_args()
 
 
-def main(args):
-    """Main code execution"""
-
-    # Setup logging (following HuggingFace style)
-    logging.basicConfig(
-        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
-        datefmt="%m/%d/%Y %H:%M:%S",
-        handlers=[logging.StreamHandler(sys.stdout)],
-    )
-
-    log_level = logging.INFO
-    logger.setLevel(log_level)
-    datasets.utils.logging.set_verbosity(log_level)
-    transformers.utils.logging.set_verbosity(log_level)
-    transformers.utils.logging.enable_default_handler()
-    transformers.utils.logging.enable_explicit_format()
-
-    # first, set all the seeds:
-    torch.manual_seed(args.seed)
-    torch.cuda.manual_seed(args.seed)
-    torch.cuda.manual_seed_all(args.seed)
-    random.seed(args.seed)
-    torch.backends.cudnn.benchmark = False
-    torch.backends.cudnn.deterministic = True
-    set_seed(args.seed)
-
-    # change "model name" to use another NLP system from Huggingface
-    model_name = (
-        args.input_model if args.input_model is not None else "bert-base-uncased"
-    )
-    output_directory = args.output_folder
-
-    logger.info("*** Loading the Tokenizer (FastTokenizer) ***")
-    tokenizer = AutoTokenizer.from_pretrained(
-        model_name, use_fast=True, do_lower_case=True
-    )
-
-    # read train and validation data
-    logger.info("*** Loading and preparing training and validation data ***")
-
+def tokenize_datasets(args, tokenizer):
+    """Read the train/val/test files (utt2text_tags) and tokenize them, the
+    tag2id map is built from the train and val tags"""
     # read train and validation data
     # split the train data in case there is not val data available
     if args.val_data == "" or args.val_data == None:
@@ -244,16 +226,6 @@ def main(args):
     train_dataset = ATCDataset_for_ner(train_encodings, train_labels)
     val_dataset = ATCDataset_for_ner(val_encodings, val_labels)
 
-    # reduce the data in the training set in case we want to use less samples
-    if args.max_train_samples is not None and args.max_train_samples != -1:
-        max_train_samples = min(len(train_dataset), args.max_train_samples)
-        logger.info(
-            f"*** Reducing the training dataset size to: {max_train_samples} ***"
-        )
-
-        indices = torch.arange(max_train_samples)
-        train_dataset = torch.utils.data.Subset(train_dataset, indices)
-
     # either, prepare the test set passed or use validation as 'final' test set
     if args.test_data is not None:
         test_texts, test_tags = read_atc_ner_data(args.test_data)
@@ -269,12 +241,103 @@ def main(args):
         test_encodings.pop("offset_mapping")  # we don't want to pass this to the model
         test_dataset = ATCDataset_for_ner(test_encodings, test_labels)
     else:
-        test_dataset, test_tags = val_dataset, val_labels
+        test_dataset = val_dataset
+
+    return train_dataset, val_dataset, test_dataset, tag2id
+
+
+def load_pretokenized_datasets(args):
+    """Select the utterances of the train/val/test files (e.g., k-fold CSVs) from
+    the pre-tokenized corpus (see pretokenize.py), the tag2id map is stored in it"""
+    prefix = args.pretokenized
+    tag2id = read_pretokenized_meta(prefix)["meta"]["tag2id"]
+    train_indices = select_indices(prefix, args.train_data)
+
+    # split the train data in case there is not val data available
+    if args.val_data == "" or args.val_data == None:
+        percentage = 0.1 if len(train_indices) < 100000 else 5000 / len(train_indices)
+        logger.info(f"*** taking {percentage*100}% of train data for dev set ***")
+        train_indices, val_indices = train_test_split(
+            train_indices, test_size=percentage
+        )
+    else:
+        val_indices = select_indices(prefix, args.val_data)
+
+    train_dataset = MemmapDataset(prefix, train_indices)
+    val_dataset = MemmapDataset(prefix, val_indices)
+    if args.test_data is not None:
+        test_dataset = MemmapDataset(prefix, select_indices(prefix, args.test_data))
+    else:
+        test_dataset = val_dataset
+    return train_dataset, val_dataset, test_dataset, tag2id
+
+
+def main(args):
+    """Main code execution"""
+
+    # Setup logging (following HuggingFace style)
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+
+    log_level = logging.INFO
+    logger.setLevel(log_level)
+    datasets.utils.logging.set_verbosity(log_level)
+    transformers.utils.logging.set_verbosity(log_level)
+    transformers.utils.logging.enable_default_handler()
+    transformers.utils.logging.enable_explicit_format()
+
+    # first, set all the seeds:
+    torch.manual_seed(args.seed)
+    torch.cuda.manual_seed(args.seed)
+    torch.cuda.manual_seed_all(args.seed)
+    random.seed(args.seed)
+    torch.backends.cudnn.benchmark = False
+    torch.backends.cudnn.deterministic = True
+    set_seed(args.seed)
+
+    # change "model name" to use another NLP system from Huggingface
+    model_name = (
+        args.input_model if args.input_model is not None else "bert-base-uncased"
+    )
+    output_directory = args.output_folder
+
+    logger.info("*** Loading the Tokenizer (FastTokenizer) ***")
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_name, use_fast=True, do_lower_case=True
+    )
+
+    # read train and validation data
+    logger.info("*** Loading and preparing training and validation data ***")
+    if args.pretokenized is not None:
+        logger.info(f"*** Using the pre-tokenized data: {args.pretokenized} ***")
+        train_dataset, val_dataset, test_dataset, tag2id = load_pretokenized_datasets(
+            args
+        )
+        data_collator = DynamicPaddingCollator(tokenizer)
+    else:
+        train_dataset, val_dataset, test_dataset, tag2id = tokenize_datasets(
+            args, tokenizer
+        )
+        data_collator = DataCollatorForTokenClassification(tokenizer)
+    id2tag = {id: tag for tag, id in tag2id.items()}
+
+    # reduce the data in the training set in case we want to use less samples
+    if args.max_train_samples is not None and args.max_train_samples != -1:
+        max_train_samples = min(len(train_dataset), args.max_train_samples)
+        logger.info(
+            f"*** Reducing the training dataset size to: {max_train_samples} ***"
+        )
+
+        indices = torch.arange(max_train_samples)
+        train_dataset = torch.utils.data.Subset(train_dataset, indices)
 
     # Fetch the model (Token Classification)
     logger.info("*** Loading the Token Classification model (NER model) ***")
     base_model = AutoModelForTokenClassification.from_pretrained(
-        model_name, num_labels=len(unique_tags)
+        model_name, num_labels=len(tag2id)
     )
 
     # Modify the configuration that contains the labels2ID mapping
@@ -335,12 +398,17 @@ def main(args):
         train_dataset=train_dataset,
         eval_dataset=val_dataset,
         compute_metrics=compute_metrics_training,
-        data_collator=DataCollatorForTokenClassification(tokenizer),
+        data_collator=data_collator,
     )
 
     # fine-tune the model
     logger.info("*** Training ***")
-    train_results = trainer.train()
+    last_checkpoint = None
+    if args.resume and os.path.isdir(output_directory):
+        last_checkpoint = get_last_checkpoint(output_directory)
+    if last_checkpoint is not None:
+        logger.info(f"*** Resuming the training from: {last_checkpoint} ***")
+    train_results = trainer.train(resume_from_checkpoint=last_checkpoint)
     metrics = train_results.metrics
 
     # saving the final model and tokenizer after fine-tuning it,
@@ -362,6 +430,11 @@ def main(args):
         log_folder=f"{output_directory}/classification_report",
     )
 
+    # seqeval metrics of the test set, in test_results.json (e.g., for k-fold runs)
+    test_metrics = compute_metrics_training((raw_pred, raw_labels))
+    trainer.log_metrics("test", test_metrics)
+    trainer.save_metrics("test", test_metrics)
+
     # Creating a model card to upload or to store training metadata,
     kwargs = {
         "finetuned_from": model_name,
@@ -50,6 +50,9 @@ test_data=experiments/data/other/$dataset/ner/5_kfold/test_fold1.csv
 # empty, pass it in CLI
 validation_data=''
 
+# prefix of the pre-tokenized corpus (see ner/pretokenize.py), empty: tokenize the files
+pretokenized=''
+
 # with this we can parse options from CLI
 . data/utils/parse_options.sh
 
@@ -78,7 +81,7 @@ $cmd python3 ner/train_ner.py \
   --eval-steps $eval_steps \
   --max-steps $max_steps \
   --input-model $input_model \
-  --val-data "$validation_data" \
+  --val-data "$validation_data" ${pretokenized:+--pretokenized $pretokenized} \
   --test-data $test_data \
   $train_data $output_folder
 
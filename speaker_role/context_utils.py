@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+# File with some utils for speaker role classification with dialogue context
+#   - each utterance is classified together with up to K previous turns of the
+#     same recording (ordered by the start time in the Kaldi segments file)
+#   - the BERT encoder only sees one turn at a time, the turns are combined on top
+#     of the pooled embeddings. Thus, each turn is encoded once (not K times) and
+#     its embedding is re-used (cached) as context of the next K turns
+
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import torch
+from sec_classification_utils import (
+    clean_input_utterance,
+    get_index_value,
+    load_data_from_text_file,
+    metrics_from_confusion,
+)
+from torch import nn
+from transformers import BertModel, BertPreTrainedModel
+from transformers.utils import ModelOutput
+
+
+@dataclass
+class ContextClassifierOutput(ModelOutput):
+    """Outputs of the context model: logits and pooled embeddings of the turns"""
+
+    loss: Optional[torch.FloatTensor] = None
+    logits: torch.FloatTensor = None
+    turn_embeddings: torch.FloatTensor = None
+
+
+class BertForContextSequenceClassification(BertPreTrainedModel):
+    """BERT sequence classification of one turn, attending to the pooled embeddings
+    of the (up to config.context_turns) previous turns of the same dialogue:
+        - context_index (turns x K) holds the position, in the batch, of the
+          previous turns of each turn (-1: no turn), the closest one first
+        - the current turn attends to its context (+ a turn distance embedding),
+          and the classifier sees [current turn; context vector]
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.num_labels = config.num_labels
+        self.context_turns = getattr(config, "context_turns", 3)
+        config.context_turns = self.context_turns
+        # only the logits are gathered by Trainer.predict
+        config.keys_to_ignore_at_inference = ["turn_embeddings"]
+
+        self.bert = BertModel(config, add_pooling_layer=True)
+        classifier_dropout = (
+            config.classifier_dropout
+            if config.classifier_dropout is not None
+            else config.hidden_dropout_prob
+        )
+        self.dropout = nn.Dropout(classifier_dropout)
+        self.distance_embeddings = nn.Embedding(self.context_turns, config.hidden_size)
+        self.context_query = nn.Linear(config.hidden_size, config.hidden_size)
+        self.context_classifier = nn.Linear(2 * config.hidden_size, config.num_labels)
+
+        # Initialize weights and apply final processing
+        self.post_init()
+
+    def encode(self, input_ids=None, attention_mask=None, token_type_ids=None):
+        """Pooled embedding of each turn (turns x hidden), without context"""
+        outputs = self.bert(
+            input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+        )
+        return outputs[1]
+
+    def classify(self, turn_embeddings, context_embeddings, context_mask):
+        """Logits of the turns (N x hidden) given the embeddings of their previous
+        turns (N x K x hidden) and the mask of the valid ones (N x K)"""
+        distance = self.distance_embeddings.weight[: context_embeddings.shape[1]]
+        keys = context_embeddings + distance
+        query = self.context_query(turn_embeddings)
+
+        scores = torch.einsum("nh,nkh->nk", query, keys) / keys.shape[-1] ** 0.5
+        scores = scores.masked_fill(~context_mask, torch.finfo(scores.dtype).min)
+        weights = torch.softmax(scores, dim=-1) * context_mask
+        context = torch.einsum("nk,nkh->nh", weights, context_embeddings)
+
+        features = torch.cat([turn_embeddings, context], dim=-1)
+        return self.context_classifier(self.dropout(features))
+
+    def forward(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        token_type_ids=None,
+        context_index=None,
+        labels=None,
+    ):
+        turn_embeddings = self.encode(input_ids, attention_mask, token_type_ids)
+        if context_index is None:
+            context_index = torch.full(
+                (len(turn_embeddings), 1), -1, device=turn_embeddings.device
+            )
+        context_mask = context_index >= 0
+        context_embeddings = turn_embeddings[context_index.clamp(min=0)]
+        logits = self.classify(turn_embeddings, context_embeddings, context_mask)
+
+        # the turns that are only context (label -100) do not contribute to the loss
+        loss = None
+        if labels is not None:
+            loss = nn.CrossEntropyLoss(ignore_index=-100)(logits, labels)
+
+        return ContextClassifierOutput(
+            loss=loss, logits=logits, turn_embeddings=turn_embeddings
+        )
+
+
+def read_segments(paths_to_segments):
+    """Kaldi segments files (<utt_id> <recording> <start> <end>), several files can
+    be given (space separated), e.g., one per corpus. Returns utt_id: (rec, start)
+    """
+    utt2segment = {}
+    for path in paths_to_segments.split():
+        with open(path, "r") as rd:
+            for line in rd:
+                fields = line.split()
+                utt2segment[fields[0]] = (fields[1], float(fields[2]))
+    return utt2segment
+
+
+def get_previous_turns(utt_ids, utt2segment, context_turns):
+    """Indices (in utt_ids) of the up to K previous turns of each utterance in
+    the same recording, the closest one first. Utterances missing from the segments
+    files are taken as single-turn dialogues"""
+    rec2turns = defaultdict(list)
+    for idx, utt_id in enumerate(utt_ids):
+        rec, start = utt2segment.get(utt_id, (utt_id, 0.0))
+        rec2turns[rec].append((start, idx))
+
+    context = [[] for _ in utt_ids]
+    for turns in rec2turns.values():
+        order = [idx for _, idx in sorted(turns)]
+        for position, idx in enumerate(order):
+            context[idx] = order[max(0, position - context_turns) : position][::-1]
+    return context
+
+
+def load_dialogue_data(path_to_data, utt2segment, context_turns):
+    """load_data_from_text_file (utt2spk_id) plus the utterance ids and the
+    previous turns of each utterance (see get_previous_turns)"""
+    data, spk_id, tags = load_data_from_text_file(path_to_data)
+    with open(path_to_data, "r") as rd:
+        utt_ids = [line.split(" ")[0] for line in rd]
+    context = get_previous_turns(utt_ids, utt2segment, context_turns)
+    return utt_ids, data, spk_id, context
+
+
+def get_dialogue_blocks(context, labels, block_size=16):
+    """Group the turns in training blocks: consecutive turns of one recording plus
+    their previous turns (context only, label -100), so a block is encoded in one
+    pass and each turn is encoded once per block. Returns, per block, the turn
+    indices, the labels and the context in local (block) indices"""
+    # next turn of each turn, to walk each recording in order
+    next_turn = {}
+    for idx, previous in enumerate(context):
+        if previous:
+            next_turn[previous[0]] = idx
+
+    blocks = []
+    for first in [idx for idx, previous in enumerate(context) if not previous]:
+        dialogue = [first]
+        while dialogue[-1] in next_turn:
+            dialogue.append(next_turn[dialogue[-1]])
+
+        for start in range(0, len(dialogue), block_size):
+            targets = dialogue[start : start + block_size]
+            history = context[targets[0]][::-1]
+            turns = history + targets
+            local = {idx: position for position, idx in enumerate(turns)}
+            blocks.append(
+                {
+                    "turns": turns,
+                    "labels": [-100] * len(history) + [labels[x] for x in targets],
+                    "context": [
+                        [local[x] for x in context[idx] if x in local] for idx in turns
+                    ],
+                }
+            )
+    return blocks
+
+
+class ATCO2Dataset_dialogue(torch.utils.data.Dataset):
+    """Dataset of dialogue blocks (see get_dialogue_blocks), the utterances are not
+    padded, see DialogueDataCollator"""
+
+    def __init__(self, encodings, blocks):
+        self.encodings = encodings
+        self.blocks = blocks
+
+    def __getitem__(self, idx):
+        block = self.blocks[idx]
+        item = {
+            key: [val[x] for x in block["turns"]] for key, val in self.encodings.items()
+        }
+        item["labels"] = block["labels"]
+        # named as the argument of forward(), so the Trainer does not remove it
+        # (remove_unused_columns), the collator converts it to batch positions
+        item["context_index"] = block["context"]
+        return item
+
+    def __len__(self):
+        return len(self.blocks)
+
+
+class DialogueDataCollator:
+    """Flatten the turns of the blocks of a batch, pad them to the longest one and
+    build the context_index (turns x K, -1 padded) in batch positions"""
+
+    def __init__(self, tokenizer, context_turns):
+        self.pad_token_id = tokenizer.pad_token_id
+        self.context_turns = context_turns
+
+    def __call__(self, features):
+        keys = [x for x in features[0] if x not in ["labels", "context_index"]]
+        num_turns = sum(len(x["labels"]) for x in features)
+        max_len = max(len(ids) for x in features for ids in x["input_ids"])
+
+        batch = {
+            key: torch.full(
+                (num_turns, max_len),
+                self.pad_token_id if key == "input_ids" else 0,
+                dtype=torch.long,
+            )
+            for key in keys
+        }
+        batch["labels"] = torch.tensor([y for x in features for y in x["labels"]])
+        batch["context_index"] = torch.full(
+            (num_turns, self.context_turns), -1, dtype=torch.long
+        )
+
+        row = 0
+        for feature in features:
+            for turn, previous in enumerate(feature["context_index"]):
+                for key in keys:
+                    values = feature[key][turn]
+                    batch[key][row + turn, : len(values)] = torch.tensor(values)
+                if previous:
+                    batch["context_index"][row + turn, : len(previous)] = (
+                        torch.tensor(previous) + row
+                    )
+            row += len(feature["labels"])
+        return batch
+
+
+def context_compute_metrics(compute_metrics):
+    """Wrap compute_metrics to skip the context-only turns (label -100)"""
+
+    def _compute_metrics(p):
+        pred, labels = p
+        mask = labels != -100
+        return compute_metrics([pred[mask], labels[mask]])
+
+    return _compute_metrics
+
+
+def predict_logits_with_context(
+    model_ojb, tokenizer, sequences, context, batch_size=32
+):
+    """Logits of the utterances, in the order of the input, with their previous
+    turns as context. Each turn is encoded once (batched, sorted by length), then
+    the context head runs on the cached pooled embeddings"""
+    device = model_ojb.device
+    num_turns = len(sequences)
+    embeddings = torch.zeros((num_turns, model_ojb.config.hidden_size), device=device)
+    logits = np.zeros((num_turns, model_ojb.config.num_labels), dtype=np.float32)
+    if num_turns == 0:
+        return logits
+
+    encodings = tokenizer(list(sequences), truncation=True)
+    order = np.argsort([len(x) for x in encodings["input_ids"]], kind="stable")
+    with torch.inference_mode():
+        for idx in range(0, num_turns, batch_size):
+            indices = order[idx : idx + batch_size]
+            batch = tokenizer.pad(
+                {key: [value[i] for i in indices] for key, value in encodings.items()},
+                return_tensors="pt",
+            )
+            batch = {key: value.to(device) for key, value in batch.items()}
+            embeddings[torch.from_numpy(indices).to(device)] = model_ojb.encode(**batch)
+
+        context_index = torch.full((num_turns, model_ojb.context_turns), -1)
+        for idx, previous in enumerate(context):
+            previous = previous[: model_ojb.context_turns]
+            context_index[idx, : len(previous)] = torch.tensor(
+                previous, dtype=torch.long
+            )
+        context_index = context_index.to(device)
+
+        for idx in range(0, num_turns, batch_size):
+            index = context_index[idx : idx + batch_size]
+            batch_logits = model_ojb.classify(
+                embeddings[idx : idx + batch_size],
+                embeddings[index.clamp(min=0)],
+                index >= 0,
+            )
+            logits[idx : idx + batch_size] = batch_logits.float().cpu().numpy()
+    return logits
+
+
+def eval_dialogue_dataset(
+    model_ojb, tokenizer, path_eval_data, utt2segment, batch_size=32
+):
+    """Same as eval_dataset (sec_classification_utils.py), for the context model.
+    The whole test set is needed to rebuild the dialogues"""
+    _, eval_data, eval_spk_id, context = load_dialogue_data(
+        path_eval_data, utt2segment, model_ojb.context_turns
+    )
+    logits = predict_logits_with_context(
+        model_ojb, tokenizer, eval_data, context, batch_size=batch_size
+    )
+    indices, scores = get_index_value(logits)
+
+    num_labels = model_ojb.config.num_labels
+    confusion = np.zeros((num_labels, num_labels), dtype=np.int64)
+    np.add.at(confusion, (np.array(eval_spk_id, dtype=np.int64), indices), 1)
+    return metrics_from_confusion(confusion), (indices, scores)
+
+
+class DialogueContextCache:
+    """Online (turn by turn) classification with a context model: the pooled
+    embeddings of the last K turns of each recording are cached, so a new turn
+    costs one encoder pass regardless of K"""
+
+    def __init__(self, model_ojb, tokenizer):
+        self.model = model_ojb
+        self.tokenizer = tokenizer
+        self.history = defaultdict(lambda: deque(maxlen=model_ojb.context_turns))
+
+    def __call__(self, recordings, utterances):
+        """Classify a batch of new turns (one per recording), returns the logits"""
+        batch = self.tokenizer(
+            [clean_input_utterance(x) for x in utterances],
+            padding=True,
+            truncation=True,
+            return_tensors="pt",
+        ).to(self.model.device)
+
+        with torch.inference_mode():
+            embeddings = self.model.encode(**batch)
+            hidden_size = embeddings.shape[-1]
+            context = torch.zeros(
+                (len(recordings), self.model.context_turns, hidden_size),
+                device=embeddings.device,
+            )
+            mask = torch.zeros(
+                (len(recordings), self.model.context_turns),
+                dtype=torch.bool,
+                device=embeddings.device,
+            )
+            for row, rec in enumerate(recordings):
+                # closest turn first, as in get_previous_turns
+                for position, previous in enumerate(reversed(self.history[rec])):
+                    context[row, position] = previous
+                    mask[row, position] = True
+            logits = self.model.classify(embeddings, context, mask)
+
+        for rec, embedding in zip(recordings, embeddings):
+            self.history[rec].append(embedding)
+        return logits.float().cpu().numpy()
+
+    def reset(self, recording=None):
+        """Forget the history of one recording (or of all of them)"""
+        if recording is None:
+            self.history.clear()
+        else:
+            self.history.pop(recording, None)
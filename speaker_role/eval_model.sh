@@ -23,6 +23,7 @@ test_names="atco2_test_set_1h uwb_atcc"
 
 # model related vars
 batch_size=16
+cache_dir=experiments/cache/eval
 
 # vars of the model and input/output folder
 input_model=bert-base-uncased
@@ -46,6 +47,7 @@ fi
 # running the command
 $cmd python3 speaker_role/eval_sec_classification.py \
   --batch-size $batch_size \
+  ${cache_dir:+--cache-dir $cache_dir} \
   --input-model "$output_folder" \
   --input-files "$input_files" \
   --test-names "$test_names" \
@@ -21,16 +21,31 @@ HuggingFace repository: https://huggingface.co/bert-base-uncased
 
 import argparse
 import os
+import sys
 
 import torch
-from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
-
+from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer
+
+from context_utils import (
+    BertForContextSequenceClassification,
+    eval_dialogue_dataset,
+    get_previous_turns,
+    predict_logits_with_context,
+    read_segments,
+)
 from sec_classification_utils import (
+    classify_sequences,
     clean_input_utterance,
     eval_dataset,
+    eval_encodings,
     get_index_value,
+    import_from_ner,
+    predict_logits_from_encodings,
 )
 
+cached_test_set = import_from_ner("cache_utils", "cached_test_set")
+OnnxModel = import_from_ner("onnx_utils", "OnnxModel")
+
 def parse_args():
     parser = argparse.ArgumentParser()
 
@@ -49,6 +64,28 @@ def parse_args():
         help="Batch size you want to use for decoding",
     )
 
+    parser.add_argument(
+        "--onnx-model",
+        default=None,
+        help="Run the model with ONNX Runtime on CPU, path to the model.onnx (or "
+        "model.int8.onnx) written by ner/export_onnx.py",
+    )
+
+    parser.add_argument(
+        "--segments",
+        default=None,
+        help="Kaldi segments file(s) of the test sets (space separated), needed by "
+        "the models trained with --context-turns (dialogue context)",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Folder to cache the cleaned and tokenized test sets, keyed by the "
+        "content of the file and the tokenizer. Checkpoints with the same tokenizer "
+        "re-use them, thus, only the forward passes are run (not with --segments)",
+    )
+
     parser.add_argument(
         "-m",
         "--input-model",
@@ -78,17 +115,6 @@ def parse_args():
     return parser.parse_args()
 
 
-def batch(input_list, batch=1):
-    """Iterator to go efficiently across the list of utterances to perform
-    inference.
-    input_list: input list with utterances
-    batch: batch size
-    """
-    l = len(input_list)
-    for ndx in range(0, l, batch):
-        yield input_list[ndx : min(ndx + batch, l)]
-
-
 def main():
     """Main code execution"""
     args = parse_args()
@@ -110,9 +136,24 @@ def main():
 
     print("\nLoading the sequence classification recognition model (speaker ID)\n")
     # Fetch the Model and tokenizer
-    eval_model = AutoModelForSequenceClassification.from_pretrained(
-        sec_classification_model
-    )
+    config = AutoConfig.from_pretrained(sec_classification_model)
+    use_context = getattr(config, "context_turns", 0) > 0
+    if use_context and (args.onnx_model is not None or args.segments is None):
+        sys.exit("the dialogue context models need --segments and can not use ONNX")
+
+    if args.onnx_model is not None:
+        eval_model = OnnxModel(args.onnx_model)
+    elif use_context:
+        utt2segment = read_segments(args.segments)
+        eval_model = BertForContextSequenceClassification.from_pretrained(
+            sec_classification_model
+        )
+        eval_model.to("cuda" if torch.cuda.is_available() else "cpu").eval()
+    else:
+        eval_model = AutoModelForSequenceClassification.from_pretrained(
+            sec_classification_model
+        )
+        eval_model.to("cuda" if torch.cuda.is_available() else "cpu").eval()
     tokenizer = AutoTokenizer.from_pretrained(
         sec_classification_model, use_fast=True, do_lower_case=True
     )
@@ -121,14 +162,6 @@ def main():
     tag2id = eval_model.config.label2id
     id2tag = eval_model.config.id2label
 
-    # Pipeline for sequence classification
-    seq_cla = pipeline(
-        "text-classification",
-        model=eval_model,
-        tokenizer=tokenizer,
-        device=0 if torch.cuda.is_available() else -1,
-    )
-
     # main loop,
     for path_to_file, dataset_name in zip(path_to_files, test_set_names):
 
@@ -138,25 +171,62 @@ def main():
         # where to store the input data
         sequences = []
         utt_id = []
+        use_cache = args.cache_dir is not None and not use_context
+
+        if use_cache:
+            # all the utterances (and labels) of utt2spk_id files are evaluated,
+            # only the non-empty ones are printed
+            def _build_test_set(path_to_file=path_to_file):
+                is_utt2spk_id = "utt2spk_id" in path_to_file
+                ids, texts, labels = [], [], []
+                with open(path_to_file, "r") as rd:
+                    for line in rd:
+                        fields = line.split(" ")
+                        sample = clean_input_utterance(
+                            " ".join(fields[3 if is_utt2spk_id else 1 :]).rstrip()
+                        )
+                        if not is_utt2spk_id and sample.strip() == "":
+                            continue
+                        ids.append(fields[0].rstrip())
+                        texts.append(sample)
+                        if is_utt2spk_id:
+                            labels.append(int(fields[1]))
+
+                encodings = tokenizer(texts, truncation=True)
+                labels = labels if is_utt2spk_id else None
+                return ids, encodings, labels, {"texts": texts}
+
+            cached_encodings, eval_labels, info = cached_test_set(
+                args.cache_dir,
+                path_to_file,
+                tokenizer,
+                "speaker_role",
+                _build_test_set,
+                extra="utt2spk_id" in path_to_file,
+            )
+            for ids, sample in zip(info["utt_ids"], info["meta"]["texts"]):
+                if sample.strip() != "":
+                    sequences.append(sample)
+                    utt_id.append(ids)
+        else:
+            # loading the data into memory
+            with open(path_to_file, "r") as rd:
+                column_id = 3 if "utt2spk_id" in path_to_file else 1
+                for line in rd:
+                    ids = line.split(" ")[0].rstrip()
 
-        # loading the data into memory
-        with open(path_to_file, "r") as rd:
-            column_id = 3 if "utt2spk_id" in path_to_file else 1
-            for line in rd:
-                ids = line.split(" ")[0].rstrip()
-
-                # clean the input utterance
-                sample = clean_input_utterance(
-                    " ".join(line.split(" ")[column_id:]).rstrip()
-                )
+                    # clean the input utterance
+                    sample = clean_input_utterance(
+                        " ".join(line.split(" ")[column_id:]).rstrip()
+                    )
 
-                # continue if sample is empty
-                if sample == "" or sample == " ":
-                    continue
+                    # continue if sample is empty
+                    if sample == "" or sample == " ":
+                        continue
 
-                # append the output
-                sequences.append(sample)
-                utt_id.append(line.split(" ")[0])
+                    # append the output
+                    sequences.append(sample)
+                    utt_id.append(line.split(" ")[0])
 
         print("Loaded dataset into memory (text or utt2spk_id)")
 
@@ -170,7 +240,26 @@ def main():
         # there are two options, either we evaluate or we do inference
         if "utt2spk_id" in path_to_file:
             #  we perform inference and evaluate
-            perf_metrics, scores = eval_dataset(eval_model, tokenizer, path_to_file)
+            if use_context:
+                perf_metrics, (indices, scores) = eval_dialogue_dataset(
+                    eval_model,
+                    tokenizer,
+                    path_to_file,
+                    utt2segment,
+                    batch_size=args.batch_size,
+                )
+            elif use_cache:
+                perf_metrics, (indices, scores) = eval_encodings(
+                    eval_model,
+                    tokenizer,
+                    cached_encodings,
+                    eval_labels,
+                    batch_size=args.batch_size,
+                )
+            else:
+                perf_metrics, (indices, scores) = eval_dataset(
+                    eval_model, tokenizer, path_to_file, batch_size=args.batch_size
+                )
 
             metrics_file = open(f"{output_folder}/{dataset_name}_metrics", "w")
             metrics_file.write(f"\nEvaluation of model:{sec_classification_model}\n")
@@ -178,18 +267,51 @@ def main():
             metrics_file.write(f"{perf_metrics['report']}")
             metrics_file.close()
 
-            # get the indices and value confides
-            indices, scores = get_index_value(scores)
+            # label index and confidence of each utterance
             inference_out = [
                 {"label": idx, "score": score} for idx, score in zip(indices, scores)
             ]
 
         # you passed a 'text' file, only inference
         else:
-            if args.print_metrics:
-                for x in batch(sequences, args.batch_size):
-                    inference = seq_cla(x, batch_size=args.batch_size)
-                    inference_out += inference
+            if args.print_metrics and use_context:
+                context = get_previous_turns(
+                    utt_id, utt2segment, eval_model.context_turns
+                )
+                indices, scores = get_index_value(
+                    predict_logits_with_context(
+                        eval_model,
+                        tokenizer,
+                        sequences,
+                        context,
+                        batch_size=args.batch_size,
+                    )
+                )
+                inference_out = [
+                    {"label": id2tag[idx], "score": score}
+                    for idx, score in zip(indices, scores)
+                ]
+            elif args.print_metrics and use_cache:
+                indices, scores = get_index_value(
+                    predict_logits_from_encodings(
+                        eval_model,
+                        tokenizer,
+                        cached_encodings,
+                        batch_size=args.batch_size,
+                    )
+                )
+                inference_out = [
+                    {"label": id2tag[idx], "score": score}
+                    for idx, score in zip(indices, scores)
+                ]
+            elif args.print_metrics:
+                labels, scores = classify_sequences(
+                    eval_model, tokenizer, sequences, batch_size=args.batch_size
+                )
+                inference_out = [
+                    {"label": label, "score": score}
+                    for label, score in zip(labels, scores)
+                ]
             else:
                 print(
                     "you paseed and only 'text' file and did not set --print-metrics flag... exit"
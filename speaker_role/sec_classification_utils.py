@@ -10,6 +10,10 @@
 # File with some utils for the train/eval Sequence Classification scripts
 #   - Speaker ID from ASR/ground truth transcripts (NLP-based)
 
+import importlib
+import os
+import sys
+
 import numpy as np
 import torch
 from sklearn.metrics import (
@@ -19,7 +23,24 @@ from sklearn.metrics import (
     precision_score,
     recall_score,
 )
-from transformers import DataCollatorWithPadding, Trainer
+
+NER_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../ner")
+
+
+def import_from_ner(module_name, *names):
+    """Import a module of the NER recipe (ner/), shared with the speaker role
+    scripts, e.g., the text cleaning, the ONNX Runtime backend or the pre-tokenized
+    datasets. Returns the module, or the given attribute(s) of it"""
+    if NER_FOLDER not in sys.path:
+        sys.path.append(NER_FOLDER)
+    module = importlib.import_module(module_name)
+    if not names:
+        return module
+    attributes = tuple(getattr(module, name) for name in names)
+    return attributes[0] if len(names) == 1 else attributes
+
+
+clean_utterance = import_from_ner("text_cleaning", "clean_utterance")
 
 
 class ATCO2Dataset_seqcla(torch.utils.data.Dataset):
@@ -43,21 +64,13 @@ class ATCO2Dataset_seqcla(torch.utils.data.Dataset):
 
 
 def clean_input_utterance(input_text):
-    """Function to clean the input utterance
+    """Function to clean the input utterance (see ner/text_cleaning.py)
     Inputs:
         - input text
     Output:
-        - cleaned text
+        - cleaned and lower-cased text
     """
-    # remove all the words starting with <> or [],
-    sequence = " ".join(filter(lambda x: x[0] != "<", input_text.strip().split()))
-    sequence = " ".join(filter(lambda x: x[-1] != ">", sequence.split()))
-    sequence = " ".join(filter(lambda x: x[0] != "[", sequence.split()))
-    sequence = " ".join(filter(lambda x: x[-1] != "]", sequence.split()))
-
-    # remove the greetings in ATCO2 format dobry_den_(greet)
-    sequence = " ".join(filter(lambda x: "(" not in x, sequence.split()))
-    return sequence.lower()
+    return clean_utterance(input_text, lower=True)
 
 
 def load_data_from_text_file(path_to_data):
@@ -103,30 +116,188 @@ def compute_metrics(p):
     }
 
 
-def eval_dataset(model_ojb, tokenizer, path_eval_data):
-    """Function to eval a given dataset.
+def get_index_value(scores):
+    """Label index and confidence (softmax probability) of each utterance,
+    from the logits of the model (samples x labels)
+    """
+    probs = np.exp(scores - scores.max(axis=1, keepdims=True))
+    probs /= probs.sum(axis=1, keepdims=True)
+    indices = probs.argmax(axis=1)
+    return indices, probs[np.arange(len(indices)), indices]
+
+
+def predict_logits(model_ojb, tokenizer, sequences, batch_size=32):
+    """Batched forward passes over a list of utterances, returns the logits in the
+    order of the input. The utterances are tokenized in bulk and sorted by length,
+    so each batch is padded to a similar length.
+    Works with the PyTorch models and with the ONNX Runtime wrapper (OnnxModel)
+    """
+    if len(sequences) == 0:
+        return np.zeros((0, model_ojb.config.num_labels), dtype=np.float32)
+    encodings = tokenizer(list(sequences), truncation=True)
+    return predict_logits_from_encodings(
+        model_ojb, tokenizer, encodings, batch_size=batch_size
+    )
+
+
+def predict_logits_from_encodings(model_ojb, tokenizer, encodings, batch_size=32):
+    """Same as predict_logits, but from already tokenized utterances (no padding),
+    e.g., a cached test set (lists or memory-mapped arrays, see ner/cache_utils.py)
+    """
+    device = getattr(model_ojb, "device", "cpu")
+    lengths = [len(x) for x in encodings["input_ids"]]
+    logits = np.zeros((len(lengths), model_ojb.config.num_labels), dtype=np.float32)
+
+    order = np.argsort(lengths, kind="stable")
+    for idx in range(0, len(order), batch_size):
+        indices = order[idx : idx + batch_size]
+        batch = tokenizer.pad(
+            {
+                key: [np.asarray(value[i]).tolist() for i in indices]
+                for key, value in encodings.items()
+            },
+            return_tensors="pt",
+        )
+        batch = {key: value.to(device) for key, value in batch.items()}
+        with torch.inference_mode():
+            logits[indices] = model_ojb(**batch).logits.float().cpu().numpy()
+    return logits
+
+
+def classify_sequences(model_ojb, tokenizer, sequences, batch_size=32):
+    """Label (model.config.id2label) and confidence of each utterance, in the
+    order of the input. Replaces the text-classification pipeline
+    """
+    indices, scores = get_index_value(
+        predict_logits(model_ojb, tokenizer, sequences, batch_size=batch_size)
+    )
+    id2label = model_ojb.config.id2label
+    return [id2label[idx] for idx in indices], scores
+
+
+def iter_data_from_text_file(path_to_data, chunk_size=1000):
+    """Same as load_data_from_text_file, but yields chunks of (data, spk_id), so
+    the test set is never fully loaded in memory
+    """
+    data, spk_id = [], []
+    with open(path_to_data, "r") as utt2spk_id:
+        for line in utt2spk_id:
+            sample = clean_input_utterance(" ".join(line.split(" ")[3:]).rstrip())
+            data.append(sample.lower())
+            spk_id.append(int(line.split(" ")[1]))
+            if len(data) == chunk_size:
+                yield data, spk_id
+                data, spk_id = [], []
+    if data:
+        yield data, spk_id
+
+
+def metrics_from_confusion(confusion, target_names=None, digits=2):
+    """Metrics of compute_metrics (accuracy, binary precision/recall/F1 of label 1
+    and a classification report), from a confusion matrix (true x predicted)
+    """
+    confusion = np.asarray(confusion, dtype=np.float64)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    true_pos = np.diag(confusion)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.nan_to_num(true_pos / predicted)
+        recall = np.nan_to_num(true_pos / support)
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+    total = support.sum()
+    accuracy = true_pos.sum() / total if total else 0.0
+
+    # same layout as sklearn.metrics.classification_report
+    names = [str(x) for x in (target_names or range(len(confusion)))]
+    width = max(len(x) for x in names + ["weighted avg"])
+    header = ["precision", "recall", "f1-score", "support"]
+    row = "{:>{width}s} " + " {:>9.{digits}f}" * 3 + " {:>9}\n"
+    report = "{:>{width}s} ".format("", width=width) + " {:>9}" * 4
+    report = report.format(*header, width=width) + "\n\n"
+    for name, values in zip(names, zip(precision, recall, f1, support)):
+        report += row.format(
+            name, *values[:3], int(values[3]), width=width, digits=digits
+        )
+    report += "\n"
+    report += ("{:>{width}s} " + " {:>9}" * 2 + " {:>9.{digits}f} {:>9}\n").format(
+        "accuracy", "", "", accuracy, int(total), width=width, digits=digits
+    )
+    weights = support / total if total else support
+    for name, avg in [
+        ("macro avg", lambda x: x.mean()),
+        ("weighted avg", lambda x: (x * weights).sum()),
+    ]:
+        report += row.format(
+            name,
+            avg(precision),
+            avg(recall),
+            avg(f1),
+            int(total),
+            width=width,
+            digits=digits,
+        )
+
+    return {
+        "accuracy": accuracy,
+        "precision": precision[1],
+        "recall": recall[1],
+        "f1": f1[1],
+        "report": report,
+        "confusion_matrix": confusion.astype(np.int64),
+    }
+
+
+def eval_dataset(model_ojb, tokenizer, path_eval_data, batch_size=32, chunk_size=1000):
+    """Function to eval a given dataset, incrementally: the utterances are read and
+    classified in chunks, only a confusion matrix and the top label/score of each
+    utterance are kept, thus the memory footprint does not grow with the logits.
     Inputs:
-        - model, object of the model
+        - model, object of the model (PyTorch or OnnxModel)
         - path to eval dataset
+    Outputs:
+        - metrics (see metrics_from_confusion)
+        - label index and confidence of each utterance
     """
-    # Load test data
-    eval_data, eval_spk_id, eval_tags = load_data_from_text_file(path_eval_data)
-    X_test_tokenized = tokenizer(eval_data, padding="max_length", truncation=True)
+    chunks = (
+        (predict_logits(model_ojb, tokenizer, data, batch_size=batch_size), spk_id)
+        for data, spk_id in iter_data_from_text_file(path_eval_data, chunk_size)
+    )
+    return eval_chunks(model_ojb.config.num_labels, chunks)
+
+
+def eval_encodings(
+    model_ojb, tokenizer, encodings, labels, batch_size=32, chunk_size=1000
+):
+    """Same as eval_dataset, but from already tokenized utterances and their labels,
+    e.g., a cached test set (see ner/cache_utils.py)
+    """
+
+    def _chunks():
+        for idx in range(0, len(labels), chunk_size):
+            chunk = {
+                key: value[idx : idx + chunk_size] for key, value in encodings.items()
+            }
+            logits = predict_logits_from_encodings(
+                model_ojb, tokenizer, chunk, batch_size=batch_size
+            )
+            yield logits, labels[idx : idx + chunk_size]
 
-    # Create torch dataset
-    test_dataset = ATCO2Dataset_seqcla(X_test_tokenized)
+    return eval_chunks(model_ojb.config.num_labels, _chunks())
 
-    # data collator
-    data_collator = DataCollatorWithPadding(tokenizer, pad_to_multiple_of=8)
 
-    # Define test trainer
-    test_trainer = Trainer(model_ojb, data_collator=data_collator)
+def eval_chunks(num_labels, chunks):
+    """Confusion matrix, metrics and top label/score of each utterance, from an
+    iterator of (logits, labels) chunks"""
+    confusion = np.zeros((num_labels, num_labels), dtype=np.int64)
+    indices, scores = [], []
 
-    # Make prediction
-    raw_pred, _, _ = test_trainer.predict(test_dataset)
-    # Preprocess the labels
-    y_lbl = np.array(eval_spk_id)
-    # Obtain the results:
-    results = compute_metrics([raw_pred, y_lbl])
+    for logits, spk_id in chunks:
+        chunk_indices, chunk_scores = get_index_value(logits)
+        np.add.at(confusion, (np.asarray(spk_id), chunk_indices), 1)
+        indices.append(chunk_indices.astype(np.int8))
+        scores.append(chunk_scores.astype(np.float32))
 
-    return results, raw_pred
+    results = metrics_from_confusion(confusion)
+    if not indices:
+        return results, (np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.float32))
+    return results, (np.concatenate(indices), np.concatenate(scores))
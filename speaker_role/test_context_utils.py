@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-FileCopyrightText: Copyright © <2022> Idiap Research Institute <contact@idiap.ch>
+#
+# SPDX-FileContributor: Juan Zuluaga-Gomez <jzuluaga@idiap.ch>
+#
+# SPDX-License-Identifier: MIT-License
+
+# Tests of the dialogue context training data (context_utils.py), run with:
+# python3 -m pytest speaker_role/test_context_utils.py
+
+import inspect
+
+import torch
+from context_utils import (
+    ATCO2Dataset_dialogue,
+    BertForContextSequenceClassification,
+    DialogueDataCollator,
+    get_dialogue_blocks,
+    get_previous_turns,
+)
+from transformers import BertConfig, BertTokenizerFast
+from transformers.trainer_utils import RemoveColumnsCollator
+
+WORDS = ["lufthansa", "one", "two", "three", "contact", "radar", "roger", "bye"]
+
+
+def make_tokenizer(tmp_path):
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS
+    (tmp_path / "vocab.txt").write_text("\n".join(vocab) + "\n")
+    return BertTokenizerFast(vocab_file=str(tmp_path / "vocab.txt"))
+
+
+def test_dialogue_block_through_trainer_collator(tmp_path):
+    tokenizer = make_tokenizer(tmp_path)
+    context_turns = 2
+    config = BertConfig(
+        vocab_size=tokenizer.vocab_size,
+        hidden_size=16,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=32,
+        num_labels=2,
+    )
+    config.context_turns = context_turns
+    model = BertForContextSequenceClassification(config).eval()
+
+    # two recordings of 3 and 2 turns, the blocks hold 2 target turns
+    utt_ids = ["a1", "a2", "a3", "b1", "b2"]
+    utt2segment = {
+        "a1": ("a", 0.0),
+        "a2": ("a", 1.0),
+        "a3": ("a", 2.0),
+        "b1": ("b", 0.0),
+        "b2": ("b", 1.0),
+    }
+    texts = ["lufthansa one", "contact radar", "roger", "two three", "bye"]
+    labels = [0, 1, 0, 1, 0]
+    context = get_previous_turns(utt_ids, utt2segment, context_turns)
+    blocks = get_dialogue_blocks(context, labels, block_size=2)
+    dataset = ATCO2Dataset_dialogue(tokenizer(texts, truncation=True), blocks)
+
+    # same wrapper as Trainer with remove_unused_columns=True (the default)
+    signature_columns = list(inspect.signature(model.forward).parameters)
+    collator = RemoveColumnsCollator(
+        DialogueDataCollator(tokenizer, context_turns),
+        signature_columns + ["label", "label_ids"],
+    )
+    batch = collator([dataset[idx] for idx in range(len(dataset))])
+
+    num_turns = sum(len(block["turns"]) for block in blocks)
+    assert batch["context_index"].shape == (num_turns, context_turns)
+    assert (batch["labels"] != -100).sum() == len(labels)
+
+    # first block: a1, a2 (no context before), a2 sees a1
+    assert batch["context_index"][1].tolist() == [0, -1]
+
+    with torch.no_grad():
+        outputs = model(**batch)
+    assert outputs.logits.shape == (num_turns, 2)
+    assert outputs.loss is not None
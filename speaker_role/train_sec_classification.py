@@ -32,6 +32,7 @@ from sklearn.model_selection import train_test_split
 
 # importing all utils functions for ATC datasets
 from transformers import (
+    AutoConfig,
     AutoModelForSequenceClassification,
     AutoTokenizer,
     DataCollatorWithPadding,
@@ -39,12 +40,26 @@ from transformers import (
     TrainingArguments,
 )
 
+from context_utils import (
+    ATCO2Dataset_dialogue,
+    BertForContextSequenceClassification,
+    DialogueDataCollator,
+    context_compute_metrics,
+    get_dialogue_blocks,
+    load_dialogue_data,
+    read_segments,
+)
 from sec_classification_utils import (
     ATCO2Dataset_seqcla,
     compute_metrics,
+    import_from_ner,
     load_data_from_text_file,
 )
 
+DynamicPaddingCollator, MemmapDataset, select_indices = import_from_ner(
+    "memmap_utils", "DynamicPaddingCollator", "MemmapDataset", "select_indices"
+)
+
 logger = logging.getLogger(__name__)
 
 # Define the tags of the model (in this case is only atco/pilot)
@@ -125,6 +140,31 @@ def parse_args():
         default=None,
         help="Path to a previously trained model, to fine tune it",
     )
+    parser.add_argument(
+        "--pretokenized",
+        default=None,
+        help="Prefix of the pre-tokenized corpus (see ner/pretokenize.py), the "
+        "utterances of the train/val/test files are selected from it by id",
+    )
+    parser.add_argument(
+        "--context-turns",
+        type=int,
+        default=0,
+        help="Classify each utterance with up to K previous turns of the same "
+        "recording (dialogue context), 0 means no context. It needs --segments",
+    )
+    parser.add_argument(
+        "--segments",
+        default=None,
+        help="Kaldi segments file(s) of the train/val/test data (space separated), "
+        "used to order the turns of each recording",
+    )
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=16,
+        help="Consecutive turns of one recording per training sample (with context)",
+    )
     parser.add_argument(
         "--val-data",
         default=None,
@@ -144,7 +184,105 @@ def parse_args():
         "output_folder",
         help="name of the output folder to store the sequence classification model and tokenizer",
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.context_turns > 0 and args.segments is None:
+        parser.error("--context-turns needs the --segments file(s)")
+    if args.context_turns > 0 and args.pretokenized is not None:
+        parser.error("--context-turns can not be used with --pretokenized")
+    return args
+
+
+def tokenize_datasets(args, tokenizer):
+    """Read the train/val/test files (utt2spk_id) and tokenize them"""
+    # read train and validation data
+    # split the train data in case there is not val data available
+    if args.val_data == "" or args.val_data == None:
+        train_data, train_spk_id, train_tags = load_data_from_text_file(args.train_data)
+        (
+            train_data,
+            val_data,
+            train_spk_id,
+            val_spk_id,
+            train_tags,
+            val_tags,
+        ) = train_test_split(train_data, train_spk_id, train_tags, test_size=0.1)
+    else:
+        train_data, train_spk_id, train_tags = load_data_from_text_file(args.train_data)
+        val_data, val_spk_id, val_tags = load_data_from_text_file(args.val_data)
+
+    # Tokenize the train and validation data
+    X_train_tokenized = tokenizer(train_data, padding="max_length", truncation=True)
+    X_val_tokenized = tokenizer(val_data, padding="max_length", truncation=True)
+
+    # Create the Dataset object
+    train_dataset = ATCO2Dataset_seqcla(X_train_tokenized, train_spk_id)
+    val_dataset = ATCO2Dataset_seqcla(X_val_tokenized, val_spk_id)
+
+    # either, prepare the test set passed or use validation as 'final' test set
+    if args.test_data is not None:
+        test_data, test_spk_id, test_tags = load_data_from_text_file(args.test_data)
+        X_test_tokenized = tokenizer(test_data, padding="max_length", truncation=True)
+        test_dataset = ATCO2Dataset_seqcla(X_test_tokenized, test_spk_id)
+    else:
+        test_dataset, test_spk_id = val_dataset, val_spk_id
+
+    return train_dataset, val_dataset, test_dataset, test_spk_id
+
+
+def tokenize_dialogue_datasets(args, tokenizer):
+    """Read the train/val/test files (utt2spk_id) with the previous turns of each
+    utterance, tokenize them (without padding) and group them in dialogue blocks"""
+    utt2segment = read_segments(args.segments)
+
+    def _dialogue_dataset(path_to_data):
+        _, data, spk_id, context = load_dialogue_data(
+            path_to_data, utt2segment, args.context_turns
+        )
+        encodings = tokenizer(data, truncation=True)
+        blocks = get_dialogue_blocks(context, spk_id, block_size=args.block_size)
+        return encodings, blocks
+
+    # split the train blocks (whole dialogues) in case there is not val data
+    train_encodings, train_blocks = _dialogue_dataset(args.train_data)
+    if args.val_data == "" or args.val_data == None:
+        train_blocks, val_blocks = train_test_split(train_blocks, test_size=0.1)
+        val_encodings = train_encodings
+    else:
+        val_encodings, val_blocks = _dialogue_dataset(args.val_data)
+
+    train_dataset = ATCO2Dataset_dialogue(train_encodings, train_blocks)
+    val_dataset = ATCO2Dataset_dialogue(val_encodings, val_blocks)
+    if args.test_data is not None:
+        test_dataset = ATCO2Dataset_dialogue(*_dialogue_dataset(args.test_data))
+    else:
+        test_dataset = val_dataset
+
+    # labels of all the turns of the test blocks (-100: only context)
+    test_spk_id = [y for block in test_dataset.blocks for y in block["labels"]]
+    return train_dataset, val_dataset, test_dataset, test_spk_id
+
+
+def load_pretokenized_datasets(args):
+    """Select the utterances of the train/val/test files from the pre-tokenized
+    corpus (see ner/pretokenize.py --task speaker-role)"""
+    prefix = args.pretokenized
+    train_indices = select_indices(prefix, args.train_data, sep=" ")
+
+    # split the train data in case there is not val data available
+    if args.val_data == "" or args.val_data == None:
+        train_indices, val_indices = train_test_split(train_indices, test_size=0.1)
+    else:
+        val_indices = select_indices(prefix, args.val_data, sep=" ")
+
+    train_dataset = MemmapDataset(prefix, train_indices)
+    val_dataset = MemmapDataset(prefix, val_indices)
+    if args.test_data is not None:
+        test_indices = select_indices(prefix, args.test_data, sep=" ")
+        test_dataset = MemmapDataset(prefix, test_indices)
+    else:
+        test_dataset = val_dataset
+    test_spk_id = [int(test_dataset[i]["labels"]) for i in range(len(test_dataset))]
+    return train_dataset, val_dataset, test_dataset, test_spk_id
 
 
 def main():
@@ -190,37 +328,42 @@ def main():
     
     # Fetch the Sequence Classification model
     logger.info("*** Loading the Sequence Classification model ***")
-    base_model = AutoModelForSequenceClassification.from_pretrained(
-        model_name, num_labels=num_labels
-    )
+    if args.context_turns > 0:
+        logger.info(f"*** Using {args.context_turns} previous turns as context ***")
+        config = AutoConfig.from_pretrained(model_name, num_labels=num_labels)
+        config.context_turns = args.context_turns
+        base_model = BertForContextSequenceClassification.from_pretrained(
+            model_name, config=config
+        )
+    else:
+        base_model = AutoModelForSequenceClassification.from_pretrained(
+            model_name, num_labels=num_labels
+        )
 
     # Modify the configuration that contains the labels2ID mapping
     base_model.config.label2id = tag2id
     base_model.config.id2label = id2tag
 
-    # read train and validation data
-    # split the train data in case there is not val data available
-    if args.val_data == "" or args.val_data == None:
-        train_data, train_spk_id, train_tags = load_data_from_text_file(args.train_data)
+    # read train, validation and test data
+    if args.context_turns > 0:
         (
-            train_data,
-            val_data,
-            train_spk_id,
-            val_spk_id,
-            train_tags,
-            val_tags,
-        ) = train_test_split(train_data, train_spk_id, train_tags, test_size=0.1)
+            train_dataset,
+            val_dataset,
+            test_dataset,
+            test_spk_id,
+        ) = tokenize_dialogue_datasets(args, tokenizer)
+    elif args.pretokenized is not None:
+        logger.info(f"*** Using the pre-tokenized data: {args.pretokenized} ***")
+        (
+            train_dataset,
+            val_dataset,
+            test_dataset,
+            test_spk_id,
+        ) = load_pretokenized_datasets(args)
     else:
-        train_data, train_spk_id, train_tags = load_data_from_text_file(args.train_data)
-        val_data, val_spk_id, val_tags = load_data_from_text_file(args.val_data)
-
-    # Tokenize the train and validation data
-    X_train_tokenized = tokenizer(train_data, padding="max_length", truncation=True)
-    X_val_tokenized = tokenizer(val_data, padding="max_length", truncation=True)
-
-    # Create the Dataset object
-    train_dataset = ATCO2Dataset_seqcla(X_train_tokenized, train_spk_id)
-    val_dataset = ATCO2Dataset_seqcla(X_val_tokenized, val_spk_id)
+        train_dataset, val_dataset, test_dataset, test_spk_id = tokenize_datasets(
+            args, tokenizer
+        )
 
     # reduce the data in the training set in case we want to use less samples
     if args.max_train_samples is not None and args.max_train_samples != -1:
@@ -232,16 +375,15 @@ def main():
         indices = torch.arange(max_train_samples)
         train_dataset = torch.utils.data.Subset(train_dataset, indices)
 
-    # either, prepare the test set passed or use validation as 'final' test set
-    if args.test_data is not None:
-        test_data, test_spk_id, test_tags = load_data_from_text_file(args.test_data)
-        X_test_tokenized = tokenizer(test_data, padding="max_length", truncation=True)
-        test_dataset = ATCO2Dataset_seqcla(X_test_tokenized, test_spk_id)
+    # Standard DataCollator (the pre-tokenized/dialogue data is not padded)
+    metrics_function = compute_metrics
+    if args.context_turns > 0:
+        data_collator = DialogueDataCollator(tokenizer, args.context_turns)
+        metrics_function = context_compute_metrics(compute_metrics)
+    elif args.pretokenized is not None:
+        data_collator = DynamicPaddingCollator(tokenizer)
     else:
-        test_dataset, test_spk_id, test_tags = val_dataset, val_spk_id, val_tags
-
-    # Standard DataCollator
-    data_collator = DataCollatorWithPadding(tokenizer, pad_to_multiple_of=8)
+        data_collator = DataCollatorWithPadding(tokenizer, pad_to_multiple_of=8)
 
     # Define TrainingArguments for Trainer object
     args = TrainingArguments(
@@ -269,7 +411,7 @@ def main():
         args=args,
         train_dataset=train_dataset,
         eval_dataset=val_dataset,
-        compute_metrics=compute_metrics,
+        compute_metrics=metrics_function,
         data_collator=data_collator,
     )
 
@@ -293,7 +435,7 @@ def main():
     raw_pred, _, _ = trainer.predict(test_dataset)
 
     # Obtain the results:
-    f_metrics = compute_metrics([raw_pred, np.array(test_spk_id)])
+    f_metrics = metrics_function([raw_pred, np.array(test_spk_id)])
     print(f"Validation set metrics:\n {f_metrics}")
 
     kwargs = {